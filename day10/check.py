@@ -1,11 +1,20 @@
 import os
+import sys
+from pathlib import Path
 from azure.core.credentials import AzureKeyCredential
 from azure.search.documents import SearchClient
-sc = SearchClient(
-    endpoint=os.environ["AZURE_SEARCH_ENDPOINT"].strip(),
-    index_name=os.environ.get("INDEX_NAME","docs-idx"),
-    credential=AzureKeyCredential(os.environ["AZURE_SEARCH_ADMIN_KEY"].strip())
-)
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+from tools.local_search import LocalSearchClient, use_local_backend
+
+if use_local_backend():  # SEARCH_BACKEND=local → ローカル BM25
+    sc = LocalSearchClient()
+else:
+    sc = SearchClient(
+        endpoint=os.environ["AZURE_SEARCH_ENDPOINT"].strip(),
+        index_name=os.environ.get("INDEX_NAME","docs-idx"),
+        credential=AzureKeyCredential(os.environ["AZURE_SEARCH_ADMIN_KEY"].strip())
+    )
 print("document_count =", sc.get_document_count())
 for d in sc.search("*", top=10):
     print(repr(d.get("metadata_storage_name")), (d.get("content","")[:60] or "").replace("\n"," "))
\ No newline at end of file
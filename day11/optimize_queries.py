@@ -3,8 +3,9 @@
 # 仕様: 環境変数でパーサ(SIMPLE/FULL)と検索対象(content/all)を切替可能
 import os
 import re
-import csv
+import sys
 from datetime import datetime
+from pathlib import Path
 
 from dotenv import load_dotenv
 from azure.core.credentials import AzureKeyCredential
@@ -12,11 +13,17 @@ from azure.core.exceptions import HttpResponseError
 from azure.search.documents import SearchClient
 from azure.search.documents.models import QueryType
 
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+from tools.local_search import LocalSearchClient, use_local_backend
+from tools.explog import ExperimentLog, env_format
+
 # ========= 環境変数 =========
 load_dotenv()
-endpoint   = os.environ["AZURE_SEARCH_ENDPOINT"].strip().rstrip("/")
+# SEARCH_BACKEND=local ならネットワーク無しのローカル BM25（tools/local_search.py）で実行
+LOCAL = use_local_backend()
+endpoint   = "local" if LOCAL else os.environ["AZURE_SEARCH_ENDPOINT"].strip().rstrip("/")
 index_name = os.getenv("INDEX_NAME", "docs-idx").strip()
-key        = (os.getenv("AZURE_SEARCH_ADMIN_KEY") or os.getenv("AZURE_SEARCH_QUERY_KEY") or "").strip()
+key        = "local" if LOCAL else (os.getenv("AZURE_SEARCH_ADMIN_KEY") or os.getenv("AZURE_SEARCH_QUERY_KEY") or "").strip()
 if not endpoint or not key or not index_name:
     raise SystemExit("環境変数が不足: AZURE_SEARCH_ENDPOINT / AZURE_SEARCH_ADMIN_KEY(or QUERY_KEY) / INDEX_NAME を確認してください。")
 
@@ -25,9 +32,16 @@ PARSER = os.getenv("SEARCH_PARSER", "simple").lower()   # simple | full
 FIELDS = os.getenv("SEARCH_FIELDS", "content").lower()  # content | all
 DEBUG_TOPK = os.getenv("DEBUG_TOPK", "0") in ("1", "true", "True")
 
+# query_result.csv の列（ファイル自体はヘッダ無し）
+RESULT_SCHEMA = [("ts", "string"), ("parser", "string"), ("fields", "string"),
+                 ("improved", "int64"), ("total", "int64")]
+
 QUERY_TYPE = QueryType.FULL if PARSER == "full" else QueryType.SIMPLE
 
-sc = SearchClient(endpoint=endpoint, index_name=index_name, credential=AzureKeyCredential(key))
+if LOCAL:
+    sc = LocalSearchClient()
+else:
+    sc = SearchClient(endpoint=endpoint, index_name=index_name, credential=AzureKeyCredential(key))
 
 # ========= 同義語辞書 =========
 SYN = {
@@ -164,10 +178,12 @@ def main():
     print(f"\nSummary: improved {improved}/{len(QUERIES)} queries by synonym expansion.")
     print("Tips: SYN 辞書に略語/別表記を追加→再実行で改善率を確認してください。")
 
-    # CSVに記録
-    os.makedirs("day11", exist_ok=True)
-    with open("day11/query_result.csv", "a", newline="", encoding="utf-8") as f:
-        csv.writer(f).writerow([datetime.now().isoformat(timespec="seconds"), PARSER, FIELDS, improved, len(QUERIES)])
+    # CSVに記録（ヘッダ無し。EXPLOG_FORMAT=parquet|arrow なら day11/explog/query_result に列指向で保存）
+    fmt = env_format()
+    path = Path("day11/query_result.csv") if fmt == "csv" else Path("day11/explog/query_result")
+    with ExperimentLog(path, RESULT_SCHEMA, fmt, csv_header=False) as log:
+        log.append({"ts": datetime.now().isoformat(timespec="seconds"), "parser": PARSER,
+                    "fields": FIELDS, "improved": improved, "total": len(QUERIES)})
 
 if __name__ == "__main__":
     main()
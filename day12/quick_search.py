@@ -1,8 +1,12 @@
 ﻿import os
 import sys
+from pathlib import Path
 from azure.core.credentials import AzureKeyCredential
 from azure.search.documents import SearchClient
 
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+from tools.local_search import LocalSearchClient, use_local_backend
+
 def need(name: str) -> str:
     v = os.environ.get(name)
     if not v:
@@ -13,8 +17,10 @@ def need(name: str) -> str:
 print("quick_search.py start")
 
 # === env ===
-ENDP  = need("AZURE_SEARCH_ENDPOINT").rstrip("/")
-ADMIN = need("AZURE_SEARCH_ADMIN_KEY")
+# SEARCH_BACKEND=local ならローカル BM25（tools/local_search.py）を使う
+LOCAL = use_local_backend()
+ENDP  = "local" if LOCAL else need("AZURE_SEARCH_ENDPOINT").rstrip("/")
+ADMIN = "local" if LOCAL else need("AZURE_SEARCH_ADMIN_KEY")
 INDEX = os.environ.get("INDEX_NAME", "docs-idx")
 
 # クエリは引数から。未指定なら Day12Marker を探す
@@ -22,7 +28,10 @@ query = " ".join(sys.argv[1:]) or "Day12Marker"
 print(f"query: {query}")
 
 # === search ===
-client = SearchClient(endpoint=ENDP, index_name=INDEX, credential=AzureKeyCredential(ADMIN))
+if LOCAL:
+    client = LocalSearchClient()
+else:
+    client = SearchClient(endpoint=ENDP, index_name=INDEX, credential=AzureKeyCredential(ADMIN))
 results = client.search(
     query,
     top=5,
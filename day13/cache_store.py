@@ -0,0 +1,136 @@
+# day13/cache_store.py
+# ---------------------------------------------
+# day13_rag_opt.py 用のキー・バリュー型キャッシュ（SQLite バックエンド）
+# - 1キー単位で読み書き（ファイル全体の読込/書き戻しをしない）
+# - WAL モード + busy_timeout で複数プロセスから同時に使っても安全
+# - スレッドごとに接続を持つ（同一プロセス内の並列実行にも対応）
+# - 旧 JSON キャッシュ（search_cache.json / llm_cache.json）を初回だけ取り込み
+# ---------------------------------------------
+
+import json
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, Iterator, Optional, Tuple
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS kv (
+    ns      TEXT NOT NULL,
+    k       TEXT NOT NULL,
+    v       TEXT NOT NULL,
+    updated REAL NOT NULL,
+    PRIMARY KEY (ns, k)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS meta (
+    k TEXT PRIMARY KEY,
+    v TEXT NOT NULL
+);
+"""
+
+
+class CacheStore:
+    """
+    名前空間（ns）付きの永続 KV キャッシュ。値は JSON 化して保存する。
+    get / set はどちらも主キー検索 1 回なのでキャッシュサイズに依存しない。
+    """
+
+    def __init__(self, path: Path, timeout: float = 30.0):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.timeout = timeout
+        self._local = threading.local()
+        with self._conn() as c:
+            c.executescript(_SCHEMA)
+
+    def _conn(self) -> sqlite3.Connection:
+        c = getattr(self._local, "conn", None)
+        if c is None:
+            c = sqlite3.connect(str(self.path), timeout=self.timeout, isolation_level=None)
+            c.execute("PRAGMA journal_mode=WAL")
+            c.execute("PRAGMA synchronous=NORMAL")
+            c.execute(f"PRAGMA busy_timeout={int(self.timeout * 1000)}")
+            self._local.conn = c
+        return c
+
+    def get(self, ns: str, key: str) -> Optional[Any]:
+        row = self._conn().execute(
+            "SELECT v FROM kv WHERE ns=? AND k=?", (ns, key)
+        ).fetchone()
+        if row is None:
+            return None
+        try:
+            return json.loads(row[0])
+        except ValueError:
+            return None
+
+    def get_with_time(self, ns: str, key: str) -> Tuple[Optional[Any], float]:
+        """値と最終更新時刻（epoch 秒）を返す。TTL 判定用。"""
+        row = self._conn().execute(
+            "SELECT v, updated FROM kv WHERE ns=? AND k=?", (ns, key)
+        ).fetchone()
+        if row is None:
+            return None, 0.0
+        try:
+            return json.loads(row[0]), float(row[1])
+        except ValueError:
+            return None, 0.0
+
+    def set(self, ns: str, key: str, value: Any) -> None:
+        self._conn().execute(
+            "INSERT OR REPLACE INTO kv (ns, k, v, updated) VALUES (?, ?, ?, ?)",
+            (ns, key, json.dumps(value, ensure_ascii=False), time.time()),
+        )
+
+    def delete(self, ns: str, key: str) -> None:
+        self._conn().execute("DELETE FROM kv WHERE ns=? AND k=?", (ns, key))
+
+    def items(self, ns: str) -> Iterator[Tuple[str, Any]]:
+        for k, v in self._conn().execute("SELECT k, v FROM kv WHERE ns=?", (ns,)):
+            try:
+                yield k, json.loads(v)
+            except ValueError:
+                continue
+
+    def count(self, ns: str) -> int:
+        return int(self._conn().execute(
+            "SELECT COUNT(*) FROM kv WHERE ns=?", (ns,)
+        ).fetchone()[0])
+
+    def migrate_json(self, ns: str, json_path: Path) -> int:
+        """
+        旧 JSON キャッシュを ns に一括取り込みし、元ファイルは *.migrated にリネーム。
+        取り込み済みなら何もしない（meta テーブルで記録）。戻り値は取り込み件数。
+        """
+        json_path = Path(json_path)
+        marker = f"migrated:{ns}:{json_path.name}"
+        c = self._conn()
+        if c.execute("SELECT 1 FROM meta WHERE k=?", (marker,)).fetchone():
+            return 0
+        if not json_path.exists():
+            return 0
+        try:
+            data: Dict[str, Any] = json.loads(json_path.read_text(encoding="utf-8"))
+        except Exception:
+            data = {}
+        now = time.time()
+        c.execute("BEGIN IMMEDIATE")
+        try:
+            # 他プロセスが先に取り込んでいたらスキップ
+            if c.execute("SELECT 1 FROM meta WHERE k=?", (marker,)).fetchone():
+                c.execute("COMMIT")
+                return 0
+            c.executemany(
+                "INSERT OR IGNORE INTO kv (ns, k, v, updated) VALUES (?, ?, ?, ?)",
+                [(ns, k, json.dumps(v, ensure_ascii=False), now) for k, v in data.items()],
+            )
+            c.execute("INSERT INTO meta (k, v) VALUES (?, ?)", (marker, str(len(data))))
+            c.execute("COMMIT")
+        except Exception:
+            c.execute("ROLLBACK")
+            raise
+        try:
+            json_path.rename(json_path.with_name(json_path.name + ".migrated"))
+        except OSError:
+            pass
+        return len(data)
@@ -0,0 +1,232 @@
+# day13/compare_runs.py
+# ---------------------------------------------------
+# 2 つの実行（ベースライン / 候補）の性能比較と回帰ゲート
+# - 入力は results.csv か列指向ストア（explog/results）。--base-since / --cand-since などで
+#   同じファイルの期間違いも比較できる
+# - 設定（topK / use_semantic / max_chars / ctx_budget / search_mode / llm_mode）ごとに、遅延・トークン数の
+#   代表値（既定 p50）の差とブートストラップ信頼区間（既定 95%）を出す
+# - 遅延はキャッシュヒットを除いた実呼び出しだけで比べる（llm_sec ↔ llm_cache,
+#   search_sec ↔ search_cache。--include-cache で全行）
+# - 悪化率が --threshold を超え、かつ差の信頼区間の下限が 0 より大きい（偶然では説明
+#   できない）指標があれば終了コード 1。比較できた設定・指標が 1 つも無ければ 2（判定不能）
+# - 後から追加された設定列は、古い行の欠損・空を既定値とみなして突き合わせる
+#   （ctx_budget=0、search_mode は use_semantic から、llm_mode は llm_cache / ttft_sec から推定）
+# 使い方:
+#   python compare_runs.py results.csv results.csv --base-until 2025-09-14T20:00 --cand-since 2025-09-14T20:00
+#   python compare_runs.py base.csv explog/results --stat p90 --threshold 0.15 --json cmp.json
+# ---------------------------------------------------
+
+import argparse
+import csv
+import json
+import sys
+from pathlib import Path
+from typing import Any, Dict, List, Tuple
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+from tools.explog import iter_rows
+
+CONFIG_KEYS = ["topK", "use_semantic", "max_chars", "ctx_budget", "search_mode", "llm_mode"]
+METRICS = ["llm_sec", "search_sec", "ttft_sec", "in_tokens", "out_tokens", "est_jpy"]
+GATE_METRICS = ["llm_sec", "search_sec", "in_tokens", "out_tokens"]
+# 遅延指標 → 実呼び出しの判定に使うキャッシュ列
+CACHE_COL = {"llm_sec": "llm_cache", "ttft_sec": "llm_cache", "search_sec": "search_cache"}
+
+Config = Tuple[str, ...]
+
+
+# ========= 読み込み =========
+def _norm(v: Any) -> str:
+    """CSV（文字列）と列指向ストア（型付き）で同じキーになるように揃える。"""
+    if v is None:
+        return ""
+    if isinstance(v, float) and v.is_integer():
+        v = int(v)
+    return str(v)
+
+
+def _to_float(v: Any) -> float | None:
+    try:
+        return float(str(v).strip())
+    except (TypeError, ValueError):
+        return None
+
+
+def _is_cache(v: Any) -> bool:
+    return str(v).lower() in ("1", "true", "yes", "on")
+
+
+# 列が後から追加された設定の既定値（古い行は列が無いか空 → 既定値として突き合わせる）。
+# 関数はその行から推定する（search_mode 以前は Azure AI Search のみ、llm_mode 以前は live / stream のみ）
+CONFIG_DEFAULTS: Dict[str, Any] = {
+    "ctx_budget": "0",
+    "search_mode": lambda r: "semantic" if _is_cache(r.get("use_semantic")) else "keyword",
+    "llm_mode": lambda r: ("cache" if _is_cache(r.get("llm_cache"))
+                           else "stream" if _to_float(r.get("ttft_sec")) is not None else "live"),
+}
+
+
+def _config_value(r: Dict[str, Any], k: str) -> str:
+    v = _norm(r.get(k)).strip()
+    if v:
+        return v
+    d = CONFIG_DEFAULTS.get(k, "")
+    return d(r) if callable(d) else d
+
+
+def load_rows(src: Path, since: str | None, until: str | None) -> List[Dict[str, Any]]:
+    """成功行（error が空）を [since, until) の期間で読む。"""
+    if src.is_dir():
+        filters: List[Tuple[str, str, Any]] = [("error", "==", "")]
+        if since:
+            filters += [("ts", ">=", since), ("date", ">=", since[:10])]
+        if until:
+            filters += [("ts", "<", until), ("date", "<=", until[:10])]
+        return list(iter_rows(src, ["ts"] + CONFIG_KEYS + METRICS + list(set(CACHE_COL.values())), filters))
+    with src.open(encoding="utf-8-sig", newline="") as f:
+        return [r for r in csv.DictReader(f)
+                if not (r.get("error") or "").strip()
+                and (not since or (r.get("ts") or "") >= since)
+                and (not until or (r.get("ts") or "") < until)]
+
+
+def group_values(rows: List[Dict[str, Any]], include_cache: bool = False
+                 ) -> Dict[Config, Dict[str, np.ndarray]]:
+    """設定ごと・指標ごとの値の配列。"""
+    out: Dict[Config, Dict[str, List[float]]] = {}
+    for r in rows:
+        cfg = tuple(_config_value(r, k) for k in CONFIG_KEYS)
+        bucket = out.setdefault(cfg, {})
+        for m in METRICS:
+            if not include_cache and m in CACHE_COL and _is_cache(r.get(CACHE_COL[m])):
+                continue
+            v = _to_float(r.get(m))
+            if v is not None:
+                bucket.setdefault(m, []).append(v)
+    return {cfg: {m: np.asarray(vs, dtype=float) for m, vs in ms.items()} for cfg, ms in out.items()}
+
+
+# ========= 統計 =========
+def _stat_fn(stat: str):
+    if stat == "mean":
+        return lambda a, axis=None: np.mean(a, axis=axis)
+    q = {"p50": 0.5, "p90": 0.9, "p95": 0.95, "p99": 0.99}[stat]
+    return lambda a, axis=None: np.quantile(a, q, axis=axis)
+
+
+def bootstrap_delta(base: np.ndarray, cand: np.ndarray, stat: str = "p50", n_boot: int = 2000,
+                    conf: float = 0.95, seed: int = 0, chunk: int = 256) -> Tuple[float, float, float]:
+    """
+    stat(cand) - stat(base) と、その信頼区間（各群を独立に復元抽出するパーセンタイル法）。
+    メモリを抑えるため chunk 回分ずつまとめて計算する。
+    """
+    fn = _stat_fn(stat)
+    rng = np.random.default_rng(seed)
+    deltas = np.empty(n_boot)
+    for s in range(0, n_boot, chunk):
+        b = min(chunk, n_boot - s)
+        sb = fn(base[rng.integers(0, len(base), size=(b, len(base)))], axis=1)
+        sc = fn(cand[rng.integers(0, len(cand), size=(b, len(cand)))], axis=1)
+        deltas[s:s + b] = sc - sb
+    lo, hi = np.quantile(deltas, [(1 - conf) / 2, 1 - (1 - conf) / 2])
+    return float(fn(cand) - fn(base)), float(lo), float(hi)
+
+
+def compare(base: Dict[Config, Dict[str, np.ndarray]], cand: Dict[Config, Dict[str, np.ndarray]],
+            stat: str, threshold: float, gate_metrics: List[str], n_boot: int, conf: float,
+            min_n: int) -> List[Dict[str, Any]]:
+    fn = _stat_fn(stat)
+    results = []
+    for cfg in sorted(set(base) & set(cand)):
+        for m in METRICS:
+            b, c = base[cfg].get(m), cand[cfg].get(m)
+            if b is None or c is None:
+                continue
+            res: Dict[str, Any] = {"config": dict(zip(CONFIG_KEYS, cfg)), "metric": m,
+                                   "n_base": len(b), "n_cand": len(c)}
+            if len(b) < min_n or len(c) < min_n:
+                res["status"] = "insufficient"
+                results.append(res)
+                continue
+            delta, lo, hi = bootstrap_delta(b, c, stat, n_boot, conf)
+            bv = float(fn(b))
+            rel = delta / bv if bv > 0 else (0.0 if delta == 0 else float("inf"))
+            regressed = m in gate_metrics and rel > threshold and lo > 0
+            res.update({"base": bv, "cand": float(fn(c)), "delta": delta, "rel": rel,
+                        "ci_low": lo, "ci_high": hi,
+                        "status": "REGRESSION" if regressed else ("improved" if hi < 0 else "ok")})
+            results.append(res)
+    return results
+
+
+def _cfg_label(cfg: Dict[str, str]) -> str:
+    return " ".join(f"{k}={v}" for k, v in cfg.items() if v != "")
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser(description="Day13 performance regression gate (baseline vs candidate)")
+    ap.add_argument("base", type=Path, help="ベースライン（results.csv か explog/results）")
+    ap.add_argument("cand", type=Path, help="候補（results.csv か explog/results）")
+    ap.add_argument("--base-since")
+    ap.add_argument("--base-until")
+    ap.add_argument("--cand-since")
+    ap.add_argument("--cand-until")
+    ap.add_argument("--stat", choices=["p50", "p90", "p95", "p99", "mean"], default="p50")
+    ap.add_argument("--threshold", type=float, default=0.10, help="許容する悪化率（0.10 = +10%%）")
+    ap.add_argument("--gate", default=",".join(GATE_METRICS), help="ゲート対象の指標（カンマ区切り）")
+    ap.add_argument("--boot", type=int, default=2000, help="ブートストラップ回数")
+    ap.add_argument("--conf", type=float, default=0.95)
+    ap.add_argument("--min-n", type=int, default=5, help="比較に必要な最小サンプル数（各群）")
+    ap.add_argument("--include-cache", action="store_true", help="遅延にキャッシュヒット行も含める")
+    ap.add_argument("--json", type=Path, help="結果を JSON で保存")
+    args = ap.parse_args()
+
+    for p in (args.base, args.cand):
+        if not p.exists():
+            raise SystemExit(f"[ERROR] not found: {p}")
+    base = group_values(load_rows(args.base, args.base_since, args.base_until), args.include_cache)
+    cand = group_values(load_rows(args.cand, args.cand_since, args.cand_until), args.include_cache)
+    gate = [m.strip() for m in args.gate.split(",") if m.strip()]
+    results = compare(base, cand, args.stat, args.threshold, gate, args.boot, args.conf, args.min_n)
+
+    only = sorted(set(base) ^ set(cand))
+    if only:
+        print(f"[WARN] 片方にしか無い設定は比較対象外: {len(only)} 件")
+    if not results:
+        print("[WARN] 共通する設定がありません。")
+
+    print(f"stat={args.stat} conf={args.conf:.0%} threshold=+{args.threshold:.0%} gate={','.join(gate)}")
+    for r in results:
+        head = f"{_cfg_label(r['config']):<48} {r['metric']:<11} n={r['n_base']}/{r['n_cand']}"
+        if r["status"] == "insufficient":
+            print(f"{head}  (insufficient samples)")
+            continue
+        print(f"{head}  {r['base']:.4f} -> {r['cand']:.4f}  Δ={r['delta']:+.4f} ({r['rel']:+.1%})  "
+              f"CI[{r['ci_low']:+.4f}, {r['ci_high']:+.4f}]  {r['status']}")
+
+    regressions = [r for r in results if r["status"] == "REGRESSION"]
+    compared = [r for r in results if r["status"] != "insufficient"]
+    if args.json:
+        # rel はベースが 0 のとき inf になる。JSON には null で書く
+        rows = [{k: (None if isinstance(v, float) and not np.isfinite(v) else v) for k, v in r.items()}
+                for r in results]
+        args.json.write_text(json.dumps({
+            "stat": args.stat, "conf": args.conf, "threshold": args.threshold, "gate": gate,
+            "results": rows, "regressions": len(regressions),
+            "status": "fail" if regressions else ("ok" if compared else "inconclusive"),
+        }, ensure_ascii=False, indent=2, allow_nan=False), encoding="utf-8")
+    if regressions:
+        print(f"\n[FAIL] {len(regressions)} regression(s) over +{args.threshold:.0%}")
+        return 1
+    if not compared:
+        # 何も比べられなかったのに OK にはしない（設定の食い違い・期間指定の誤りなど）
+        print("\n[INCONCLUSIVE] 比較できた設定・指標がありません")
+        return 2
+    print("\n[OK] no regression")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
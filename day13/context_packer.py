@@ -0,0 +1,156 @@
+# day13/context_packer.py
+# ---------------------------------------------
+# トークン予算ベースの文脈パッキング（MAX_CHARS の文字数切り詰めの代替）
+# - トークナイザ: tiktoken（o200k_base / TIKTOKEN_CACHE_DIR のローカル語彙）があれば使用、
+#   無ければ ASCII 4文字≒1token・日本語1文字≒1token の近似
+# - 検索結果の関連度順に、クエリ語を含む文＋前後1文を抜き出して予算まで詰める
+# - 既に詰めたチャンクとほぼ同じ内容（文字3-gram の Jaccard が閾値以上）は捨てる
+# ---------------------------------------------
+
+import os
+import re
+from dataclasses import dataclass
+from typing import Callable, List, Optional, Set
+
+_SENT_SPLIT = re.compile(r"(?<=[。！？!?])|(?<=\.)\s+|\n+")
+_ASCII_WORD = re.compile(r"[A-Za-z0-9][A-Za-z0-9_\-]+")
+_CJK_RUN = re.compile(r"[一-龠々ァ-ヴー]{2,}")
+
+
+# ========= トークナイザ =========
+def _approx_tokens(text: str) -> int:
+    ascii_n = sum(1 for ch in text if ord(ch) < 128)
+    return (ascii_n + 3) // 4 + (len(text) - ascii_n)
+
+
+def _load_encoder() -> Optional[Callable[[str], List[int]]]:
+    if os.getenv("CTX_TOKENIZER", "tiktoken") != "tiktoken":
+        return None
+    try:
+        import tiktoken
+        enc = tiktoken.get_encoding(os.getenv("CTX_ENCODING", "o200k_base"))
+        return enc.encode
+    except Exception:
+        # 未インストール / 語彙をダウンロードできない環境では近似にフォールバック
+        return None
+
+
+_encode = _load_encoder()
+
+
+def count_tokens(text: str) -> int:
+    if not text:
+        return 0
+    if _encode is not None:
+        return len(_encode(text))
+    return _approx_tokens(text)
+
+
+def tokenizer_name() -> str:
+    return "tiktoken" if _encode is not None else "approx"
+
+
+# ========= 前処理 =========
+def query_terms(query: str) -> Set[str]:
+    """クエリからマッチ用の語を作る（英数字語＋漢字/カタカナ連続の2-gram）。"""
+    terms = {w.lower() for w in _ASCII_WORD.findall(query)}
+    for run in _CJK_RUN.findall(query):
+        terms.update(run[i:i + 2] for i in range(len(run) - 1))
+    return terms
+
+
+def split_sentences(text: str) -> List[str]:
+    return [s.strip() for s in _SENT_SPLIT.split(text) if s and s.strip()]
+
+
+def _shingles(text: str, n: int = 3) -> Set[str]:
+    t = re.sub(r"\s+", "", text)
+    if len(t) <= n:
+        return {t} if t else set()
+    return {t[i:i + n] for i in range(len(t) - n + 1)}
+
+
+def _jaccard(a: Set[str], b: Set[str]) -> float:
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+def extract(doc: str, terms: Set[str], window: int = 1) -> str:
+    """クエリ語を含む文とその前後 window 文を原文順で連結。ヒットが無ければ文書全体。"""
+    sents = split_sentences(doc)
+    if not sents or not terms:
+        return doc.strip()
+    lowered = [s.lower() for s in sents]
+    hits = [i for i, s in enumerate(lowered) if any(t in s for t in terms)]
+    if not hits:
+        return doc.strip()
+    keep = sorted({j for i in hits for j in range(max(0, i - window), min(len(sents), i + window + 1))})
+    return "\n".join(sents[i] for i in keep)
+
+
+def _fit(text: str, budget: int) -> str:
+    """文単位で予算に収まるところまで残す（1文目すら入らなければ文字で切る）。"""
+    out: List[str] = []
+    used = 0
+    for s in split_sentences(text):
+        n = count_tokens(s) + 1
+        if used + n > budget:
+            break
+        out.append(s)
+        used += n
+    if out:
+        return "\n".join(out)
+    lo, hi = 0, len(text)
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if count_tokens(text[:mid]) <= budget:
+            lo = mid
+        else:
+            hi = mid - 1
+    return text[:lo]
+
+
+# ========= パッキング本体 =========
+@dataclass
+class Packed:
+    text: str
+    tokens: int
+    used_docs: int
+    dropped_dupes: int
+
+
+def pack(query: str, docs: List[str], budget: int,
+         window: int = 1, dedup_threshold: float = 0.8,
+         sep: str = "\n\n") -> Packed:
+    """
+    docs は関連度順（検索結果順）で渡す。budget はトークン数。
+    """
+    terms = query_terms(query)
+    sep_tokens = count_tokens(sep)
+    chunks: List[str] = []
+    seen: List[Set[str]] = []
+    used = 0
+    dupes = 0
+    for doc in docs:
+        remain = budget - used - (sep_tokens if chunks else 0)
+        if remain <= 0:
+            break
+        chunk = extract(doc, terms, window)
+        if not chunk:
+            continue
+        sh = _shingles(chunk)
+        if any(_jaccard(sh, prev) >= dedup_threshold for prev in seen):
+            dupes += 1
+            continue
+        n = count_tokens(chunk)
+        if n > remain:
+            chunk = _fit(chunk, remain)
+            if not chunk:
+                break
+            n = count_tokens(chunk)
+        chunks.append(chunk)
+        seen.append(sh)
+        used += n + (sep_tokens if len(chunks) > 1 else 0)
+    text = sep.join(chunks)
+    return Packed(text=text, tokens=count_tokens(text), used_docs=len(chunks), dropped_dupes=dupes)
@@ -4,12 +4,23 @@
 # - 親フォルダ(プロジェクト直下)の .env を自動探索・読込
 # - 互換名を許容（AZURE_* 系 / 旧 AOAI_* 系どちらでも可）
 # - USE_SEMANTIC / MAX_CHARS / TOPK_LIST を環境変数で切替
-# - Semantic未対応サービスへの自動フォールバック（semantic→keyword）
+# - CTX_TOKENS>0 でトークン予算ベースの文脈パッキング（context_packer.py）
+# - --queries file.jsonl でバッチ実行（チェックポイントから再開可能）
+# - CONCURRENCY>1 で (query, topK) ジョブをスレッドプールで並列実行（出力順は固定）
+# - Semantic未対応サービスへの自動フォールバック（判定結果を TTL 付きで保存、実モードを CSV に記録）
 # - 429/503 などに対する指数バックオフ＋ジッタのリトライ
+# - 送信前のトークンバケット制御（AOAI_RPM / AOAI_TPM / SEARCH_RPM, tools/ratelimit.py）
 # - 失敗時も CSV にエラーを記録して継続（打ち切らない）
 # - エンドポイントの https:// / 末尾スラッシュを自動補正
-# - Azure AI Search & Azure OpenAI の最小実行＋簡易キャッシュ
-# - CSV(results.csv) に計測ログを追記
+# - SEARCH_BACKEND=local でローカル BM25 検索（tools/local_search.py）に切替
+# - Azure AI Search & Azure OpenAI の最小実行＋SQLite キャッシュ（cache_store.py）
+# - Search / OpenAI 呼び出しは共有の接続プール経由（HTTP_POOL_SIZE / HTTP2）
+# - STREAM=1 でストリーミング受信し TTFT / トークン間隔(p50/p95) を記録
+# - SEM_CACHE=1 で埋め込み類似度による意味的回答キャッシュ（semantic_cache.py）
+# - --batch-api で LLM 呼び出しを Azure OpenAI Batch API に一括投入（tools/aoai_batch.py）
+# - CSV(results.csv) に計測ログを追記（列追加時は既存ファイルのヘッダを自動更新）
+# - 計測ログ / 回答ログはまとめ書き（tools/explog.py）。EXPLOG_FORMAT=parquet|arrow で
+#   explog/results・explog/answers に日付パーティションの列指向ストアとして保存
 # ---------------------------------------------
 
 import os
@@ -19,12 +30,32 @@ import random
 import hashlib
 import csv
 import datetime
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import Tuple, Dict, Any, List
+from typing import Tuple, Dict, Any, Callable, Hashable, List
 
 import requests
+from requests.adapters import HTTPAdapter
 from dotenv import load_dotenv, find_dotenv
 
+from cache_store import CacheStore
+import context_packer
+from semantic_cache import SemanticCache, HashingEmbedder, FunctionEmbedder
+
+# リポジトリ直下の共有モジュール（tools/）を import 可能にする
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+from tools.ratelimit import shared_limiter, estimate_tokens, env_limits
+from tools.local_search import default_index, use_local_backend
+from tools.aoai_batch import BatchClient, chat_request, run_requests
+from tools.explog import ExperimentLog, env_format
+
+try:  # HTTP/2 は任意（pip install "httpx[http2]"）
+    import httpx
+except ImportError:  # pragma: no cover
+    httpx = None
+
 # ========= ユーティリティ =========
 def _normalize_endpoint(u: str | None) -> str:
     if not u:
@@ -47,20 +78,126 @@ def _require_env(name: str, value: str | None):
 def _truthy(s: Any) -> bool:
     return str(s).lower() in ("1", "true", "yes", "on")
 
+# ========= HTTP クライアント（接続プール / keep-alive） =========
+# 全 Search / OpenAI 呼び出しで 1 つのクライアントを共有し、TLS ハンドシェイクを使い回す。
+# HTTP2=1 かつ httpx[http2] が入っていれば httpx、それ以外は requests.Session。
+_http_lock = threading.Lock()
+_http_client: Any = None
+_http_reqs = 0
+_httpx_conns = 0  # httpx で新しく張った TCP 接続数（trace の connect_tcp.complete で数える）
+
+def _http() -> Any:
+    global _http_client
+    if _http_client is not None:
+        return _http_client
+    with _http_lock:
+        if _http_client is None:
+            if HTTP2 and httpx is not None:
+                try:
+                    limits = httpx.Limits(max_connections=HTTP_POOL_SIZE,
+                                          max_keepalive_connections=HTTP_POOL_SIZE)
+                    _http_client = httpx.Client(http2=True, limits=limits)
+                except ImportError:
+                    print("[WARN] HTTP2=1 ですが h2 が未インストールのため requests を使います。")
+            if _http_client is None:
+                sess = requests.Session()
+                adapter = HTTPAdapter(pool_connections=4, pool_maxsize=HTTP_POOL_SIZE, pool_block=True)
+                sess.mount("https://", adapter)
+                sess.mount("http://", adapter)
+                _http_client = sess
+    return _http_client
+
+def http_stats() -> Dict[str, int]:
+    """
+    プロセス起動からの累積 HTTP リクエスト数と新規接続数。
+    http_conns / http_reqs が小さいほど接続が再利用できている。
+    """
+    c = _http_client
+    conns = 0
+    if isinstance(c, requests.Session):
+        for adapter in set(c.adapters.values()):
+            pools = adapter.poolmanager.pools
+            for key in list(pools.keys()):
+                pool = pools.get(key)
+                if pool is not None:
+                    conns += getattr(pool, "num_connections", 0)
+    elif c is not None:
+        conns = _httpx_conns
+    return {"http_reqs": _http_reqs, "http_conns": conns}
+
+def _httpx_trace(event: str, info: Dict[str, Any]) -> None:
+    # httpcore は新規接続を張るときだけ connect_tcp を通る（再利用時は出ない）
+    global _httpx_conns
+    if event == "connection.connect_tcp.complete":
+        with _http_lock:
+            _httpx_conns += 1
+
+def _post(url: str, headers: Dict[str, str], payload: Dict[str, Any], timeout: float,
+          stream: bool = False) -> Any:
+    """stream=True のときは本文を読まずに返す（呼び出し側で iter_lines → close）。"""
+    global _http_reqs
+    c = _http()
+    is_httpx = httpx is not None and isinstance(c, httpx.Client)
+    if is_httpx:
+        req = c.build_request("POST", url, headers=headers, json=payload, timeout=timeout,
+                              extensions={"trace": _httpx_trace})
+        r = c.send(req, stream=stream)
+    else:
+        r = c.post(url, headers=headers, json=payload, timeout=timeout, stream=stream)
+    with _http_lock:
+        _http_reqs += 1
+    return r
+
+def _drain(r: Any) -> None:
+    """ストリーミング応答をエラー表示用に読み切って閉じる。"""
+    try:
+        if hasattr(r, "read"):
+            r.read()
+        else:
+            r.content
+    except Exception:
+        pass
+    r.close()
+
+# ========= レート制御（tools/ratelimit.py・プロセス内で共有） =========
+LIMITER = shared_limiter()
+_tl = threading.local()  # ジョブ単位の待機時間集計
+
+def _rl_wait_reset() -> None:
+    _tl.rl_wait = 0.0
+
+def _rl_wait() -> float:
+    return getattr(_tl, "rl_wait", 0.0)
+
 def _post_retry(url: str, headers: Dict[str, str], payload: Dict[str, Any],
-                timeout: float, max_retry: int = 5) -> requests.Response:
+                timeout: float, max_retry: int = 5,
+                limit_key: Hashable | None = None, est_tokens: int = 0,
+                stream: bool = False) -> Any:
     """
     429/503 に指数バックオフ＋ジッタでリトライ。その他のHTTPは即raise。
+    limit_key を渡すと送信前にトークンバケットで待機し、応答ヘッダから残量を学習する。
+    戻り値は requests.Response / httpx.Response（どちらも .json() / .headers を持つ）。
+    stream=True の場合は本文未読の応答を返すので、呼び出し側で close すること。
     """
     wait = 1.0
     for _ in range(max_retry):
-        r = requests.post(url, headers=headers, json=payload, timeout=timeout)
+        if limit_key is not None:
+            _tl.rl_wait = _rl_wait() + LIMITER.acquire(limit_key, est_tokens)
+        r = _post(url, headers, payload, timeout, stream=stream)
+        if limit_key is not None:
+            LIMITER.observe(limit_key, r.status_code, r.headers)
         if r.status_code in (429, 503):
-            ra = r.headers.get("retry-after")
-            sleep = float(ra) if ra else wait + random.random()
-            time.sleep(min(sleep, 30))
+            if stream:
+                _drain(r)
+            ra = r.headers.get("retry-after-ms") or r.headers.get("retry-after")
+            if not (ra and limit_key is not None):
+                # retry-after 付きならリミッタ側が次の acquire で待つ
+                sleep = float(r.headers.get("retry-after") or 0) or wait + random.random()
+                time.sleep(min(sleep, 30))
             wait = min(wait * 2, 16)
             continue
+        if stream and r.status_code >= 400:
+            _drain(r)
         r.raise_for_status()
         return r
     # 最後の試行も失敗した場合は詳細付で例外
@@ -120,6 +257,33 @@ try:
 except ValueError:
     MAX_CHARS = 0
 
+# トークン予算での文脈パッキング（0なら従来の MAX_CHARS 切り詰め）
+try:
+    CTX_TOKENS = int(os.getenv("CTX_TOKENS", "0") or "0")
+except ValueError:
+    CTX_TOKENS = 0
+
+# ストリーミング受信（TTFT / トークン間隔を計測）
+STREAM = _truthy(os.getenv("STREAM", "0"))
+
+# 意味的キャッシュ（言い換え質問でも同じ文脈なら既存回答を再利用）
+SEM_CACHE = _truthy(os.getenv("SEM_CACHE", "0"))
+SEM_CACHE_EMBEDDER = (os.getenv("SEM_CACHE_EMBEDDER", "hash") or "hash").lower()  # hash | aoai
+EMBED_DEPLOY = os.getenv("AOAI_EMBED_DEPLOYMENT") or os.getenv("AZURE_OPENAI_EMBED_DEPLOYMENT")
+# 既定の閾値: ハッシュ埋め込みは類似度が低めに出るため 0.75、AOAI 埋め込みは 0.9
+_sem_default = "0.9" if SEM_CACHE_EMBEDDER == "aoai" else "0.75"
+try:
+    SEM_CACHE_THRESHOLD = float(os.getenv("SEM_CACHE_THRESHOLD", _sem_default) or _sem_default)
+except ValueError:
+    SEM_CACHE_THRESHOLD = float(_sem_default)
+
+# HTTP 接続プール（同時接続数の上限 / HTTP2=1 で httpx の HTTP/2 を使用）
+try:
+    HTTP_POOL_SIZE = max(1, int(os.getenv("HTTP_POOL_SIZE", "16") or "16"))
+except ValueError:
+    HTTP_POOL_SIZE = 16
+HTTP2 = _truthy(os.getenv("HTTP2", "0"))
+
 # topK の実験セット（例: "1,3,5" / "3"）
 _topk_env = os.getenv("TOPK_LIST") or os.getenv("TOPK")
 if _topk_env:
@@ -137,28 +301,72 @@ if _topk_env:
 else:
     TOPK_LIST = [1, 3, 5]
 
+# 同時実行数（(query, topK) ジョブの in-flight 上限。1なら従来どおり逐次）
+try:
+    CONCURRENCY = max(1, int(os.getenv("CONCURRENCY", "1") or "1"))
+except ValueError:
+    CONCURRENCY = 1
+
+# Batch API（--batch-api 時）: Global-Batch 型のデプロイ名と、対話料金に対する単価比
+BATCH_DEPLOY = os.getenv("AOAI_BATCH_DEPLOYMENT") or DEPLOY
+try:
+    BATCH_PRICE_RATIO = float(os.getenv("BATCH_PRICE_RATIO", "0.5") or "0.5")
+except ValueError:
+    BATCH_PRICE_RATIO = 0.5
+
 # 必須チェック
 _require_env("AOAI_ENDPOINT", AOAI_EP)
 _require_env("AOAI_KEY", AOAI_KEY)
 _require_env("AOAI_DEPLOYMENT", DEPLOY)
-_require_env("AZ_SEARCH_ENDPOINT", SEARCH_EP)
-_require_env("AZ_SEARCH_KEY", SEARCH_KEY)
-_require_env("AZ_SEARCH_INDEX", INDEX)
+# SEARCH_BACKEND=local なら Azure AI Search の代わりにローカル BM25（tools/local_search.py）
+LOCAL_SEARCH = use_local_backend()
+if LOCAL_SEARCH:
+    SEARCH_EP = "local"
+    INDEX = INDEX or "local-md"
+else:
+    _require_env("AZ_SEARCH_ENDPOINT", SEARCH_EP)
+    _require_env("AZ_SEARCH_KEY", SEARCH_KEY)
+    _require_env("AZ_SEARCH_INDEX", INDEX)
+
+# レート制御のキー（エンドポイント＋デプロイ／インデックス単位）
+AOAI_LIMIT_KEY = ("aoai", AOAI_EP, DEPLOY)
+SEARCH_LIMIT_KEY = ("search", SEARCH_EP, INDEX)
+LIMITER.configure(AOAI_LIMIT_KEY, *env_limits("AOAI", os.environ))      # AOAI_RPM / AOAI_TPM
+LIMITER.configure(SEARCH_LIMIT_KEY, *env_limits("SEARCH", os.environ))  # SEARCH_RPM
+
+# Semantic 対応可否の判定結果の有効期間（秒）
+try:
+    SEMANTIC_CAP_TTL = float(os.getenv("SEMANTIC_CAP_TTL_SEC", "86400") or "86400")
+except ValueError:
+    SEMANTIC_CAP_TTL = 86400.0
+SEMANTIC_CAP_KEY = f"{SEARCH_EP}|{INDEX}"
 
 # ========= キャッシュ =========
+# SQLite の KV ストア（cache/cache.sqlite3）。旧 JSON キャッシュは初回のみ自動移行。
 CACHE_DIR = Path(__file__).with_name("cache")
 CACHE_DIR.mkdir(exist_ok=True)
-SCACHE = CACHE_DIR / "search_cache.json"
-LCACHE = CACHE_DIR / "llm_cache.json"
-
-def _load_json(p: Path) -> Dict[str, Any]:
-    try:
-        return json.loads(p.read_text(encoding="utf-8"))
-    except Exception:
-        return {}
-
-def _save_json(p: Path, data: Dict[str, Any]) -> None:
-    p.write_text(json.dumps(data, ensure_ascii=False, indent=2), encoding="utf-8")
+SCACHE = CACHE_DIR / "search_cache.json"  # 旧形式（移行元）
+LCACHE = CACHE_DIR / "llm_cache.json"     # 旧形式（移行元）
+CACHE = CacheStore(CACHE_DIR / "cache.sqlite3")
+CACHE.migrate_json("search", SCACHE)
+CACHE.migrate_json("llm", LCACHE)
+
+def _aoai_embed(text: str) -> List[float]:
+    url = f"{AOAI_EP}/openai/deployments/{EMBED_DEPLOY}/embeddings?api-version={AOAI_API_VERSION}"
+    headers = {"api-key": AOAI_KEY, "Content-Type": "application/json"}
+    est = estimate_tokens([{"content": text}])
+    r = _post_retry(url, headers, {"input": text}, timeout=30,
+                    limit_key=("aoai", AOAI_EP, EMBED_DEPLOY), est_tokens=est)
+    return r.json()["data"][0]["embedding"]
+
+SEMCACHE: SemanticCache | None = None
+if SEM_CACHE:
+    if SEM_CACHE_EMBEDDER == "aoai":
+        _require_env("AOAI_EMBED_DEPLOYMENT", EMBED_DEPLOY)
+        _embedder: Any = FunctionEmbedder(f"aoai-{EMBED_DEPLOY}", _aoai_embed)
+    else:
+        _embedder = HashingEmbedder()
+    SEMCACHE = SemanticCache(CACHE, _embedder, SEM_CACHE_THRESHOLD)
 
 # ========= Azure AI Search =========
 def _extract_doc_text(doc: Dict[str, Any]) -> str:
@@ -177,60 +385,157 @@ def _extract_doc_text(doc: Dict[str, Any]) -> str:
                 return v
     return json.dumps(doc, ensure_ascii=False)
 
-def search(query: str, top_k: int = 3) -> Tuple[List[str], bool]:
-    cache_key = f"{INDEX}|{query}|k={top_k}|semantic={int(USE_SEMANTIC)}"
-    cache = _load_json(SCACHE)
-    if cache_key in cache:
-        return cache[cache_key], True
+# Semantic 対応可否は (エンドポイント, インデックス) ごとに一度だけ判定し、TTL 付きで保存
+_cap_lock = threading.Lock()
 
-    base = SEARCH_EP.rstrip("/")
-    url = f"{base}/indexes/{INDEX}/docs/search?api-version=2023-11-01"
-    payload: Dict[str, Any] = {"search": query, "top": top_k}
-    if USE_SEMANTIC:
-        payload.update({
-            "queryType": "semantic",
-            "semanticConfiguration": "default"
-        })
+def _is_semantic_unavailable(e: Exception) -> bool:
+    txt = ""
+    try:
+        txt = e.response.text  # type: ignore
+    except Exception:
+        pass
+    return ("Semantic search is not enabled" in txt) or ("SemanticQueriesNotAvailable" in txt)
+
+def _semantic_capability() -> bool | None:
+    """保存済みの判定結果（TTL 切れ・未判定なら None）。"""
+    if LOCAL_SEARCH:
+        return False  # ローカル BM25 は semantic ランカー無し
+    v, updated = CACHE.get_with_time("caps", SEMANTIC_CAP_KEY)
+    if v is None or time.time() - updated > SEMANTIC_CAP_TTL:
+        return None
+    return bool(v.get("semantic"))
 
+def _search_request(payload: Dict[str, Any]) -> Dict[str, Any]:
+    if LOCAL_SEARCH:
+        return default_index().search_rest(payload)
+    url = f"{SEARCH_EP.rstrip('/')}/indexes/{INDEX}/docs/search?api-version=2023-11-01"
     headers = {"api-key": SEARCH_KEY, "Content-Type": "application/json"}
+    r = _post_retry(url, headers, payload, timeout=20, limit_key=SEARCH_LIMIT_KEY)
+    return r.json()
 
-    # まずは（必要なら）semanticで試行 → Semantic未対応ならキーワードに自動フォールバック
-    try:
-        r = _post_retry(url, headers, payload, timeout=20)
-    except requests.exceptions.HTTPError as e:
-        txt = ""
-        try:
-            txt = e.response.text  # type: ignore
-        except Exception:
-            pass
-        if ("Semantic search is not enabled" in txt) or ("SemanticQueriesNotAvailable" in txt):
-            # フォールバック：semanticパラメータを外して再送
-            payload.pop("queryType", None)
-            payload.pop("semanticConfiguration", None)
-            r = _post_retry(url, headers, payload, timeout=20)
-        else:
-            raise
-    except Exception:
-        # _post_retry からのRuntimeErrorなどもそのまま上位へ
-        raise
+def search(query: str, top_k: int = 3) -> Tuple[List[str], bool, str]:
+    """戻り値: (本文リスト, キャッシュヒット, 実際に使われたモード "semantic"/"keyword")"""
+    mode = "keyword"
+    if USE_SEMANTIC:
+        mode = "keyword" if _semantic_capability() is False else "semantic"
+    if LOCAL_SEARCH:
+        # ローカル検索は十分速いのでキャッシュしない（検索性能の計測を優先）
+        j = _search_request({"search": query, "top": top_k})
+        return [_extract_doc_text(item) for item in j.get("value", [])], False, "local"
+
+    cache_key = f"{INDEX}|{query}|k={top_k}|semantic={int(mode == 'semantic')}"
+    cached = CACHE.get("search", cache_key)
+    if cached is not None:
+        return cached, True, mode
+
+    payload: Dict[str, Any] = {"search": query, "top": top_k}
+    semantic = {"queryType": "semantic", "semanticConfiguration": "default"}
+
+    j: Dict[str, Any] | None = None
+    if mode == "semantic":
+        cap = _semantic_capability()
+        if cap is None:
+            # 未判定: 最初の1件を判定リクエストとして使う（並列ジョブは結果を待つ）
+            with _cap_lock:
+                cap = _semantic_capability()
+                if cap is None:
+                    try:
+                        j = _search_request({**payload, **semantic})
+                        cap = True
+                    except Exception as e:
+                        if not _is_semantic_unavailable(e):
+                            raise
+                        cap = False
+                    CACHE.set("caps", SEMANTIC_CAP_KEY, {"semantic": cap})
+        if cap is False:
+            mode = "keyword"
+            cache_key = f"{INDEX}|{query}|k={top_k}|semantic=0"
+        elif j is None:
+            try:
+                j = _search_request({**payload, **semantic})
+            except Exception as e:
+                if not _is_semantic_unavailable(e):
+                    raise
+                # TTL 内に無効化された場合: 判定を更新してキーワードへ
+                CACHE.set("caps", SEMANTIC_CAP_KEY, {"semantic": False})
+                mode = "keyword"
+                cache_key = f"{INDEX}|{query}|k={top_k}|semantic=0"
+    if j is None:
+        j = _search_request(payload)
 
-    j = r.json()
     items = j.get("value", [])
     docs = [_extract_doc_text(item) for item in items]
-    cache[cache_key] = docs
-    _save_json(SCACHE, cache)
-    return docs, False
+    CACHE.set("search", cache_key, docs)
+    return docs, False, mode
 
 # ========= Azure OpenAI (Chat Completions) =========
-def chat(query: str, context: str) -> Tuple[Dict[str, Any], bool]:
-    key_src = f"{DEPLOY}\n{query}\n{hashlib.sha256(context.encode('utf-8')).hexdigest()}"
+def _percentile(xs: List[float], p: float) -> float | None:
+    if not xs:
+        return None
+    xs = sorted(xs)
+    i = min(len(xs) - 1, max(0, int(round(p / 100.0 * (len(xs) - 1)))))
+    return xs[i]
+
+def _iter_sse(r: Any) -> Any:
+    """SSE の data: 行を JSON として順に返す（[DONE] で終了）。"""
+    for line in r.iter_lines():
+        if isinstance(line, bytes):
+            line = line.decode("utf-8")
+        if not line.startswith("data:"):
+            continue
+        data = line[5:].strip()
+        if data == "[DONE]":
+            break
+        if data:
+            yield json.loads(data)
+
+def _chat_stream(url: str, headers: Dict[str, str], body: Dict[str, Any], est: int,
+                 on_delta: Callable[[str], None] | None) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    body = {**body, "stream": True, "stream_options": {"include_usage": True}}
+    t0 = time.perf_counter()
+    r = _post_retry(url, headers, body, timeout=60, limit_key=AOAI_LIMIT_KEY,
+                    est_tokens=est, stream=True)
+    chunks: List[str] = []
+    usage: Dict[str, Any] = {}
+    ttft: float | None = None
+    gaps: List[float] = []
+    last = 0.0
+    try:
+        for ev in _iter_sse(r):
+            if ev.get("usage"):
+                usage = ev["usage"]
+            for ch in ev.get("choices") or []:
+                delta = (ch.get("delta") or {}).get("content")
+                if not delta:
+                    continue
+                now = time.perf_counter()
+                if ttft is None:
+                    ttft = now - t0
+                else:
+                    gaps.append((now - last) * 1000.0)
+                last = now
+                chunks.append(delta)
+                if on_delta:
+                    on_delta(delta)
+    finally:
+        r.close()
+    timing = {
+        "ttft_sec": round(ttft, 3) if ttft is not None else None,
+        "itl_p50_ms": _percentile(gaps, 50),
+        "itl_p95_ms": _percentile(gaps, 95),
+    }
+    return {"content": "".join(chunks), "usage": usage, "chunks": chunks}, timing
+
+def _llm_keys(query: str, context: str) -> Tuple[str, str]:
+    """完全一致キャッシュのキーと、意味的キャッシュの partition（同じ文脈の回答同士）。"""
+    ctx_hash = hashlib.sha256(context.encode('utf-8')).hexdigest()
+    key_src = f"{DEPLOY}\n{query}\n{ctx_hash}"
     cache_key = hashlib.sha256(key_src.encode("utf-8")).hexdigest()
-    cache = _load_json(LCACHE)
-    if cache_key in cache:
-        return cache[cache_key], True
+    partition = hashlib.sha256(f"{DEPLOY}\n{ctx_hash}".encode("utf-8")).hexdigest()[:32]
+    return cache_key, partition
 
-    url = f"{AOAI_EP}/openai/deployments/{DEPLOY}/chat/completions?api-version={AOAI_API_VERSION}"
-    body = {
+def _chat_body(query: str, context: str) -> Dict[str, Any]:
+    return {
         "messages": [
             {"role": "system", "content": "Use ONLY the provided context. If context is missing, say so briefly."},
             {"role": "user", "content": f"# Query\n{query}\n\n# Context\n{context}"},
@@ -238,16 +543,50 @@ def chat(query: str, context: str) -> Tuple[Dict[str, Any], bool]:
         "temperature": 0.2,
         "max_tokens": 400,
     }
+
+def chat(query: str, context: str,
+         on_delta: Callable[[str], None] | None = None) -> Tuple[Dict[str, Any], bool]:
+    """
+    STREAM=1 ならストリーミングで受信し、result["timing"] に TTFT / トークン間隔を入れる。
+    キャッシュには受信したチャンク列も保存し、ヒット時は on_delta にそのまま再生する。
+    SEM_CACHE=1 なら完全一致キャッシュのミス時に、同じ文脈での類似質問の回答を探す
+    （result["semcache"] に hit/miss と類似度）。
+    """
+    cache_key, partition = _llm_keys(query, context)
+    cached = CACHE.get("llm", cache_key)
+    semcache: Dict[str, Any] = {}
+    if cached is None and SEMCACHE is not None:
+        cached, sim = SEMCACHE.lookup(partition, query)
+        semcache = {"status": "hit" if cached is not None else "miss", "sim": round(sim, 4)}
+    if cached is not None:
+        if on_delta:
+            for delta in cached.get("chunks") or [cached.get("content") or ""]:
+                on_delta(delta)
+        return {**cached, "semcache": semcache}, True
+
+    url = f"{AOAI_EP}/openai/deployments/{DEPLOY}/chat/completions?api-version={AOAI_API_VERSION}"
+    body = _chat_body(query, context)
     headers = {"api-key": AOAI_KEY, "Content-Type": "application/json"}
 
-    r = _post_retry(url, headers, body, timeout=60)
-    data = r.json()
-    content = data.get("choices", [{}])[0].get("message", {}).get("content", "")
-    usage = data.get("usage", {})
-    result = {"content": content, "usage": usage}
-    cache[cache_key] = result
-    _save_json(LCACHE, cache)
-    return result, False
+    est = estimate_tokens(body["messages"], body["max_tokens"])
+    timing: Dict[str, Any] = {}
+    if STREAM:
+        result, timing = _chat_stream(url, headers, body, est, on_delta)
+        usage = result["usage"]
+    else:
+        r = _post_retry(url, headers, body, timeout=60, limit_key=AOAI_LIMIT_KEY, est_tokens=est)
+        data = r.json()
+        content = data.get("choices", [{}])[0].get("message", {}).get("content", "")
+        usage = data.get("usage", {})
+        result = {"content": content, "usage": usage}
+        if on_delta:
+            on_delta(content)
+    if usage.get("total_tokens"):
+        LIMITER.settle(AOAI_LIMIT_KEY, est, usage["total_tokens"])
+    CACHE.set("llm", cache_key, result)
+    if SEMCACHE is not None:
+        SEMCACHE.add(partition, query, result)
+    return {**result, "timing": timing, "semcache": semcache}, False
 
 # ========= 実行ルーチン =========
 CSV_FIELDS = [
@@ -256,112 +595,415 @@ CSV_FIELDS = [
     "search_sec", "llm_sec",
     "in_tokens", "out_tokens", "est_jpy",
     "error",
+    "http_reqs", "http_conns", "rl_wait_sec",
+    "search_mode",
+    "ctx_budget", "ctx_tokens",
+    "ttft_sec", "itl_p50_ms", "itl_p95_ms",
+    "sem_cache", "sem_sim",
+    "llm_mode",
 ]
+# 列指向ストア用の型（ここに無い列は string）
+CSV_TYPES = {
+    "topK": "int64", "max_chars": "int64", "search_cache": "bool", "llm_cache": "bool",
+    "search_sec": "float64", "llm_sec": "float64",
+    "in_tokens": "int64", "out_tokens": "int64", "est_jpy": "float64",
+    "http_reqs": "int64", "http_conns": "int64", "rl_wait_sec": "float64",
+    "ctx_budget": "int64", "ctx_tokens": "int64",
+    "ttft_sec": "float64", "itl_p50_ms": "float64", "itl_p95_ms": "float64",
+    "sem_sim": "float64",
+}
+RESULTS_SCHEMA = [(k, CSV_TYPES.get(k, "string")) for k in CSV_FIELDS]
+ANSWERS_SCHEMA = [("ts", "string"), ("query", "string"), ("topK", "int64"),
+                  ("use_semantic", "string"), ("max_chars", "int64"), ("answer", "string")]
+
+# 計測ログの出力先（csv: 従来の results.csv / answers.jsonl、parquet / arrow: explog/ 配下）
+EXPLOG_FORMAT = env_format()
+EXPLOG_DIR = Path(__file__).with_name("explog")
+if EXPLOG_FORMAT == "csv":
+    RESULTS_LOG = ExperimentLog(Path(__file__).with_name("results.csv"), RESULTS_SCHEMA, "csv")
+    ANSWERS_LOG = ExperimentLog(Path(__file__).with_name("answers.jsonl"), ANSWERS_SCHEMA, "jsonl")
+else:
+    RESULTS_LOG = ExperimentLog(EXPLOG_DIR / "results", RESULTS_SCHEMA, EXPLOG_FORMAT)
+    ANSWERS_LOG = ExperimentLog(EXPLOG_DIR / "answers", ANSWERS_SCHEMA, EXPLOG_FORMAT)
 
-def _estimate_jpy(usage: Dict[str, Any]) -> float | None:
+def flush_logs() -> None:
+    RESULTS_LOG.flush()
+    ANSWERS_LOG.flush()
+
+def _estimate_jpy(usage: Dict[str, Any], ratio: float = 1.0) -> float | None:
     if not (IN_PRICE or OUT_PRICE):
         return None
     in_t = usage.get("prompt_tokens", 0) or usage.get("total_tokens", 0)
     out_t = usage.get("completion_tokens", 0)
-    return (in_t / 1000.0) * IN_PRICE + (out_t / 1000.0) * OUT_PRICE
+    return ((in_t / 1000.0) * IN_PRICE + (out_t / 1000.0) * OUT_PRICE) * ratio
+
+def _fmt_timing(timing: Dict[str, Any]) -> Dict[str, Any]:
+    """ストリーミング計測値を CSV 用に整形（非ストリーミング・キャッシュ時は空欄）。"""
+    out: Dict[str, Any] = {}
+    for k in ("ttft_sec", "itl_p50_ms", "itl_p95_ms"):
+        v = timing.get(k)
+        out[k] = "" if v is None else round(float(v), 3)
+    return out
+
+_csv_checked = False
+
+def _upgrade_csv_header(logf: Path) -> None:
+    """
+    既存 results.csv のヘッダが CSV_FIELDS と異なる（列追加前のファイル）場合、
+    既存行を新ヘッダに載せ替えて書き直す。プロセス内で 1 回だけ確認する。
+    """
+    global _csv_checked
+    if _csv_checked:
+        return
+    _csv_checked = True
+    if not logf.exists():
+        return
+    with logf.open(encoding="utf-8", newline="") as f:
+        header = next(csv.reader(f), None)
+    if header is None or header == CSV_FIELDS:
+        return
+    with logf.open(encoding="utf-8", newline="") as f:
+        old_rows = list(csv.DictReader(f))
+    tmp = logf.with_suffix(".csv.tmp")
+    with tmp.open("w", newline="", encoding="utf-8") as f:
+        w = csv.DictWriter(f, fieldnames=CSV_FIELDS, extrasaction="ignore")
+        w.writeheader()
+        for r in old_rows:
+            w.writerow({k: r.get(k, "") for k in CSV_FIELDS})
+    tmp.replace(logf)
 
 def _append_csv(row: Dict[str, Any]) -> None:
-    logf = Path(__file__).with_name("results.csv")
-    new = not logf.exists()
-    with logf.open("a", newline="", encoding="utf-8") as f:
-        w = csv.DictWriter(f, fieldnames=CSV_FIELDS)
-        if new:
-            w.writeheader()
-        # 欠損キーを空で埋める
-        for k in CSV_FIELDS:
-            row.setdefault(k, "")
-        w.writerow(row)
-
-def run(query: str = "RAGの最適化ポイントを要約して") -> None:
-    for top_k in TOPK_LIST:
-        try:
-            # Search
-            t0 = time.time()
-            docs, hit_s = search(query, top_k)
-            t1 = time.time()
+    if RESULTS_LOG.fmt == "csv":
+        _upgrade_csv_header(RESULTS_LOG.path)
+    # 欠損キーを空で埋める
+    for k in CSV_FIELDS:
+        row.setdefault(k, "")
+    RESULTS_LOG.append(row)
+
+def _build_context(query: str, docs: List[str]) -> Tuple[str, int]:
+    """検索結果から LLM に渡す文脈を作る（CTX_TOKENS / MAX_CHARS に従う）。"""
+    if CTX_TOKENS > 0:
+        # 関連度順のまま、クエリ語周辺の文をトークン予算まで詰める
+        packed = context_packer.pack(query, docs, CTX_TOKENS)
+        return packed.text or "（検索結果なし）", packed.tokens
+
+    # 結果順の揺れ対策（キャッシュキー安定に寄与・任意）
+    docs = sorted(docs)
+
+    # 文脈圧縮（MAX_CHARS > 0 の場合）
+    if MAX_CHARS > 0:
+        ctx = "\n\n".join(d[:MAX_CHARS] for d in docs) if docs else "（検索結果なし）"
+    else:
+        ctx = "\n\n".join(docs) if docs else "（検索結果なし）"
+    return ctx, context_packer.count_tokens(ctx)
 
-            # 結果順の揺れ対策（キャッシュキー安定に寄与・任意）
-            docs = sorted(docs)
+def _run_one(query: str, top_k: int) -> Tuple[Dict[str, Any], str | None, List[str]]:
+    """
+    1ジョブ (query, topK) を実行し、CSV行・回答本文・表示用ログ行を返す。
+    並列実行時も計測はジョブ内で完結させる（他ジョブの待ち時間を含めない）。
+    """
+    ts = datetime.datetime.now().isoformat(timespec="seconds")
+    base_row: Dict[str, Any] = {
+        "ts": ts,
+        "query": query,
+        "topK": top_k,
+        "use_semantic": "1" if USE_SEMANTIC else "0",
+        "max_chars": MAX_CHARS,
+        "ctx_budget": CTX_TOKENS,
+    }
+    _rl_wait_reset()
+    try:
+        # Search
+        t0 = time.perf_counter()
+        docs, hit_s, mode_s = search(query, top_k)
+        t1 = time.perf_counter()
+        ctx, ctx_tokens = _build_context(query, docs)
+
+        # LLM
+        t2s = time.perf_counter()
+        res, hit_l = chat(query, ctx)
+        t2 = time.perf_counter()
+
+        usage = res.get("usage", {})
+        in_t = usage.get("prompt_tokens", 0)
+        out_t = usage.get("completion_tokens", 0)
+        jpy = _estimate_jpy(usage)
+
+        lines = [f"[topK={top_k}] search: {'cache' if hit_s else 'live'} {t1 - t0:.2f}s, "
+                 f"llm: {'cache' if hit_l else 'live'} {t2 - t2s:.2f}s"]
+        meta = f"tokens in/out={in_t}/{out_t}"
+        if jpy is not None:
+            meta += f", est ¥{jpy:.2f}"
+        lines.append("  " + meta)
+        ans = (res.get("content") or "").strip().replace("\n", " ")
+        lines.append("  answer: " + (ans[:180] + (" ..." if len(ans) > 180 else "")))
+
+        row = dict(base_row)
+        row.update({
+            "search_cache": hit_s,
+            "search_mode": mode_s,
+            "ctx_tokens": ctx_tokens,
+            **_fmt_timing(res.get("timing") or {}),
+            "sem_cache": (res.get("semcache") or {}).get("status", ""),
+            "sem_sim": (res.get("semcache") or {}).get("sim", ""),
+            "llm_cache": hit_l,
+            "llm_mode": "cache" if hit_l else ("stream" if STREAM else "live"),
+            "search_sec": round(t1 - t0, 3),
+            "llm_sec": round(t2 - t2s, 3),
+            "in_tokens": int(in_t or 0),
+            "out_tokens": int(out_t or 0),
+            "est_jpy": round(jpy or 0, 6),
+            "error": "",
+        })
+        row.update(http_stats())
+        row["rl_wait_sec"] = round(_rl_wait(), 3)
+        return row, (res.get("content") or ""), lines
 
-            # 文脈圧縮（MAX_CHARS > 0 の場合）
-            if MAX_CHARS > 0:
-                ctx = "\n\n".join(d[:MAX_CHARS] for d in docs) if docs else "（検索結果なし）"
-            else:
-                ctx = "\n\n".join(docs) if docs else "（検索結果なし）"
-
-            # LLM
-            res, hit_l = chat(query, ctx)
-            t2 = time.time()
-
-            usage = res.get("usage", {})
-            in_t = usage.get("prompt_tokens", 0)
-            out_t = usage.get("completion_tokens", 0)
-            jpy = _estimate_jpy(usage)
-
-            print(f"[topK={top_k}] search: {'cache' if hit_s else 'live'} {t1 - t0:.2f}s, "
-                  f"llm: {'cache' if hit_l else 'live'} {t2 - t1:.2f}s")
-            meta = f"tokens in/out={in_t}/{out_t}"
-            if jpy is not None:
-                meta += f", est ¥{jpy:.2f}"
-            print(" ", meta)
-            ans = (res.get("content") or "").strip().replace("\n", " ")
-            print("  answer:", (ans[:180] + (" ..." if len(ans) > 180 else "")))
-            print()
-
-            _append_csv({
-                "ts": datetime.datetime.now().isoformat(timespec="seconds"),
-                "query": query,
-                "topK": top_k,
-                "use_semantic": "1" if USE_SEMANTIC else "0",
-                "max_chars": MAX_CHARS,
-                "search_cache": hit_s,
-                "llm_cache": hit_l,
-                "search_sec": round(t1 - t0, 3),
-                "llm_sec": round(t2 - t1, 3),
-                "in_tokens": int(in_t or 0),
-                "out_tokens": int(out_t or 0),
-                "est_jpy": round(jpy or 0, 6),
-                "error": "",
-            })
+    except Exception as e:
+        # 失敗しても継続し、CSVに記録
+        msg = str(e)
+        row = dict(base_row)
+        row["error"] = msg[:500]
+        row.update(http_stats())
+        row["rl_wait_sec"] = round(_rl_wait(), 3)
+        return row, None, [f"[WARN] topK={top_k} skipped due to error: {msg}"]
+
+def _append_answer(row: Dict[str, Any], answer: str) -> None:
+    # answers.jsonl に回答本文も保存（Day14の自動採点で使える）
+    ANSWERS_LOG.append({
+        "ts": row["ts"], "query": row["query"], "topK": row["topK"],
+        "use_semantic": row["use_semantic"], "max_chars": row["max_chars"],
+        "answer": answer,
+    })
+
+def run_jobs(jobs: List[Tuple[str, int]], concurrency: int | None = None) -> List[Dict[str, Any]]:
+    """
+    (query, topK) のジョブ群を最大 concurrency 件ずつ並列実行する。
+    出力（標準出力 / results.csv / answers.jsonl）はジョブの投入順に揃える。
+    """
+    n = concurrency or CONCURRENCY
+    pool = ThreadPoolExecutor(max_workers=min(n, len(jobs))) if n > 1 and len(jobs) > 1 else None
+    if pool is None:
+        results = (_run_one(q, k) for q, k in jobs)
+    else:
+        futures = [pool.submit(_run_one, q, k) for q, k in jobs]
+        results = (f.result() for f in futures)
 
+    rows: List[Dict[str, Any]] = []
+    try:
+        for row, answer, lines in results:
+            _emit(row, answer, lines)
+            rows.append(row)
+    finally:
+        if pool is not None:
+            pool.shutdown(wait=True)
+        flush_logs()
+    return rows
+
+def _emit(row: Dict[str, Any], answer: str | None, lines: List[str]) -> None:
+    for line in lines:
+        print(line)
+    print()
+    _append_csv(row)
+    if answer is not None:
+        _append_answer(row, answer)
+
+def run_jobs_batch_api(jobs: List[Tuple[str, int]], poll_sec: float | None = None) -> List[Dict[str, Any]]:
+    """
+    (query, topK) ジョブの検索・文脈作成までを実行し、キャッシュに無い LLM 呼び出しを
+    Batch API の 1 ジョブにまとめて投入する。完了後に custom_id（LLM キャッシュキー）で
+    突き合わせて CSV / answers.jsonl に書き出し、LLM キャッシュにも保存する。
+    llm_sec はリクエスト単位の値が無いので空欄、est_jpy は BATCH_PRICE_RATIO を掛ける。
+    """
+    def prepare(job: Tuple[str, int]) -> Dict[str, Any]:
+        query, top_k = job
+        _rl_wait_reset()
+        st: Dict[str, Any] = {"row": {
+            "ts": datetime.datetime.now().isoformat(timespec="seconds"),
+            "query": query, "topK": top_k,
+            "use_semantic": "1" if USE_SEMANTIC else "0",
+            "max_chars": MAX_CHARS, "ctx_budget": CTX_TOKENS,
+        }}
+        try:
+            t0 = time.perf_counter()
+            docs, hit_s, mode_s = search(query, top_k)
+            st["row"].update({"search_cache": hit_s, "search_mode": mode_s,
+                              "search_sec": round(time.perf_counter() - t0, 3)})
+            ctx, ctx_tokens = _build_context(query, docs)
+            st["row"]["ctx_tokens"] = ctx_tokens
+            st["key"], st["partition"] = _llm_keys(query, ctx)
+            st["body"] = _chat_body(query, ctx)
+            st["cached"] = CACHE.get("llm", st["key"])
+            if st["cached"] is None and SEMCACHE is not None:
+                st["cached"], sim = SEMCACHE.lookup(st["partition"], query)
+                st["row"].update({"sem_cache": "hit" if st["cached"] is not None else "miss",
+                                  "sem_sim": round(sim, 4)})
         except Exception as e:
-            # 失敗しても継続し、CSVに記録
-            msg = str(e)
-            print(f"[WARN] topK={top_k} skipped due to error: {msg}")
-            _append_csv({
-                "ts": datetime.datetime.now().isoformat(timespec="seconds"),
-                "query": query,
-                "topK": top_k,
-                "use_semantic": "1" if USE_SEMANTIC else "0",
-                "max_chars": MAX_CHARS,
-                "search_cache": "",
-                "llm_cache": "",
-                "search_sec": "",
-                "llm_sec": "",
-                "in_tokens": "",
-                "out_tokens": "",
-                "est_jpy": "",
-                "error": msg[:500],
-            })
+            st["error"] = str(e)
+        st["row"]["rl_wait_sec"] = round(_rl_wait(), 3)
+        return st
+
+    n = min(CONCURRENCY, len(jobs))
+    if n > 1:
+        with ThreadPoolExecutor(max_workers=n) as pool:
+            states = list(pool.map(prepare, jobs))
+    else:
+        states = [prepare(j) for j in jobs]
+
+    # 同じ (query, 文脈) は 1 リクエストにまとめる（custom_id = キャッシュキー）
+    reqs: Dict[str, Dict[str, Any]] = {}
+    for st in states:
+        if "error" not in st and st["cached"] is None and st["key"] not in reqs:
+            b = dict(st["body"])
+            reqs[st["key"]] = chat_request(st["key"], BATCH_DEPLOY, b.pop("messages"), **b)
+    results: Dict[str, Dict[str, Any]] = {}
+    if reqs:
+        results = run_requests(BatchClient(AOAI_EP, AOAI_KEY), list(reqs.values()),
+                               CACHE_DIR / "batch", tag="day13", poll_sec=poll_sec)
+        for key, r in results.items():
+            if r.get("content") is not None and CACHE.get("llm", key) is None:
+                CACHE.set("llm", key, {"content": r["content"], "usage": r["usage"]})
+
+    rows: List[Dict[str, Any]] = []
+    added = set()
+    for st in states:
+        row = st["row"]
+        row.update(http_stats())
+        top_k = row["topK"]
+        if "error" in st:
+            row["error"] = st["error"][:500]
+            _emit(row, None, [f"[WARN] topK={top_k} skipped due to error: {st['error']}"])
+            rows.append(row)
+            continue
+        hit_l = st["cached"] is not None
+        res = st["cached"] if hit_l else results.get(st["key"]) or {}
+        if res.get("content") is None:
+            row["error"] = str(res.get("error") or "no batch result")[:500]
+            row["llm_mode"] = "batch"
+            _emit(row, None, [f"[WARN] topK={top_k} batch request failed: {row['error']}"])
+            rows.append(row)
             continue
+        if not hit_l and SEMCACHE is not None and st["key"] not in added:
+            SEMCACHE.add(st["partition"], row["query"], {"content": res["content"], "usage": res["usage"]})
+            added.add(st["key"])
+        usage = res.get("usage") or {}
+        in_t = usage.get("prompt_tokens", 0)
+        out_t = usage.get("completion_tokens", 0)
+        jpy = _estimate_jpy(usage, 1.0 if hit_l else BATCH_PRICE_RATIO)
+        row.update({
+            "llm_cache": hit_l,
+            "llm_mode": "cache" if hit_l else "batch",
+            "llm_sec": "",
+            "in_tokens": int(in_t or 0),
+            "out_tokens": int(out_t or 0),
+            "est_jpy": round(jpy or 0, 6),
+            "error": "",
+        })
+        ans = (res.get("content") or "").strip().replace("\n", " ")
+        lines = [f"[topK={top_k}] search: {'cache' if row['search_cache'] else 'live'} {row['search_sec']:.2f}s, "
+                 f"llm: {'cache' if hit_l else 'batch'}",
+                 f"  tokens in/out={in_t}/{out_t}" + (f", est ¥{jpy:.2f}" if jpy is not None else ""),
+                 "  answer: " + (ans[:180] + (" ..." if len(ans) > 180 else ""))]
+        _emit(row, res.get("content") or "", lines)
+        rows.append(row)
+    flush_logs()
+    return rows
+
+def run(query: str = "RAGの最適化ポイントを要約して", batch_api: bool = False) -> None:
+    jobs = [(query, top_k) for top_k in TOPK_LIST]
+    if batch_api:
+        run_jobs_batch_api(jobs)
+    else:
+        run_jobs(jobs)
+
+def _parse_query_line(line: str) -> str:
+    """JSONL 1行からクエリ文字列を取り出す（query / question キー、または素の文字列）。"""
+    line = line.strip()
+    if not line:
+        return ""
+    try:
+        item = json.loads(line)
+    except ValueError:
+        return line
+    if isinstance(item, dict):
+        return str(item.get("query") or item.get("question") or "").strip()
+    return str(item).strip()
+
+def run_batch(queries_path: Path, chunk: int = 0, restart: bool = False,
+              batch_api: bool = False) -> None:
+    """
+    クエリファイル（JSONL）を 1 プロセスでストリーム処理する。
+    chunk 件ごとにまとめて run_jobs に渡し、完了したバイト位置を
+    キャッシュDB（ns="batch"）に記録する。中断後の再実行はその位置から再開。
+    batch_api=True なら chunk 件（既定 BATCH_API_CHUNK=1000）ごとに Batch API へ投入する。
+    """
+    queries_path = Path(queries_path).resolve()
+    if not queries_path.exists():
+        raise FileNotFoundError(f"queries file not found: {queries_path}")
+    if batch_api:
+        chunk = chunk or max(1, int(os.getenv("BATCH_API_CHUNK", "1000") or "1000"))
+    else:
+        chunk = chunk or max(1, CONCURRENCY // max(1, len(TOPK_LIST)))
+
+    # 設定が変わったら別ジョブとして最初からやり直す
+    ckpt_key = "|".join([
+        str(queries_path), ",".join(map(str, TOPK_LIST)),
+        f"deploy={BATCH_DEPLOY if batch_api else DEPLOY}", f"batch_api={int(batch_api)}",
+        f"search={'local' if LOCAL_SEARCH else SEARCH_EP}:{INDEX}",
+        f"semantic={int(USE_SEMANTIC)}", f"max_chars={MAX_CHARS}", f"ctx_tokens={CTX_TOKENS}",
+        f"stream={int(STREAM)}",
+        f"sem_cache={SEM_CACHE_EMBEDDER}:{SEM_CACHE_THRESHOLD}" if SEM_CACHE else "sem_cache=0",
+    ])
+    ckpt = None if restart else CACHE.get("batch", ckpt_key)
+    offset = int(ckpt["offset"]) if ckpt else 0
+    done = int(ckpt["done"]) if ckpt else 0
+    if offset:
+        print(f"[batch] resume from query #{done + 1} (offset={offset})")
+
+    t_start = time.perf_counter()
+    n_new = 0
+    with queries_path.open("rb") as f:
+        f.seek(offset)
+        if offset == 0 and f.read(3) != b"\xef\xbb\xbf":  # BOM 付き JSONL 対策
+            f.seek(0)
+        while True:
+            pending: List[str] = []
+            while len(pending) < chunk:
+                raw = f.readline()
+                if not raw:
+                    break
+                q = _parse_query_line(raw.decode("utf-8"))
+                if q:
+                    pending.append(q)
+            if not pending:
+                break
+            jobs = [(q, k) for q in pending for k in TOPK_LIST]
+            if batch_api:
+                run_jobs_batch_api(jobs)
+            else:
+                run_jobs(jobs)
+            done += len(pending)
+            n_new += len(pending)
+            CACHE.set("batch", ckpt_key, {"offset": f.tell(), "done": done})
 
-        # answers.jsonl に回答本文も保存（Day14の自動採点で使える）
-        anslog = Path(__file__).with_name("answers.jsonl")
-        with anslog.open("a", encoding="utf-8") as f:
-            import json
-            f.write(json.dumps({
-                "ts": row["ts"], "query": query, "topK": top_k,
-                "use_semantic": row["use_semantic"], "max_chars": row["max_chars"],
-                "answer": (res.get("content") or "")
-            }, ensure_ascii=False) + "\n")
+    sec = time.perf_counter() - t_start
+    rate = n_new / sec if sec > 0 else 0.0
+    print(f"[batch] finished: {done} queries total, {n_new} this run, {sec:.1f}s ({rate:.2f} q/s)")
 
 # ========= エントリーポイント =========
 if __name__ == "__main__":
-    import sys
-    q = " ".join(sys.argv[1:]).strip() if len(sys.argv) > 1 else ""
-    run(q or "RAGの最適化ポイントを要約して")
+    import argparse
+    ap = argparse.ArgumentParser(description="Day13 RAG optimizer")
+    ap.add_argument("query", nargs="*", help="単発実行するクエリ")
+    ap.add_argument("--queries", type=Path, help="バッチ実行するクエリファイル（JSONL）")
+    ap.add_argument("--chunk", type=int, default=0,
+                    help="同時に投入するクエリ数（既定: CONCURRENCY / len(TOPK_LIST)）")
+    ap.add_argument("--restart", action="store_true", help="チェックポイントを無視して最初から実行")
+    ap.add_argument("--batch-api", action="store_true",
+                    help="LLM 呼び出しを Azure OpenAI Batch API で一括実行（オフライン評価用）")
+    args = ap.parse_args()
+    if args.queries:
+        run_batch(args.queries, chunk=args.chunk, restart=args.restart, batch_api=args.batch_api)
+    else:
+        q = " ".join(args.query).strip()
+        run(q or "RAGの最適化ポイントを要約して", batch_api=args.batch_api)
@@ -0,0 +1,178 @@
+# day13/perf_report.py
+# ---------------------------------------------------
+# 性能レポート（viz_results.py --report から呼ぶ）
+# - 検索 / LLM 遅延の p50 / p90 / p99 を、キャッシュヒットと実呼び出しに分けて集計
+# - topK 別: 行数・失敗率と、実呼び出しだけの LLM 遅延分位点
+# - スループットの推移（分単位の処理件数）をグラフ化
+# - 1 枚の Markdown / HTML レポートと、回帰チェック用の JSON サマリを出力
+# 分位点は stream_agg.py のスケッチによる近似（相対誤差 1% 以内）
+# ---------------------------------------------------
+
+import datetime
+import html
+import json
+import os
+from pathlib import Path
+from typing import Any, Dict, List, Tuple
+
+import matplotlib.pyplot as plt
+
+from stream_agg import RunningStat, StreamAggregator
+
+QUANTILES = (("p50", 0.5), ("p90", 0.9), ("p99", 0.99))
+# 遅延の指標 → 分割に使うキャッシュ次元
+LATENCY = {"search_sec": "search_cache", "llm_sec": "llm_cache", "ttft_sec": "llm_cache"}
+
+
+def _dist(st: RunningStat | None) -> Dict[str, Any] | None:
+    if st is None or not st.count:
+        return None
+    d: Dict[str, Any] = {"count": st.count, "mean": round(st.mean, 4)}
+    for name, q in QUANTILES:
+        d[name] = round(st.quantile(q), 4)
+    d["max"] = round(st.max, 4)
+    return d
+
+
+# ========= サマリ（JSON） =========
+def build_summary(agg: StreamAggregator, source: str) -> Dict[str, Any]:
+    latency: Dict[str, Dict[str, Any]] = {}
+    for metric, dim in LATENCY.items():
+        parts = {"all": _dist(agg.stat("all", "all", metric)),
+                 "live": _dist(agg.stat(dim, "live", metric)),
+                 "cache": _dist(agg.stat(dim, "cache", metric))}
+        parts = {k: v for k, v in parts.items() if v}
+        if parts:
+            latency[metric] = parts
+
+    by_topk: Dict[str, Dict[str, Any]] = {}
+    for k, (rows, errors, rate) in sorted(agg.error_rates("topK").items()):
+        by_topk[str(k)] = {
+            "rows": rows, "errors": errors, "error_rate": round(rate, 4),
+            "llm_sec_live": _dist(agg.stat("topK_llm", f"{k}/live", "llm_sec")),
+            "search_sec": _dist(agg.stat("topK", k, "search_sec")),
+        }
+
+    minutes = sorted(agg.timeline)
+    per_min = [{"minute": m, "rows": agg.timeline[m][0], "errors": agg.timeline[m][1]} for m in minutes]
+    rpm = [x["rows"] for x in per_min]
+    return {
+        "generated_at": datetime.datetime.now().isoformat(timespec="seconds"),
+        "source": source,
+        "rows": agg.rows,
+        "errors": agg.errors,
+        "error_rate": round(agg.errors / agg.rows, 4) if agg.rows else 0.0,
+        "latency": latency,
+        "by_topK": by_topk,
+        "throughput": {
+            "active_minutes": len(rpm),
+            "mean_rows_per_min": round(sum(rpm) / len(rpm), 2) if rpm else 0.0,
+            "peak_rows_per_min": max(rpm) if rpm else 0,
+            "first": minutes[0] if minutes else None,
+            "last": minutes[-1] if minutes else None,
+            "per_minute": per_min,
+        },
+    }
+
+
+def plot_throughput(summary: Dict[str, Any], path: Path) -> bool:
+    per_min = summary["throughput"]["per_minute"]
+    if not per_min:
+        return False
+    xs = list(range(len(per_min)))
+    plt.figure()
+    plt.title("Throughput over time (rows per minute, active minutes only)")
+    plt.xlabel("minute")
+    plt.ylabel("rows / min")
+    plt.plot(xs, [x["rows"] for x in per_min], marker="o")
+    step = max(1, len(xs) // 8)
+    plt.xticks(xs[::step], [x["minute"][5:] for x in per_min][::step], rotation=30, ha="right")
+    plt.tight_layout()
+    plt.savefig(path, dpi=150)
+    plt.close()
+    return True
+
+
+# ========= 表の組み立て（Markdown / HTML 共通） =========
+def _fmt(v: Any) -> str:
+    if v is None:
+        return "-"
+    if isinstance(v, float):
+        return f"{v:.4f}"
+    return str(v)
+
+
+def _tables(summary: Dict[str, Any]) -> List[Tuple[str, List[str], List[List[str]]]]:
+    cols = ["count", "mean", "p50", "p90", "p99", "max"]
+    lat_rows = []
+    for metric, parts in summary["latency"].items():
+        for part, d in parts.items():
+            lat_rows.append([metric, part] + [_fmt(d.get(c)) for c in cols])
+    topk_rows = []
+    for k, d in summary["by_topK"].items():
+        live = d["llm_sec_live"] or {}
+        search = d["search_sec"] or {}
+        topk_rows.append([k, str(d["rows"]), str(d["errors"]), f"{d['error_rate']:.2%}",
+                          _fmt(live.get("p50")), _fmt(live.get("p90")), _fmt(live.get("p99")),
+                          _fmt(search.get("p50")), _fmt(search.get("p99"))])
+    tp = summary["throughput"]
+    tp_rows = [[_fmt(tp["first"]), _fmt(tp["last"]), str(tp["active_minutes"]),
+                _fmt(tp["mean_rows_per_min"]), str(tp["peak_rows_per_min"])]]
+    return [
+        ("Latency percentiles (sec)", ["metric", "calls"] + cols, lat_rows),
+        ("By topK (llm = live calls only)",
+         ["topK", "rows", "errors", "error rate", "llm p50", "llm p90", "llm p99", "search p50", "search p99"],
+         topk_rows),
+        ("Throughput", ["first", "last", "active min", "mean rows/min", "peak rows/min"], tp_rows),
+    ]
+
+
+def render_markdown(summary: Dict[str, Any], images: List[str]) -> str:
+    out = ["# Day13 performance report",
+           "",
+           f"- source: `{summary['source']}`",
+           f"- generated: {summary['generated_at']}",
+           f"- rows: {summary['rows']} (errors={summary['errors']}, {summary['error_rate']:.2%})",
+           ""]
+    for title, header, rows in _tables(summary):
+        out += [f"## {title}", "", "| " + " | ".join(header) + " |",
+                "|" + "---|" * len(header)]
+        out += ["| " + " | ".join(r) + " |" for r in rows]
+        out.append("")
+    for img in images:
+        out += [f"![{Path(img).stem}]({img})", ""]
+    return "\n".join(out)
+
+
+def render_html(summary: Dict[str, Any], images: List[str]) -> str:
+    e = html.escape
+    out = ["<!DOCTYPE html>", "<html><head><meta charset=\"utf-8\"><title>Day13 performance report</title>",
+           "<style>body{font-family:sans-serif} table{border-collapse:collapse} "
+           "td,th{border:1px solid #999;padding:2px 8px;text-align:right}</style></head><body>",
+           "<h1>Day13 performance report</h1>",
+           f"<p>source: <code>{e(summary['source'])}</code><br>generated: {e(summary['generated_at'])}<br>"
+           f"rows: {summary['rows']} (errors={summary['errors']}, {summary['error_rate']:.2%})</p>"]
+    for title, header, rows in _tables(summary):
+        out.append(f"<h2>{e(title)}</h2><table><tr>" + "".join(f"<th>{e(h)}</th>" for h in header) + "</tr>")
+        out += ["<tr>" + "".join(f"<td>{e(c)}</td>" for c in r) + "</tr>" for r in rows]
+        out.append("</table>")
+    out += [f"<p><img src=\"{e(img)}\" alt=\"{e(Path(img).stem)}\"></p>" for img in images]
+    out.append("</body></html>")
+    return "\n".join(out)
+
+
+def write_report(agg: StreamAggregator, source: str, report_dir: Path, img_dir: Path,
+                 fmt: str = "md") -> Tuple[Path, Path]:
+    """レポート（perf_report.md / .html）と perf_summary.json を report_dir に書き出す。"""
+    report_dir.mkdir(parents=True, exist_ok=True)
+    summary = build_summary(agg, source)
+    images = []
+    tp_png = img_dir / "throughput_over_time.png"
+    if plot_throughput(summary, tp_png):
+        images.append(Path(os.path.relpath(tp_png, report_dir)).as_posix())
+    report = report_dir / f"perf_report.{fmt}"
+    text = render_html(summary, images) if fmt == "html" else render_markdown(summary, images)
+    report.write_text(text, encoding="utf-8")
+    json_path = report_dir / "perf_summary.json"
+    json_path.write_text(json.dumps(summary, ensure_ascii=False, indent=2), encoding="utf-8")
+    return report, json_path
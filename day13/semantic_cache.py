@@ -0,0 +1,144 @@
+# day13/semantic_cache.py
+# ---------------------------------------------
+# 意味的キャッシュ（クエリ埋め込みの類似度で回答を再利用）
+# - 完全一致キャッシュ（sha256）の手前ではなく「後ろ」に置き、言い換え質問を拾う
+# - 同じ検索結果（コンテキスト）に対する回答同士だけを比較する（partition 単位）
+# - 埋め込みは差し替え可能:
+#     HashingEmbedder  … 文字 n-gram のハッシュ（オフライン・決定的。テスト/ベンチ用）
+#     FunctionEmbedder … 任意の関数（例: Azure OpenAI embeddings）をラップ
+# - ベクトルは CacheStore（SQLite）に永続化し、partition ごとにメモリ上の索引で近傍探索
+# ---------------------------------------------
+
+import hashlib
+import math
+import threading
+import unicodedata
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+try:
+    import numpy as np
+except ImportError:  # numpy が無ければ純 Python で内積を計算
+    np = None
+
+from cache_store import CacheStore
+
+
+# ========= 埋め込み =========
+def _normalize(vec: List[float]) -> List[float]:
+    n = math.sqrt(sum(v * v for v in vec))
+    return [v / n for v in vec] if n else vec
+
+
+class HashingEmbedder:
+    """文字 2/3-gram を符号付きハッシュで dim 次元に射影する決定的な埋め込み。"""
+
+    def __init__(self, dim: int = 512):
+        self.dim = dim
+        self.name = f"hash{dim}"
+
+    def embed(self, text: str) -> List[float]:
+        t = unicodedata.normalize("NFKC", text).lower()
+        t = "".join(ch for ch in t if not ch.isspace())
+        vec = [0.0] * self.dim
+        for n in (2, 3):
+            for i in range(len(t) - n + 1):
+                h = hashlib.blake2b(t[i:i + n].encode("utf-8"), digest_size=8).digest()
+                idx = int.from_bytes(h[:4], "little") % self.dim
+                vec[idx] += 1.0 if h[4] & 1 else -1.0
+        return _normalize(vec)
+
+
+class FunctionEmbedder:
+    """embed 関数をラップ（戻り値は正規化して使う）。"""
+
+    def __init__(self, name: str, fn: Callable[[str], List[float]]):
+        self.name = name
+        self._fn = fn
+
+    def embed(self, text: str) -> List[float]:
+        return _normalize([float(v) for v in self._fn(text)])
+
+
+# ========= 近傍探索 =========
+class VectorIndex:
+    """
+    正規化済みベクトルの総当たりコサイン類似度索引（partition 内の件数は小さい前提）。
+    add と nearest は索引ごとのロックで直列化する（並列ジョブで行列と payloads の長さがずれないように）。
+    """
+
+    def __init__(self) -> None:
+        self.keys: List[str] = []
+        self.payloads: List[Any] = []
+        self._vecs: List[List[float]] = []
+        self._mat: Any = None
+        self._keyset: set = set()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def add(self, key: str, vec: List[float], payload: Any) -> bool:
+        """追加したら True（同じキーが既にあれば何もしない）。"""
+        with self._lock:
+            if key in self._keyset:
+                return False
+            self._keyset.add(key)
+            self.keys.append(key)
+            self._vecs.append(vec)
+            self.payloads.append(payload)
+            self._mat = None
+            return True
+
+    def nearest(self, vec: List[float]) -> Tuple[float, Optional[Any]]:
+        with self._lock:
+            if not self.keys:
+                return 0.0, None
+            if np is not None:
+                if self._mat is None:
+                    self._mat = np.asarray(self._vecs, dtype=np.float32)
+                sims = self._mat @ np.asarray(vec, dtype=np.float32)
+                i = int(sims.argmax())
+                return float(sims[i]), self.payloads[i]
+            best, best_i = -1.0, 0
+            for i, v in enumerate(self._vecs):
+                s = sum(a * b for a, b in zip(v, vec))
+                if s > best:
+                    best, best_i = s, i
+            return best, self.payloads[best_i]
+
+
+# ========= キャッシュ本体 =========
+class SemanticCache:
+    def __init__(self, store: CacheStore, embedder: Any, threshold: float = 0.9):
+        self.store = store
+        self.embedder = embedder
+        self.threshold = threshold
+        self._lock = threading.Lock()
+        self._indexes: Dict[str, VectorIndex] = {}
+
+    def _ns(self, partition: str) -> str:
+        return f"semcache:{self.embedder.name}:{partition}"
+
+    def _index(self, partition: str) -> VectorIndex:
+        with self._lock:
+            idx = self._indexes.get(partition)
+            if idx is None:
+                idx = VectorIndex()
+                for k, v in self.store.items(self._ns(partition)):
+                    idx.add(k, v["vec"], v["payload"])
+                self._indexes[partition] = idx
+            return idx
+
+    def lookup(self, partition: str, query: str) -> Tuple[Optional[Any], float]:
+        """類似度が閾値以上の既存回答と類似度を返す（無ければ None）。"""
+        idx = self._index(partition)
+        if not len(idx):
+            return None, 0.0
+        sim, payload = idx.nearest(self.embedder.embed(query))
+        return (payload if sim >= self.threshold else None), sim
+
+    def add(self, partition: str, query: str, payload: Any) -> None:
+        vec = self.embedder.embed(query)
+        key = hashlib.sha256(query.encode("utf-8")).hexdigest()
+        self.store.set(self._ns(partition), key, {"query": query, "vec": vec, "payload": payload})
+        self._index(partition).add(key, vec, payload)
@@ -0,0 +1,342 @@
+# day13/stream_agg.py
+# ---------------------------------------------
+# results.csv（追記のみ）のインクリメンタル集計
+# - CSV を前回のバイト位置から読み、新しい行だけを集計に足し込む
+# - バケット（全体 / topK / 圧縮有無 / セマンティック ON/OFF / 検索・LLM キャッシュ有無）× 指標ごとに
+#   件数・合計（平均）・最小・最大と、分位点用のストリーミングスケッチを保持
+# - バケットごとの行数・失敗行数（失敗率）と、分単位の処理件数（スループットの推移）も保持
+# - スケッチは相対誤差 alpha の対数ビン（DDSketch 方式）。マージ可能で JSON に保存できる
+# - 集計状態とバイト位置をチェックポイント（JSON）に保存。ヘッダが変わった（列追加で
+#   書き直された）/ ファイルが縮んだ / 位置直前の内容が違う場合は最初から集計し直す
+# 使い方:
+#   agg = StreamAggregator.open(csv_path, ckpt_path)
+#   n = agg.update()        # 新しい行数
+#   agg.save()
+#   agg.stat("topK", 3, "llm_sec").mean / .quantile(0.95)
+# ---------------------------------------------
+
+import csv
+import json
+import math
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, List, Tuple
+
+# 集計する次元（バケット名, 行 → キー）
+DIMENSIONS: Dict[str, Callable[[Dict[str, str]], Any]] = {}
+# 集計する指標（空欄は欠損として数えない）
+METRICS = ["search_sec", "llm_sec", "ttft_sec", "in_tokens", "out_tokens", "est_jpy"]
+# 集計に使う列（列指向ストアから読むときはこれだけを射影する）
+COLUMNS = ["ts", "topK", "max_chars", "use_semantic", "search_cache", "llm_cache", "error"] + METRICS
+_TAIL = 64  # 再開位置の直前バイト（ファイル書き直しの検出用）
+_VERSION = 2  # チェックポイントの形式（集計項目を増やしたら上げる → 旧形式は集計し直し）
+
+
+def _to_bool(v: Any) -> bool:
+    return str(v).lower() in ("1", "true", "yes", "on")
+
+
+def _to_int(v: Any, default: int = 0) -> int:
+    try:
+        return int(str(v).strip())
+    except Exception:
+        return default
+
+
+def _to_float(v: Any) -> float | None:
+    try:
+        return float(str(v).strip())
+    except Exception:
+        return None
+
+
+DIMENSIONS["all"] = lambda r: "all"
+DIMENSIONS["topK"] = lambda r: _to_int(r.get("topK", 0), 0)
+DIMENSIONS["compress"] = lambda r: "compressed" if _to_int(r.get("max_chars", 0), 0) > 0 else "no-compress"
+DIMENSIONS["semantic"] = lambda r: "semantic-on" if _to_bool(r.get("use_semantic", "0")) else "semantic-off"
+DIMENSIONS["search_cache"] = lambda r: "cache" if _to_bool(r.get("search_cache", "")) else "live"
+DIMENSIONS["llm_cache"] = lambda r: "cache" if _to_bool(r.get("llm_cache", "")) else "live"
+# topK × LLM キャッシュ有無（"3/live" など。topK 別の遅延をキャッシュヒット抜きで見る用）
+DIMENSIONS["topK_llm"] = lambda r: f"{DIMENSIONS['topK'](r)}/{DIMENSIONS['llm_cache'](r)}"
+
+
+# ========= ストリーミング分位点スケッチ =========
+class QuantileSketch:
+    """
+    対数ビンのヒストグラム（DDSketch 方式）。値 x>0 を ceil(log_gamma x) のビンに数え、
+    分位点は相対誤差 alpha 以内で返す。0 以下の値は zero ビンにまとめる。
+    """
+
+    def __init__(self, alpha: float = 0.01):
+        self.alpha = alpha
+        self.gamma = (1 + alpha) / (1 - alpha)
+        self._lg = math.log(self.gamma)
+        self.bins: Dict[int, int] = {}
+        self.zero = 0
+        self.count = 0
+
+    def add(self, x: float) -> None:
+        self.count += 1
+        if x <= 1e-9:
+            self.zero += 1
+            return
+        i = math.ceil(math.log(x) / self._lg)
+        self.bins[i] = self.bins.get(i, 0) + 1
+
+    def merge(self, other: "QuantileSketch") -> None:
+        self.count += other.count
+        self.zero += other.zero
+        for i, c in other.bins.items():
+            self.bins[i] = self.bins.get(i, 0) + c
+
+    def quantile(self, q: float) -> float | None:
+        if not self.count:
+            return None
+        # 順位は切り上げ（少数サンプルの p99 が最大値を取りこぼさないように）
+        rank = math.ceil(q * (self.count - 1))
+        seen = self.zero
+        if rank < seen:
+            return 0.0
+        for i in sorted(self.bins):
+            seen += self.bins[i]
+            if rank < seen:
+                return 2 * self.gamma ** i / (self.gamma + 1)
+        return 2 * self.gamma ** max(self.bins) / (self.gamma + 1)
+
+    def to_json(self) -> Dict[str, Any]:
+        return {"alpha": self.alpha, "zero": self.zero, "count": self.count,
+                "bins": {str(k): v for k, v in self.bins.items()}}
+
+    @classmethod
+    def from_json(cls, d: Dict[str, Any]) -> "QuantileSketch":
+        s = cls(d.get("alpha", 0.01))
+        s.zero = int(d.get("zero", 0))
+        s.count = int(d.get("count", 0))
+        s.bins = {int(k): int(v) for k, v in (d.get("bins") or {}).items()}
+        return s
+
+
+class RunningStat:
+    def __init__(self, alpha: float = 0.01):
+        self.count = 0
+        self.total = 0.0
+        self.min: float | None = None
+        self.max: float | None = None
+        self.sketch = QuantileSketch(alpha)
+
+    def add(self, x: float) -> None:
+        self.count += 1
+        self.total += x
+        self.min = x if self.min is None else min(self.min, x)
+        self.max = x if self.max is None else max(self.max, x)
+        self.sketch.add(x)
+
+    @property
+    def mean(self) -> float | None:
+        return self.total / self.count if self.count else None
+
+    def quantile(self, q: float) -> float | None:
+        v = self.sketch.quantile(q)
+        # ビンの代表値が実測の範囲を超えないようにする
+        return v if v is None else min(max(v, self.min), self.max)
+
+    def to_json(self) -> Dict[str, Any]:
+        return {"count": self.count, "total": self.total, "min": self.min, "max": self.max,
+                "sketch": self.sketch.to_json()}
+
+    @classmethod
+    def from_json(cls, d: Dict[str, Any]) -> "RunningStat":
+        s = cls()
+        s.count = int(d["count"])
+        s.total = float(d["total"])
+        s.min, s.max = d.get("min"), d.get("max")
+        s.sketch = QuantileSketch.from_json(d["sketch"])
+        return s
+
+
+# ========= CSV の追記分だけを読む =========
+def iter_new_rows(csv_path: Path, offset: int, header: List[str] | None
+                  ) -> Iterator[Tuple[List[str], Dict[str, str], int]]:
+    """
+    offset 以降の完結した CSV レコードを (header, row, レコード末尾のバイト位置) で返す。
+    書きかけの最終行（改行で終わっていない）は読まない。クォート内の改行にも対応。
+    """
+    with csv_path.open("rb") as f:
+        f.seek(offset)
+        state = {"pos": offset}
+
+        def lines() -> Iterator[str]:
+            while True:
+                raw = f.readline()
+                if not raw or not raw.endswith(b"\n"):
+                    return
+                text = raw[3:] if state["pos"] == 0 and raw.startswith(b"\xef\xbb\xbf") else raw
+                state["pos"] += len(raw)
+                yield text.decode("utf-8")
+
+        reader = csv.reader(lines())
+        for rec in reader:
+            if header is None:
+                header = rec
+                yield header, {}, state["pos"]
+                continue
+            if not rec:
+                continue
+            yield header, dict(zip(header, rec)), state["pos"]
+
+
+# ========= 集計本体 =========
+class StreamAggregator:
+    def __init__(self, csv_path: Path, ckpt_path: Path, alpha: float = 0.01):
+        self.csv_path = Path(csv_path)
+        self.ckpt_path = Path(ckpt_path)
+        self.alpha = alpha
+        self.offset = 0
+        self.header: List[str] | None = None
+        self.tail = ""
+        self.rows = 0
+        self.errors = 0
+        # stats[(次元, キー)][指標] -> RunningStat
+        self.stats: Dict[Tuple[str, Any], Dict[str, RunningStat]] = {}
+        # counts[(次元, キー)] -> [行数, 失敗行数] / timeline["YYYY-MM-DDTHH:MM"] -> [行数, 失敗行数]
+        self.counts: Dict[Tuple[str, Any], List[int]] = {}
+        self.timeline: Dict[str, List[int]] = {}
+
+    # ----- チェックポイント -----
+    @classmethod
+    def open(cls, csv_path: Path, ckpt_path: Path, rebuild: bool = False) -> "StreamAggregator":
+        agg = cls(csv_path, ckpt_path)
+        if rebuild or not agg.ckpt_path.exists():
+            return agg
+        try:
+            d = json.loads(agg.ckpt_path.read_text(encoding="utf-8"))
+        except ValueError:
+            return agg
+        if d.get("csv") != str(agg.csv_path.resolve()) or d.get("version") != _VERSION:
+            return agg
+        agg.offset = int(d["offset"])
+        agg.header = d.get("header")
+        agg.tail = d.get("tail", "")
+        agg.rows = int(d.get("rows", 0))
+        agg.errors = int(d.get("errors", 0))
+        for item in d.get("stats", []):
+            key = (item["dim"], item["key"])
+            agg.stats[key] = {m: RunningStat.from_json(s) for m, s in item["metrics"].items()}
+        for item in d.get("counts", []):
+            agg.counts[(item["dim"], item["key"])] = [int(item["rows"]), int(item["errors"])]
+        agg.timeline = {k: [int(a), int(b)] for k, (a, b) in d.get("timeline", {}).items()}
+        if not agg._still_valid():
+            print("[agg] results.csv が書き直されたため最初から集計します。")
+            return cls(csv_path, ckpt_path)
+        return agg
+
+    def _read_tail(self, offset: int) -> str:
+        if offset <= 0:
+            return ""
+        with self.csv_path.open("rb") as f:
+            f.seek(max(0, offset - _TAIL))
+            return f.read(min(_TAIL, offset)).hex()
+
+    def _current_header(self) -> List[str] | None:
+        with self.csv_path.open(encoding="utf-8-sig", newline="") as f:
+            return next(csv.reader(f), None)
+
+    def _still_valid(self) -> bool:
+        if not self.csv_path.exists() or self.csv_path.stat().st_size < self.offset:
+            return False
+        if self.header is not None and self._current_header() != self.header:
+            return False
+        return self._read_tail(self.offset) == self.tail
+
+    def save(self) -> None:
+        self.ckpt_path.parent.mkdir(parents=True, exist_ok=True)
+        d = {
+            "version": _VERSION,
+            "csv": str(self.csv_path.resolve()),
+            "offset": self.offset, "header": self.header, "tail": self.tail,
+            "rows": self.rows, "errors": self.errors,
+            "stats": [{"dim": dim, "key": key, "metrics": {m: s.to_json() for m, s in ms.items()}}
+                      for (dim, key), ms in self.stats.items()],
+            "counts": [{"dim": dim, "key": key, "rows": c[0], "errors": c[1]}
+                       for (dim, key), c in self.counts.items()],
+            "timeline": self.timeline,
+        }
+        tmp = self.ckpt_path.with_suffix(".tmp")
+        tmp.write_text(json.dumps(d, ensure_ascii=False), encoding="utf-8")
+        tmp.replace(self.ckpt_path)
+
+    # ----- 更新 -----
+    def add_row(self, r: Dict[str, str]) -> None:
+        self.rows += 1
+        failed = int(bool((r.get("error") or "").strip()))
+        keys = [(dim, fn(r)) for dim, fn in DIMENSIONS.items()]
+        for key in keys:
+            c = self.counts.setdefault(key, [0, 0])
+            c[0] += 1
+            c[1] += failed
+        minute = str(r.get("ts") or "")[:16]
+        if minute:
+            t = self.timeline.setdefault(minute, [0, 0])
+            t[0] += 1
+            t[1] += failed
+        if failed:
+            # 失敗行は件数だけ数え、指標には入れない
+            self.errors += 1
+            return
+        for key in keys:
+            bucket = self.stats.setdefault(key, {})
+            for m in METRICS:
+                v = _to_float(r.get(m, ""))
+                if v is None:
+                    continue
+                st = bucket.get(m)
+                if st is None:
+                    st = bucket[m] = RunningStat(self.alpha)
+                st.add(v)
+
+    def update(self) -> int:
+        """前回位置以降の行を取り込み、取り込んだ行数を返す。"""
+        if not self.csv_path.exists():
+            raise FileNotFoundError(f"CSV not found: {self.csv_path}")
+        n = 0
+        for header, row, pos in iter_new_rows(self.csv_path, self.offset, self.header):
+            self.header = header
+            if row:
+                self.add_row(row)
+                n += 1
+            self.offset = pos
+        self.tail = self._read_tail(self.offset)
+        return n
+
+    # ----- 参照 -----
+    def stat(self, dim: str, key: Any, metric: str) -> RunningStat | None:
+        return self.stats.get((dim, key), {}).get(metric)
+
+    def error_rates(self, dim: str) -> Dict[Any, Tuple[int, int, float]]:
+        """キーごとの (行数, 失敗行数, 失敗率)。"""
+        return {key: (c[0], c[1], c[1] / c[0] if c[0] else 0.0)
+                for (d, key), c in self.counts.items() if d == dim}
+
+    def means(self, dim: str, metric: str) -> Dict[Any, float]:
+        out = {}
+        for (d, key), ms in self.stats.items():
+            st = ms.get(metric)
+            if d == dim and st is not None and st.count:
+                out[key] = st.mean
+        return out
+
+
+if __name__ == "__main__":
+    import argparse
+    ap = argparse.ArgumentParser(description="incremental aggregation of results.csv")
+    ap.add_argument("csv", type=Path, nargs="?", default=Path(__file__).with_name("results.csv"))
+    ap.add_argument("--ckpt", type=Path, default=Path(__file__).with_name("cache") / "viz_agg.json")
+    ap.add_argument("--rebuild", action="store_true")
+    args = ap.parse_args()
+    agg = StreamAggregator.open(args.csv, args.ckpt, rebuild=args.rebuild)
+    print(f"new rows: {agg.update()}  total: {agg.rows} (errors={agg.errors})")
+    agg.save()
+    for (dim, key), ms in sorted(agg.stats.items(), key=lambda kv: (kv[0][0], str(kv[0][1]))):
+        st = ms.get("llm_sec")
+        if st:
+            print(f"{dim}={key}: llm_sec n={st.count} mean={st.mean:.3f} "
+                  f"p50={st.quantile(0.5):.3f} p95={st.quantile(0.95):.3f}")
@@ -4,60 +4,30 @@
 # - グラフ1: topK別 平均LLM遅延（秒）
 # - グラフ2: 圧縮(有/無)別 平均入力トークン数
 # - グラフ3: セマンティック(ON/OFF)別 平均推定コスト(円)
-# 使い方:  python viz_results.py  [CSVパス省略可]
+# - グラフ4: topK別 平均TTFT（秒, STREAM=1 で計測した行のみ）
+# - 集計は stream_agg.py でインクリメンタルに行う（前回以降に追記された行だけを読む。
+#   状態とバイト位置は cache/viz_agg.json に保存）
+# - --store で列指向ストア（EXPLOG_FORMAT=parquet|arrow の explog/results）を読む。
+#   必要な列だけを射影し、成功行・期間（--since）の条件はファイル側で絞り込む
+# 使い方:  python viz_results.py  [CSVパス省略可]  [--rebuild]
+# - --report md|html で性能レポート（遅延 p50/p90/p99・キャッシュ有無別・topK 別失敗率・
+#   スループット推移, perf_report.py）と回帰チェック用の reports/perf_summary.json を出力
+#          python viz_results.py --store explog/results [--since 2025-09-01]
+#          python viz_results.py --report html
 # ---------------------------------------------------
 
+import argparse
 import sys
-import csv
-import statistics
 from pathlib import Path
 from typing import Any, Dict, List
 
 import matplotlib.pyplot as plt
 
+from perf_report import write_report
+from stream_agg import COLUMNS, StreamAggregator
 
-def load_rows(csv_path: Path) -> List[Dict[str, Any]]:
-    if not csv_path.exists():
-        raise FileNotFoundError(f"CSV not found: {csv_path}")
-    with csv_path.open(encoding="utf-8") as f:
-        reader = csv.DictReader(f)
-        rows = list(reader)
-    return rows
-
-
-def to_bool(v: Any) -> bool:
-    return str(v).lower() in ("1", "true", "yes", "on")
-
-
-def to_int(v: Any, default: int = 0) -> int:
-    try:
-        return int(str(v).strip())
-    except Exception:
-        return default
-
-
-def to_float(v: Any, default: float = 0.0) -> float:
-    try:
-        return float(str(v).strip())
-    except Exception:
-        return default
-
-
-def coerce_types(rows: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
-    out = []
-    for r in rows:
-        rr = dict(r)
-        rr["topK"] = to_int(rr.get("topK", 0), 0)
-        rr["search_sec"] = to_float(rr.get("search_sec", 0.0), 0.0)
-        rr["llm_sec"] = to_float(rr.get("llm_sec", 0.0), 0.0)
-        rr["in_tokens"] = to_int(rr.get("in_tokens", 0), 0)
-        rr["out_tokens"] = to_int(rr.get("out_tokens", 0), 0)
-        rr["est_jpy"] = to_float(rr.get("est_jpy", 0.0), 0.0)
-        rr["use_semantic"] = to_bool(rr.get("use_semantic", "0"))
-        rr["max_chars"] = to_int(rr.get("max_chars", 0), 0)
-        rr["error"] = (rr.get("error") or "").strip()
-        out.append(rr)
-    return out
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+from tools.explog import iter_rows
 
 
 def ensure_outdir(root: Path) -> Path:
@@ -66,17 +36,6 @@ def ensure_outdir(root: Path) -> Path:
     return outdir
 
 
-def agg_mean(rows: List[Dict[str, Any]], key_fn, metric: str) -> Dict[Any, float]:
-    buckets: Dict[Any, List[float]] = {}
-    for r in rows:
-        # 数値が有効な行のみ
-        val = r.get(metric, None)
-        if isinstance(val, (int, float)):
-            k = key_fn(r)
-            buckets.setdefault(k, []).append(float(val))
-    return {k: statistics.mean(v) for k, v in buckets.items() if v}
-
-
 def plot_bar(x_labels: List[str], y_values: List[float], title: str, xlabel: str, ylabel: str, path: Path):
     plt.figure()
     plt.title(title)
@@ -88,24 +47,53 @@ def plot_bar(x_labels: List[str], y_values: List[float], title: str, xlabel: str
     plt.close()
 
 
+def aggregate_store(store: Path, since: str | None, ckpt: Path) -> StreamAggregator:
+    """列指向ストアを集計する（成功行は集計列を、失敗行は件数を数える列だけを読む）。"""
+    filters = [("ts", ">=", since), ("date", ">=", since[:10])] if since else []
+    agg = StreamAggregator(store, ckpt)
+    for r in iter_rows(store, COLUMNS, filters + [("error", "==", "")]):
+        agg.add_row(r)
+    for r in iter_rows(store, ["ts", "topK", "max_chars", "use_semantic", "error"],
+                       filters + [("error", "!=", "")]):
+        agg.add_row(r)
+    return agg
+
+
 def main():
     # スクリプトの隣にある results.csv を既定とする
     here = Path(__file__).resolve().parent
-    csv_path = Path(sys.argv[1]).resolve() if len(sys.argv) > 1 else (here / "results.csv")
+    ap = argparse.ArgumentParser(description="Day13 results visualizer")
+    ap.add_argument("csv", nargs="?", type=Path, default=here / "results.csv")
+    ap.add_argument("--ckpt", type=Path, default=here / "cache" / "viz_agg.json",
+                    help="集計チェックポイント（JSON）")
+    ap.add_argument("--rebuild", action="store_true", help="チェックポイントを使わず全行を集計し直す")
+    ap.add_argument("--store", type=Path, help="列指向ストア（explog/results）を CSV の代わりに読む")
+    ap.add_argument("--since", help="--store 使用時: この日時（ISO 形式）以降の行だけ")
+    ap.add_argument("--report", choices=["md", "html"], help="性能レポートと JSON サマリも出力")
+    ap.add_argument("--report-dir", type=Path, default=here / "reports")
+    args = ap.parse_args()
     outdir = ensure_outdir(here)
+    source = str(args.store if args.store else args.csv)
 
-    rows_raw = load_rows(csv_path)
-    rows = coerce_types(rows_raw)
-
-    # 集計対象は基本的に error が空の成功行のみ（失敗行は除外）
-    ok_rows = [r for r in rows if not r["error"]]
+    # 集計対象は error が空の成功行のみ（失敗行は件数だけ数える）
+    if args.store:
+        agg = aggregate_store(args.store.resolve(), args.since, args.ckpt)
+        print(f"[agg] store rows: {agg.rows} (errors={agg.errors})")
+    else:
+        agg = StreamAggregator.open(args.csv.resolve(), args.ckpt, rebuild=args.rebuild)
+        n_new = agg.update()
+        agg.save()
+        print(f"[agg] new rows: {n_new}, total: {agg.rows} (errors={agg.errors})")
 
-    if not ok_rows:
+    if agg.rows - agg.errors <= 0:
         print("No valid rows to visualize (all rows had errors).")
+        if args.report and agg.rows:
+            report, summary = write_report(agg, source, args.report_dir, outdir, args.report)
+            print(f"Report: {report}\nSummary JSON: {summary}")
         return
 
     # 1) topK別 平均LLM遅延（秒）
-    topk_llm = agg_mean(ok_rows, key_fn=lambda r: r["topK"], metric="llm_sec")
+    topk_llm = agg.means("topK", "llm_sec")
     if topk_llm:
         xs = sorted(topk_llm.keys())
         ys = [topk_llm[x] for x in xs]
@@ -117,9 +105,7 @@ def main():
         print("WARN: no data for LLM latency by topK")
 
     # 2) 圧縮有無での平均入力トークン
-    cmp_in = agg_mean(ok_rows,
-                      key_fn=lambda r: "compressed" if r["max_chars"] > 0 else "no-compress",
-                      metric="in_tokens")
+    cmp_in = agg.means("compress", "in_tokens")
     if cmp_in:
         xs2 = list(cmp_in.keys())
         ys2 = [cmp_in[x] for x in xs2]
@@ -131,9 +117,7 @@ def main():
         print("WARN: no data for tokens (compression)")
 
     # 3) セマンティック有無での平均推定コスト(円)
-    sem_cost = agg_mean(ok_rows,
-                        key_fn=lambda r: "semantic-on" if r["use_semantic"] else "semantic-off",
-                        metric="est_jpy")
+    sem_cost = agg.means("semantic", "est_jpy")
     if sem_cost:
         xs3 = list(sem_cost.keys())
         ys3 = [sem_cost[x] for x in xs3]
@@ -144,6 +128,18 @@ def main():
     else:
         print("WARN: no data for estimated cost (semantic on/off)")
 
+    # 4) topK別 平均TTFT（秒）
+    topk_ttft = agg.means("topK", "ttft_sec")
+    if topk_ttft:
+        xs4 = sorted(topk_ttft.keys())
+        ys4 = [topk_ttft[x] for x in xs4]
+        plot_bar([str(x) for x in xs4], ys4,
+                 title="Time to first token by topK (avg)",
+                 xlabel="topK", ylabel="seconds",
+                 path=outdir / "ttft_by_topk.png")
+    else:
+        print("WARN: no data for TTFT by topK (run with STREAM=1)")
+
     # --- コンソールに概要出力 ---
     def p_map(title: str, m: Dict[Any, float], unit: str = ""):
         print(f"\n== {title} ==")
@@ -156,15 +152,18 @@ def main():
         p_map("Avg prompt tokens: compression vs no-compression", cmp_in)
     if sem_cost:
         p_map("Avg estimated cost: semantic on/off", sem_cost, " JPY")
-
-    # 参考：基本統計量
-    try:
-        all_llm = [r["llm_sec"] for r in ok_rows if r["llm_sec"] > 0]
-        if all_llm:
-            print(f"\nLLM latency: count={len(all_llm)}, mean={statistics.mean(all_llm):.4f}, "
-                  f"p50≈{statistics.median(all_llm):.4f}, min={min(all_llm):.4f}, max={max(all_llm):.4f}")
-    except Exception:
-        pass
+    if topk_ttft:
+        p_map("Avg TTFT by topK", topk_ttft, " sec")
+
+    # 参考：基本統計量（キャッシュヒット以外の実呼び出し。分位点はスケッチによる近似）
+    st = agg.stat("llm_cache", "live", "llm_sec")
+    if st and st.count:
+        print(f"\nLLM latency: count={st.count}, mean={st.mean:.4f}, "
+              f"p50≈{st.quantile(0.5):.4f}, p95≈{st.quantile(0.95):.4f}, min={st.min:.4f}, max={st.max:.4f}")
+
+    if args.report:
+        report, summary = write_report(agg, source, args.report_dir, outdir, args.report)
+        print(f"Report: {report}\nSummary JSON: {summary}")
 
     print(f"\nSaved charts under: {outdir}")
 
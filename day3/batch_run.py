@@ -0,0 +1,72 @@
+# batch_run.py - pf run create（1行ずつ同期呼び出し）の代わりに Azure OpenAI Batch API で一括実行
+# - inputs.jsonl の各行を flow.py（ask_gpt4o）と同じプロンプトで Batch 形式 JSONL に変換して投入
+# - 完了後、custom_id（行番号）で突き合わせて outputs/outputs.jsonl を
+#   Prompt Flow と同じ形（{"answer": {"user_input", "answer"}, "line_number"}）で書き出す
+#   → そのまま to_csv_merge.py で answers.csv にできる
+# - 投入済みジョブは outputs/batch/ に記録され、中断後の再実行は待機から再開
+# 使い方:
+#   python batch_run.py                  # inputs.jsonl → outputs/outputs.jsonl
+#   python batch_run.py --poll 10        # ポーリング間隔（秒）
+#   python to_csv_merge.py
+# 必要なキー（.env）: AZURE_OPENAI_ENDPOINT / AZURE_OPENAI_KEY / AZURE_OPENAI_DEPLOYMENT
+#   （Batch 用デプロイが別なら AOAI_BATCH_DEPLOYMENT）
+
+import argparse
+import json
+import os
+import sys
+from pathlib import Path
+
+from dotenv import load_dotenv
+
+HERE = Path(__file__).resolve().parent
+sys.path.insert(0, str(HERE.parent))
+from tools.aoai_batch import BatchClient, chat_request, run_requests
+
+load_dotenv()
+
+SYSTEM = "あなたは簡潔な日本語アシスタントです。"  # flow.py と同じ
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Day3 batch run via Azure OpenAI Batch API")
+    ap.add_argument("--data", type=Path, default=HERE / "inputs.jsonl")
+    ap.add_argument("--out", type=Path, default=HERE / "outputs" / "outputs.jsonl")
+    ap.add_argument("--poll", type=float, default=None, help="ポーリング間隔（秒）")
+    args = ap.parse_args()
+
+    deploy = os.getenv("AOAI_BATCH_DEPLOYMENT") or os.getenv("AZURE_OPENAI_DEPLOYMENT")
+    prompts = []
+    with open(args.data, "r", encoding="utf-8-sig") as f:  # BOM 付き対策
+        for line in f:
+            if not line.strip():
+                continue
+            o = json.loads(line)
+            prompts.append(o.get("user_input") or o.get("question") or "")
+
+    reqs = [
+        chat_request(str(i), deploy, [
+            {"role": "system", "content": SYSTEM},
+            {"role": "user", "content": p},
+        ])
+        for i, p in enumerate(prompts)
+    ]
+    results = run_requests(BatchClient.from_env(), reqs, args.out.parent / "batch",
+                           tag="day3", poll_sec=args.poll)
+
+    args.out.parent.mkdir(parents=True, exist_ok=True)
+    ok = 0
+    with open(args.out, "w", encoding="utf-8") as fout:
+        for i, p in enumerate(prompts):
+            r = results.get(str(i)) or {}
+            if r.get("content") is None:
+                print(f"[WARN] line {i} failed: {r.get('error')}")
+                continue
+            fout.write(json.dumps({"answer": {"user_input": p, "answer": r["content"]},
+                                   "line_number": i}, ensure_ascii=False) + "\n")
+            ok += 1
+    print(f"wrote: {args.out} ({ok}/{len(prompts)} lines)")
+
+
+if __name__ == "__main__":
+    main()
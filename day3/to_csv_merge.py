@@ -16,6 +16,8 @@ with open(r".\outputs\outputs.jsonl", "r", encoding="utf-8") as fin, \
         o = json.loads(line)
         ln = o.get("line_number")
         ans = o.get("answer")
+        if isinstance(ans, dict):  # flow.py の出力 {"user_input", "answer"}（batch_run.py も同じ形）
+            ans = ans.get("answer")
         q = qs[ln] if isinstance(ln, int) and 0 <= ln < len(qs) else None
         w.writerow({"question": q, "answer": ans})
 
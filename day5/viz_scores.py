@@ -3,9 +3,12 @@
 # - Day4の rows.csv / summary.csv を読み込み
 # - ヒストグラム & 質問別平均スコアを ../images/day5/ に保存
 # - 閾値と合格率を day5/threshold.json に保存
+# - --store で列指向ストア（tools/explog.py import で rows.csv から作成）を読む（必要な列だけ）
 # 方針: matplotlibのみ・単一プロット・色指定なし／フォルダは自動生成
 
+import argparse
 import json
+import sys
 from pathlib import Path
 
 import numpy as np
@@ -29,9 +32,19 @@ th_config_path = CFG_DIR / "threshold.json"
 IMG_DIR.mkdir(parents=True, exist_ok=True)
 CFG_DIR.mkdir(parents=True, exist_ok=True)
 
+ap = argparse.ArgumentParser(description="Day5 score visualizer")
+ap.add_argument("--store", type=Path, help="rows.csv の代わりに読む列指向ストア（parquet / arrow）")
+args = ap.parse_args()
+
 # ===== 1) 読み込み =====
-# encoding は必要に応じて "utf-8-sig" に変更
-rows = pd.read_csv(rows_path)
+if args.store:
+    sys.path.insert(0, str(ROOT))
+    from tools.explog import read_table
+    # 使うのは question / score だけ（回答本文などは読まない）
+    rows = read_table(args.store, columns=["question", "score"]).to_pandas()
+else:
+    # encoding は必要に応じて "utf-8-sig" に変更
+    rows = pd.read_csv(rows_path)
 # summary は今は未使用。必要なら読み込み:
 # summary = pd.read_csv(summary_path, header=None, names=["key", "value"])
 
@@ -1,41 +1,38 @@
 import pandas as pd
-import re
+
+from scoring import Vocab, contains_all_column, jaccard_columns, stuffing_metrics, text_lengths
 
 # 1) 読み込み
 df = pd.read_csv("results_day6.csv")
 
 # 2) 簡易メトリクス: 文章長、キーワード完全一致、Jaccard(期待文との語彙重なり)
-def tok(s):  # ゆるいトークナイザ
-    return [w for w in re.findall(r"\w+|[一-龠ぁ-んァ-ン]+", str(s))]
-
-def jaccard(a, b):
-    A, B = set(tok(a)), set(tok(b))
-    return len(A & B) / max(1, len(A | B))
+#    列ごとに 1 回だけトークン化してまとめて計算（scoring.py。1 行ずつの旧実装と同じ数値）
+def column(name):
+    # 旧実装と同じく str() で文字列化（列が無ければ空文字）
+    return [str(x) for x in df[name]] if name in df.columns else [""] * len(df)
 
-def contains_all(ans, kw_csv):
-    kws = [k.strip() for k in str(kw_csv).split(",") if k.strip()]
-    return all(k in str(ans) for k in kws)
+exp = column("keywords")
+base = column("base_answer")
+impv = column("improved_answer")
+expected = column("expected")
+vocab = Vocab()
 
-rows = []
-for _, r in df.iterrows():
-    exp = r.get("keywords", "")
-    base = r.get("base_answer", "")
-    impv = r.get("improved_answer", "")
+out = pd.DataFrame({
     # 文章長
-    base_len = len(base)
-    impv_len = len(impv)
+    "base_len": text_lengths(base),
+    "impv_len": text_lengths(impv),
     # キーワード完全一致
-    base_all = contains_all(base, exp)
-    impv_all = contains_all(impv, exp)
+    "base_allKW": contains_all_column(base, exp),
+    "impv_allKW": contains_all_column(impv, exp),
     # 期待文（expected）との重なり度
-    jac_base = jaccard(r.get("expected",""), base)
-    jac_impv = jaccard(r.get("expected",""), impv)
-    rows.append((base_len, impv_len, base_all, impv_all, jac_base, jac_impv))
-
-out = pd.DataFrame(rows, columns=["base_len","impv_len","base_allKW","impv_allKW","jac_base","jac_impv"])
+    "jac_base": jaccard_columns(expected, base, vocab),
+    "jac_impv": jaccard_columns(expected, impv, vocab),
+})
+# キーワード出現位置から: 本文に占める割合 / 「A、B、C」のように連続する個数
+out["impv_kw_cov"], out["impv_kw_run"] = stuffing_metrics(impv, exp)
 print("=== Averages ===")
 print(out.mean(numeric_only=True))
 print("\n=== Suspicious (keyword stuffing?) ===")
-# 極端に短いのに全キーワード一致 → 羅列の疑い
-sus = out[(out.impv_len <= 25) & (out.impv_allKW)]
+# 極端に短いのに全キーワード一致 / キーワードが本文の半分以上 / 3つ以上の羅列 → 羅列の疑い
+sus = out[((out.impv_len <= 25) & (out.impv_allKW)) | (out.impv_kw_cov >= 0.5) | (out.impv_kw_run >= 3)]
 print(sus if len(sus) else "none")
@@ -1,17 +1,38 @@
 # eval_prompts.py  — Day6 改善版（キーワード必須・BOM対策・.env読込）
 # 使い方:
 #   py -m pip install openai==1.* python-dotenv pandas matplotlib
-#   python .\eval_prompts.py
+#   python .\eval_prompts.py                 # 途中まで済んでいれば続きから（プロンプト等が同じときだけ）
+#   python .\eval_prompts.py --workers 8     # 同時実行数（既定: EVAL_WORKERS or 4）
+#   python .\eval_prompts.py --fresh         # results_day6.csv を作り直す
+#   python .\eval_prompts.py --variants variants.json   # N バリアント（プロンプト/温度/max_tokens）
+#   python .\eval_prompts.py --early-stop               # 劣るバリアントを途中で除外（既定は全問で評価）
+#   python .\eval_prompts.py --no-early-stop            # JSON で有効にしていても全問で評価
+#   python .\eval_prompts.py --batch                    # Batch API で一括投入（対話クォータを使わない）
+# 設定: AOAI_RPM / AOAI_TPM（送信前のレート制御）, AOAI_MAX_RETRIES（429 / 5xx の再送回数, 既定 2）
 
 import os
+import sys
 import json
 import csv
+import math
+import hashlib
+import argparse
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
 from pathlib import Path
 
 import pandas as pd
 import matplotlib.pyplot as plt
 from dotenv import load_dotenv
-from openai import AzureOpenAI
+from openai import AzureOpenAI, APIConnectionError, APIStatusError
+
+# リポジトリ直下の共有モジュール（tools/）を import 可能にする
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+from tools.ratelimit import shared_limiter, estimate_tokens, env_limits
+from tools.aoai_batch import BatchClient, chat_request, run_requests
+# スコア関数（超簡易: キーワード完全一致率。analyze_day6.py と共有）
+from scoring import score_answer
 
 
 # ---------- .env 読み込み ----------
@@ -24,6 +45,8 @@ ENDPOINT   = os.getenv("AZURE_OPENAI_ENDPOINT")
 API_KEY    = os.getenv("AZURE_OPENAI_KEY")
 DEPLOYMENT = os.getenv("AZURE_OPENAI_DEPLOYMENT")  # 例: gpt4o-mini-chat
 API_VER    = os.getenv("AZURE_OPENAI_API_VERSION") or "2024-07-18"
+# --batch 時のデプロイ（Global-Batch 型）。未指定なら通常のデプロイ名
+BATCH_DEPLOYMENT = os.getenv("AOAI_BATCH_DEPLOYMENT") or DEPLOYMENT
 
 # 軽いバリデーション（足りない場合でも例外は投げず警告のみ）
 def warn_env(name, val):
@@ -35,11 +58,31 @@ warn_env("AZURE_OPENAI_KEY", API_KEY)
 warn_env("AZURE_OPENAI_DEPLOYMENT", DEPLOYMENT)
 
 # ---------- Azure OpenAI Client ----------
+# SDK 内部の再送は切る（429 の retry-after を共有バケットに通すため、再送は ask() が行う）
 client = AzureOpenAI(
     api_key=API_KEY,
     api_version=API_VER,
-    azure_endpoint=ENDPOINT
+    azure_endpoint=ENDPOINT,
+    max_retries=0,
 )
+# ask() の再送回数（429 / 5xx / 接続エラー）
+MAX_RETRIES = int(os.getenv("AOAI_MAX_RETRIES", "2") or "2")
+
+# ---------- レート制御（day13 と同じトークンバケット実装を共有） ----------
+# AOAI_RPM / AOAI_TPM を設定すると送信前に待機して 429 を避ける
+# バケットはデプロイごと（クォータも x-ratelimit ヘッダもデプロイ単位のため）
+LIMITER = shared_limiter()
+_LIMIT_KEYS = set()
+_LIMIT_LOCK = threading.Lock()
+
+def limit_key(deployment: str | None) -> tuple:
+    """実際に呼ぶデプロイのキー。初めて使うときに AOAI_RPM / AOAI_TPM で設定する。"""
+    key = ("aoai", (ENDPOINT or "").rstrip("/"), deployment)
+    with _LIMIT_LOCK:
+        if key not in _LIMIT_KEYS:
+            LIMITER.configure(key, *env_limits("AOAI", os.environ))
+            _LIMIT_KEYS.add(key)
+    return key
 
 # ---------- プロンプト定義 ----------
 BASE_SYS = "あなたは端的に答えるアシスタントです。"
@@ -58,97 +101,366 @@ IMPROVED_USER_TMPL = (
     "質問: {q}"
 )
 
+# 評価するバリアント一覧（name は CSV 列名 {name}_answer / {name}_score に使う）
+# --variants で JSON（variants.json 参照）を渡すと置き換わる
+VARIANTS = [
+    {"name": "base", "system": BASE_SYS, "user": BASE_USER_TMPL},
+    # 改善版はキーワードを明示的に渡す（空なら“指定なし”とする）
+    {"name": "improved", "system": IMPROVED_SYS, "user": IMPROVED_USER_TMPL},
+]
+
+# 早期打ち切りの既定値（JSON の "early_stopping" で上書き）。既定は無効（--early-stop で有効）
+EARLY_STOPPING = {"enabled": False, "min_questions": 10, "delta": 0.05}
+
+def load_variants(path: Path):
+    """
+    {"variants": [{"name","system","user","temperature","max_tokens"}, ...],
+     "early_stopping": {...}} 形式の JSON を読む。
+    """
+    cfg = json.loads(path.read_text(encoding="utf-8-sig"))
+    variants = cfg.get("variants") or []
+    names = [v.get("name") for v in variants]
+    if not variants or any(not n for n in names) or len(set(names)) != len(names):
+        raise SystemExit(f"[ERROR] {path.name}: variants の name が空または重複しています。")
+    for v in variants:
+        if "user" not in v:
+            raise SystemExit(f"[ERROR] {path.name}: variant '{v['name']}' に user テンプレートがありません。")
+    return variants, {**EARLY_STOPPING, **(cfg.get("early_stopping") or {})}
+
+def render(variant: dict, q: str, kw: str) -> str:
+    return variant["user"].format(q=q, keywords=kw if kw else "（指定なし）")
+
+# ---------- 早期打ち切り（逐次除去: Hoeffding 信頼区間） ----------
+class EarlyStopper:
+    """
+    スコアは [0,1] なので、n 問の平均に対し半径 sqrt(log(4 K n^2 / delta) / 2n) の
+    時刻一様な信頼区間を取る。上限が「最良バリアントの下限」を下回ったら除外し、
+    以降の問では API を呼ばない。全バリアントは同じ問で比較される（対応のある比較）。
+    """
+    def __init__(self, names, min_questions: int = 10, delta: float = 0.05, enabled: bool = True):
+        self.names = list(names)
+        self.min_questions = int(min_questions)
+        self.delta = float(delta)
+        self.enabled = enabled
+        self.n = {k: 0 for k in self.names}
+        self.total = {k: 0.0 for k in self.names}
+        self.active = list(self.names)
+        self.eliminated = {}  # name -> その時点の評価数
+
+    def add(self, name: str, score: float) -> None:
+        self.n[name] += 1
+        self.total[name] += score
+
+    def mean(self, name: str) -> float:
+        return self.total[name] / self.n[name] if self.n[name] else 0.0
+
+    def radius(self, name: str) -> float:
+        n = self.n[name]
+        if not n:
+            return 1.0
+        k = len(self.names)
+        return math.sqrt(math.log(4 * k * n * n / self.delta) / (2 * n))
+
+    def update(self):
+        """除外されたバリアント名のリストを返す。"""
+        if not self.enabled or len(self.active) <= 1:
+            return []
+        if min(self.n[k] for k in self.active) < self.min_questions:
+            return []
+        best_lcb = max(self.mean(k) - self.radius(k) for k in self.active)
+        out = [k for k in self.active if self.mean(k) + self.radius(k) < best_lcb]
+        for k in out:
+            self.active.remove(k)
+            self.eliminated[k] = self.n[k]
+        return out
+
 # ---------- 呼び出し関数 ----------
-def ask(model_deploy: str, sys_msg: str, user_msg: str) -> str:
-    resp = client.chat.completions.create(
-        model=model_deploy,
-        messages=[
-            {"role": "system", "content": sys_msg},
-            {"role": "user", "content": user_msg},
-        ],
-        temperature=0.1,   # 指示遵守を高める
-        max_tokens=256,    # 出力短縮でコスト抑制
-    )
+def ask(model_deploy: str, sys_msg: str, user_msg: str,
+        temperature: float = 0.1,   # 指示遵守を高める
+        max_tokens: int = 256,      # 出力短縮でコスト抑制
+        ) -> str:
+    messages = [
+        {"role": "system", "content": sys_msg},
+        {"role": "user", "content": user_msg},
+    ]
+    est = estimate_tokens(messages, max_tokens)
+    key = limit_key(model_deploy)
+    for attempt in range(MAX_RETRIES + 1):
+        # 再送も毎回バケットを通す（429 の retry-after は observe 済みなので acquire が待つ）
+        LIMITER.acquire(key, est)
+        try:
+            raw = client.chat.completions.with_raw_response.create(
+                model=model_deploy,
+                messages=messages,
+                temperature=temperature,
+                max_tokens=max_tokens,
+            )
+            break
+        except APIStatusError as e:
+            # 429 等の retry-after / 残量ヘッダを学習してから再送 or 上位へ
+            LIMITER.observe(key, e.status_code, e.response.headers)
+            if attempt >= MAX_RETRIES or not (e.status_code == 429 or e.status_code >= 500):
+                raise
+            if not (e.response.headers.get("retry-after-ms") or e.response.headers.get("retry-after")):
+                time.sleep(min(8.0, 0.5 * 2 ** attempt))
+        except APIConnectionError:
+            if attempt >= MAX_RETRIES:
+                raise
+            time.sleep(min(8.0, 0.5 * 2 ** attempt))
+    LIMITER.observe(key, raw.status_code, raw.headers)
+    resp = raw.parse()
+    if resp.usage is not None:
+        LIMITER.settle(key, est, resp.usage.total_tokens)
     return (resp.choices[0].message.content or "").strip()
 
-# ---------- スコア関数（超簡易: キーワード完全一致率） ----------
-def score_answer(ans: str, keywords_csv: str) -> float:
-    ans = ans or ""
-    keys = [k.strip() for k in (keywords_csv or "").split(",") if k.strip()]
-    if not keys:
-        return 0.0
-    hits = sum(1 for k in keys if k in ans)
-    return hits / len(keys)
-
 # ---------- 入出力パス ----------
 CWD = Path(__file__).resolve().parent
 TESTSET = CWD / "testset.jsonl"
 IMG_DIR = CWD.parents[1] /"articles"/ "images" / "day6"  # ../images/day6
 IMG_DIR.mkdir(parents=True, exist_ok=True)
 OUT_CSV = CWD / "results_day6.csv"
+OUT_META = CWD / "results_day6.meta.json"  # OUT_CSV を書いたときの設定ハッシュ（再開判定用）
 OUT_PNG = IMG_DIR / "prompt_compare.png"
 
-# ---------- メイン処理 ----------
-def main():
-    if not TESTSET.exists():
-        raise FileNotFoundError(f"testset.jsonl が見つかりません: {TESTSET}")
+# ---------- 途中再開 ----------
+def fieldnames(variants) -> list:
+    return (["id", "question", "keywords"]
+            + [f"{v['name']}_answer" for v in variants]
+            + [f"{v['name']}_score" for v in variants])
+
+def config_hash(variants, deployment: str | None) -> str:
+    """回答に効く設定（バリアントのプロンプト・温度・max_tokens とデプロイ名）のハッシュ。"""
+    cfg = {
+        "deployment": deployment or "",
+        "variants": [{"name": v["name"], "system": v.get("system", ""), "user": v["user"],
+                      "temperature": float(v.get("temperature", 0.1)),
+                      "max_tokens": int(v.get("max_tokens", 256))} for v in variants],
+    }
+    raw = json.dumps(cfg, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()[:16]
+
+def prepare_output(variants, deployment: str | None, fresh: bool) -> None:
+    """
+    再開するかを決める。前回の設定ハッシュ（OUT_META）が今回と一致するときだけ続きから。
+    違う・記録が無い場合は古いスコアを混ぜないよう最初から評価し直す（--fresh と同じ）。
+    """
+    h = config_hash(variants, deployment)
+    if OUT_CSV.exists() and not fresh:
+        try:
+            prev = json.loads(OUT_META.read_text(encoding="utf-8")).get("config_hash")
+        except (OSError, ValueError):
+            prev = None
+        if prev != h:
+            print(f"[INFO] プロンプト/バリアント設定が前回と異なる（または記録が無い）ため、"
+                  f"{OUT_CSV.name} を作り直します。")
+            fresh = True
+    if fresh and OUT_CSV.exists():
+        OUT_CSV.unlink()
+    OUT_META.write_text(json.dumps({"config_hash": h, "deployment": deployment,
+                                    "variants": [v["name"] for v in variants]},
+                                   ensure_ascii=False, indent=2), encoding="utf-8")
+
+def done_ids(out_csv: Path, fields: list) -> set:
+    """既に CSV に書き出し済みの id。ヘッダが今のバリアント構成と違えば使わない。"""
+    return {r["id"] for r in read_done(out_csv, fields)}
 
-    rows = []
+def read_done(out_csv: Path, fields: list) -> list:
+    if not out_csv.exists():
+        return []
+    with open(out_csv, "r", newline="", encoding="utf-8") as f:
+        reader = csv.DictReader(f)
+        if reader.fieldnames != fields:
+            raise SystemExit(
+                f"[ERROR] {out_csv.name} の列構成が現在のバリアントと異なります。--fresh で作り直してください。"
+            )
+        return list(reader)
+
+def restore_stopper(stopper: EarlyStopper, rows: list) -> None:
+    """再開時: 書き出し済みの行からスコアを戻し、除外判定をやり直す（空欄は除外後の問）。"""
+    for r in rows:
+        for name in stopper.names:
+            val = r.get(f"{name}_score", "")
+            if val != "":
+                stopper.add(name, float(val))
+        stopper.update()
+
+def iter_testset(path: Path):
     # PowerShell Out-File の BOM 付きに対応（utf-8-sig）
-    with open(TESTSET, "r", encoding="utf-8-sig") as f:
-        for line in f:
+    with open(path, "r", encoding="utf-8-sig") as f:
+        for n, line in enumerate(f, 1):
             line = line.strip()
             if not line:
                 continue
             item = json.loads(line)
-            q = item.get("question", "").strip()
-            kw = item.get("keywords", "").strip()  # 例: "Azure,OpenAI"
-
-            # base
-            base_ans = ask(DEPLOYMENT, BASE_SYS, BASE_USER_TMPL.format(q=q))
-
-            # improved（キーワードを明示的に渡す。空なら“指定なし”とする）
-            kw_for_prompt = kw if kw else "（指定なし）"
-            impv_ans = ask(
-                DEPLOYMENT,
-                IMPROVED_SYS,
-                IMPROVED_USER_TMPL.format(q=q, keywords=kw_for_prompt)
-            )
+            item.setdefault("id", f"line{n}")
+            yield item
 
-            base_sc = score_answer(base_ans, kw)
-            impv_sc = score_answer(impv_ans, kw)
+# ---------- メイン処理 ----------
+def evaluate(variants, workers: int, fresh: bool = False, stopper: EarlyStopper | None = None) -> int:
+    """
+    (質問, バリアント) を workers 並列で実行し、1問の全バリアントが揃った時点で
+    CSV に 1 行追記する（都度 flush）。既に書かれた id はスキップ（設定が前回と同じ場合のみ。
+    prepare_output 参照）。戻り値は新規行数。
+    stopper を渡すと、行を書くたびに除外判定し、除外済みバリアントは以降の問で呼ばない
+    （CSV の該当列は空欄）。
+    """
+    fields = fieldnames(variants)
+    prepare_output(variants, DEPLOYMENT, fresh)
+    done = read_done(OUT_CSV, fields)
+    skip = {r["id"] for r in done}
+    if skip:
+        print(f"[INFO] {len(skip)} 問は評価済みのためスキップします。")
+    if stopper is None:
+        stopper = EarlyStopper([v["name"] for v in variants], enabled=False)
+    restore_stopper(stopper, done)
+    if stopper.eliminated:
+        print(f"[INFO] 除外済みバリアント: {', '.join(stopper.eliminated)}")
 
-            rows.append({
-                "id": item.get("id"),
-                "question": q,
-                "keywords": kw,
-                "base_answer": base_ans,
-                "improved_answer": impv_ans,
-                "base_score": base_sc,
-                "improved_score": impv_sc,
-            })
+    new = not OUT_CSV.exists()
+    wf = open(OUT_CSV, "a", newline="", encoding="utf-8")
+    writer = csv.DictWriter(wf, fieldnames=fields)
+    if new:
+        writer.writeheader()
+        wf.flush()
 
-    if not rows:
-        print("[WARN] testset.jsonl に有効なデータがありません。")
-        return
+    by_name = {v["name"]: v for v in variants}
+    pending = {}    # id -> {"item":..., "names": [...], "answers": {name: ans}}
+    written = 0
+    max_inflight = max(1, workers) * 2
+    items = (it for it in iter_testset(TESTSET) if str(it["id"]) not in skip)
 
-    # CSV保存
-    with open(OUT_CSV, "w", newline="", encoding="utf-8") as wf:
-        writer = csv.DictWriter(wf, fieldnames=list(rows[0].keys()))
-        writer.writeheader()
-        writer.writerows(rows)
+    def job(item, v):
+        q = item.get("question", "").strip()
+        kw = item.get("keywords", "").strip()  # 例: "Azure,OpenAI"
+        return ask(DEPLOYMENT, v.get("system", ""), render(v, q, kw),
+                   temperature=float(v.get("temperature", 0.1)),
+                   max_tokens=int(v.get("max_tokens", 256)))
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        inflight = {}
+        exhausted = False
+        while True:
+            # 在庫が少なければ次の質問の（残っている）全バリアントを投入
+            while not exhausted and len(inflight) < max_inflight:
+                item = next(items, None)
+                if item is None:
+                    exhausted = True
+                    break
+                names = list(stopper.active)
+                pending[item["id"]] = {"item": item, "names": names, "answers": {}, "failed": False}
+                for name in names:
+                    inflight[pool.submit(job, item, by_name[name])] = (item["id"], name)
+            if not inflight:
+                break
+            finished, _ = wait(inflight, return_when=FIRST_COMPLETED)
+            for fut in finished:
+                iid, name = inflight.pop(fut)
+                st = pending[iid]
+                try:
+                    st["answers"][name] = fut.result()
+                except Exception as e:
+                    # 失敗した問は書き出さない（次回の再実行で再評価される）
+                    print(f"[WARN] id={iid} variant={name} failed: {e}")
+                    st["failed"] = True
+                    st["answers"][name] = None
+                if len(st["answers"]) < len(st["names"]):
+                    continue
+                del pending[iid]
+                if st["failed"]:
+                    continue
+                item = st["item"]
+                kw = item.get("keywords", "").strip()
+                row = {"id": iid, "question": item.get("question", "").strip(), "keywords": kw}
+                for name in st["names"]:
+                    ans = st["answers"][name]
+                    sc = score_answer(ans, kw)
+                    row[f"{name}_answer"] = ans
+                    row[f"{name}_score"] = sc
+                    stopper.add(name, sc)
+                writer.writerow(row)
+                wf.flush()
+                written += 1
+                for name in stopper.update():
+                    print(f"[INFO] early stop: '{name}' を除外 "
+                          f"(n={stopper.n[name]}, mean={stopper.mean(name):.3f})")
+    wf.close()
+    return written
+
+def evaluate_batch(variants, fresh: bool = False, poll_sec: float | None = None) -> int:
+    """
+    未評価の (質問, バリアント) を Batch API に 1 ジョブで投入し、完了後に結果を
+    custom_id（"{id}::{name}"）で突き合わせて CSV に追記する。
+    投入済みジョブは day6/batch/ に記録され、中断後の再実行は待機から再開する。
+    逐次の早期打ち切りは行わない（全バリアントを一括で評価）。
+    """
+    fields = fieldnames(variants)
+    prepare_output(variants, BATCH_DEPLOYMENT, fresh)
+    skip = done_ids(OUT_CSV, fields)
+    if skip:
+        print(f"[INFO] {len(skip)} 問は評価済みのためスキップします。")
+    items = [it for it in iter_testset(TESTSET) if str(it["id"]) not in skip]
+    if not items:
+        return 0
 
-    # 集計＆可視化
-    df = pd.DataFrame(rows)
-    avg_base = float(df["base_score"].mean())
-    avg_impr = float(df["improved_score"].mean())
+    reqs = []
+    for item in items:
+        q = item.get("question", "").strip()
+        kw = item.get("keywords", "").strip()
+        for v in variants:
+            messages = [
+                {"role": "system", "content": v.get("system", "")},
+                {"role": "user", "content": render(v, q, kw)},
+            ]
+            reqs.append(chat_request(f"{item['id']}::{v['name']}", BATCH_DEPLOYMENT, messages,
+                                     temperature=float(v.get("temperature", 0.1)),
+                                     max_tokens=int(v.get("max_tokens", 256))))
+    results = run_requests(BatchClient(ENDPOINT, API_KEY), reqs, CWD / "batch",
+                           tag="day6", poll_sec=poll_sec)
 
-    print(f"Base Avg: {avg_base:.3f}")
-    print(f"Improved Avg: {avg_impr:.3f}")
+    new = not OUT_CSV.exists()
+    written = 0
+    with open(OUT_CSV, "a", newline="", encoding="utf-8") as wf:
+        writer = csv.DictWriter(wf, fieldnames=fields)
+        if new:
+            writer.writeheader()
+        for item in items:
+            iid = item["id"]
+            kw = item.get("keywords", "").strip()
+            got = {v["name"]: results.get(f"{iid}::{v['name']}") or {} for v in variants}
+            failed = [n for n, r in got.items() if r.get("content") is None]
+            if failed:
+                # 失敗した問は書き出さない（次回の再実行で再評価される）
+                for n in failed:
+                    print(f"[WARN] id={iid} variant={n} failed: {got[n].get('error')}")
+                continue
+            row = {"id": iid, "question": item.get("question", "").strip(), "keywords": kw}
+            for v in variants:
+                ans = got[v["name"]]["content"]
+                row[f"{v['name']}_answer"] = ans
+                row[f"{v['name']}_score"] = score_answer(ans, kw)
+            writer.writerow(row)
+            written += 1
+    return written
+
+def summarize(variants, stopper: EarlyStopper | None = None) -> None:
+    # 集計＆可視化（CSV 全体＝今回分＋前回までの分）
+    df = pd.read_csv(OUT_CSV)
+    if df.empty:
+        print("[WARN] testset.jsonl に有効なデータがありません。")
+        return
+    cols = [f"{v['name']}_score" for v in variants]
+    for v, c in zip(variants, cols):
+        # 除外済みバリアントは空欄（NaN）を除いた評価済みの問だけで平均
+        note = ""
+        if stopper is not None and v["name"] in stopper.eliminated:
+            note = "  (early-stopped)"
+        print(f"{v['name'].capitalize()} Avg: {float(df[c].mean()):.3f}  n={int(df[c].count())}{note}")
+    if stopper is not None and stopper.enabled and len(stopper.active) == 1 and len(variants) > 1:
+        print(f"[INFO] 勝者: {stopper.active[0]}")
 
     # 棒グラフ（seabornは使わず、単一プロット）
     plt.figure()
-    df[["base_score", "improved_score"]].mean().plot(
+    df[cols].mean().plot(
         kind="bar", title="Prompt Score Comparison"
     )
     plt.ylabel("Average keyword hit ratio")
@@ -157,5 +469,35 @@ def main():
 
     print(f"Saved: {OUT_CSV.name}, {OUT_PNG}")
 
+def main():
+    ap = argparse.ArgumentParser(description="Day6 prompt A/B evaluator")
+    ap.add_argument("--workers", type=int, default=int(os.getenv("EVAL_WORKERS", "4") or "4"))
+    ap.add_argument("--fresh", action="store_true", help="既存の結果を消して最初から")
+    ap.add_argument("--variants", type=Path, help="バリアント定義 JSON（省略時は組み込みの base/improved）")
+    ap.add_argument("--early-stop", action="store_true", help="劣るバリアントを早期除外する")
+    ap.add_argument("--no-early-stop", action="store_true", help="JSON で有効でも早期除外をしない")
+    ap.add_argument("--batch", action="store_true", help="Batch API で一括評価（早期除外なし）")
+    ap.add_argument("--poll", type=float, default=None, help="--batch のポーリング間隔（秒）")
+    args = ap.parse_args()
+
+    if not TESTSET.exists():
+        raise FileNotFoundError(f"testset.jsonl が見つかりません: {TESTSET}")
+
+    variants, es = VARIANTS, dict(EARLY_STOPPING)
+    if args.variants:
+        variants, es = load_variants(args.variants)
+    stopper = EarlyStopper([v["name"] for v in variants],
+                           min_questions=es.get("min_questions", 10),
+                           delta=es.get("delta", 0.05),
+                           enabled=(bool(es.get("enabled", False)) or args.early_stop) and not args.no_early_stop)
+
+    if args.batch:
+        stopper.enabled = False
+        n = evaluate_batch(variants, fresh=args.fresh, poll_sec=args.poll)
+    else:
+        n = evaluate(variants, args.workers, fresh=args.fresh, stopper=stopper)
+    print(f"[INFO] {n} 問を新たに評価しました。")
+    summarize(variants, stopper)
+
 if __name__ == "__main__":
     main()
@@ -0,0 +1,243 @@
+# scoring.py — Day6 の採点をまとめて高速に計算するモジュール
+# - analyze_day6.py（文章長・全キーワード一致・Jaccard）と eval_prompts.py（キーワード命中率）で共有
+# - 列ごとに 1 回だけトークン化し、語彙 ID（int）の集合として持つ
+# - Jaccard は (行番号, 語彙ID) を 1 本の int64 キーにして np.intersect1d でまとめて計算
+# - キーワードは同じキーワード列（"Azure,OpenAI" など）ごとにまとめ、照合器
+#   （tools/keyword_match.py の Aho-Corasick）は 1 回だけ作る
+# - キーワード羅列の疑い: 出現位置から本文の被覆率と「A、B、C」型の連続数を出す
+# - 1 行版（tok / jaccard / contains_all / score_answer）と同じ数値になる
+# 使い方:
+#   from scoring import score_answer, jaccard_columns, keyword_hits
+#   python .\scoring.py --bench 100000   # 旧実装（iterrows）との速度比較＋一致確認
+
+import re
+import sys
+import time
+from functools import lru_cache
+from pathlib import Path
+from typing import Dict, List, Sequence, Tuple
+
+import numpy as np
+
+# リポジトリ直下の共有モジュール（tools/）を import 可能にする
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+from tools.keyword_match import KeywordMatcher, compile_keywords, keyword_coverage, max_keyword_run
+
+# ゆるいトークナイザ（analyze_day6.py の tok と同じパターン）
+TOKEN_RE = re.compile(r"\w+|[一-龠ぁ-んァ-ン]+")
+
+
+# ---------- 1 行版（従来どおりの関数） ----------
+def tok(s) -> List[str]:
+    return TOKEN_RE.findall(str(s))
+
+def jaccard(a, b) -> float:
+    A, B = set(tok(a)), set(tok(b))
+    return len(A & B) / max(1, len(A | B))
+
+@lru_cache(maxsize=4096)
+def parse_keywords(kw_csv: str) -> Tuple[str, ...]:
+    """"Azure, OpenAI" → ("Azure", "OpenAI")（空要素は捨てる）。"""
+    return tuple(k.strip() for k in kw_csv.split(",") if k.strip())
+
+def matcher(kw_csv: str, normalize: bool = False) -> KeywordMatcher:
+    return compile_keywords(parse_keywords(kw_csv), normalize)
+
+def contains_all(ans, kw_csv) -> bool:
+    m = matcher(str(kw_csv))
+    return m.hit_count(str(ans)) == len(m.keywords)
+
+def score_answer(ans: str, keywords_csv: str, normalize: bool = False) -> float:
+    """キーワード命中率（キーワードが無ければ 0.0）。normalize=True で全角/半角・大小文字を同一視。"""
+    m = matcher(keywords_csv or "", normalize)
+    if not m.keywords:
+        return 0.0
+    return m.hit_count(ans or "") / len(m.keywords)
+
+
+# ---------- 列単位（まとめて計算） ----------
+class Vocab:
+    """トークン → 語彙ID。同じ文字列のトークン化は 1 回だけ。"""
+
+    def __init__(self) -> None:
+        self.ids: Dict[str, int] = {}
+        self._memo: Dict[str, List[int]] = {}
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def encode(self, s: str) -> List[int]:
+        """s の語彙ID集合（重複なし）。"""
+        out = self._memo.get(s)
+        if out is None:
+            ids = self.ids
+            out = []
+            for t in set(TOKEN_RE.findall(s)):
+                i = ids.get(t)
+                if i is None:
+                    i = ids[t] = len(ids)
+                out.append(i)
+            self._memo[s] = out
+        return out
+
+    def encode_column(self, col: Sequence[str]) -> Tuple[np.ndarray, np.ndarray]:
+        """列全体を (平坦化した語彙ID, 各行の要素数) に変換。"""
+        flat: List[int] = []
+        lens = np.empty(len(col), dtype=np.int64)
+        encode = self.encode
+        for i, s in enumerate(col):
+            ids = encode(s)
+            flat.extend(ids)
+            lens[i] = len(ids)
+        return np.array(flat, dtype=np.int64), lens
+
+
+def _row_keys(flat: np.ndarray, lens: np.ndarray, width: int) -> np.ndarray:
+    """各行の語彙ID集合を (行番号 * width + ID) の 1 次元配列にする（全体で重複なし）。"""
+    rows = np.repeat(np.arange(len(lens), dtype=np.int64), lens)
+    return rows * width + flat
+
+
+def jaccard_columns(a: Sequence[str], b: Sequence[str], vocab: Vocab | None = None) -> np.ndarray:
+    """行ごとの jaccard(a[i], b[i])。a / b は文字列の列（str 化済み）。"""
+    if len(a) != len(b):
+        raise ValueError("a と b の行数が違います。")
+    vocab = vocab or Vocab()
+    fa, la = vocab.encode_column(a)
+    fb, lb = vocab.encode_column(b)
+    width = max(1, len(vocab))
+    inter = np.intersect1d(_row_keys(fa, la, width), _row_keys(fb, lb, width), assume_unique=True)
+    ic = np.bincount(inter // width, minlength=len(a)).astype(np.int64)
+    union = la + lb - ic
+    return ic / np.maximum(1, union)
+
+
+def keyword_hits(answers: Sequence[str], kw_csvs: Sequence[str],
+                 normalize: bool = False) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    行ごとの (命中したキーワード数, キーワード数)。
+    同じキーワード列を持つ行をまとめ、照合器を 1 回だけ作って各行を 1 回走査する。
+    """
+    n = len(answers)
+    hits = np.zeros(n, dtype=np.int64)
+    nkeys = np.zeros(n, dtype=np.int64)
+    groups: Dict[str, List[int]] = {}
+    for i, kw in enumerate(kw_csvs):
+        groups.setdefault(kw, []).append(i)
+    for kw, idx in groups.items():
+        m = matcher(kw, normalize)
+        if not m.keywords:
+            continue
+        sel = np.asarray(idx, dtype=np.int64)
+        hits[sel] = np.fromiter((m.hit_count(answers[i]) for i in idx), dtype=np.int64, count=len(idx))
+        nkeys[sel] = len(m.keywords)
+    return hits, nkeys
+
+
+def stuffing_metrics(answers: Sequence[str], kw_csvs: Sequence[str],
+                     normalize: bool = False) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    キーワード羅列の指標: (本文に占めるキーワード出現の割合, 区切り文字だけで連続する
+    キーワードの最大個数)。出現位置は照合器の 1 回の走査で得る。
+    """
+    cov = np.zeros(len(answers))
+    run = np.zeros(len(answers), dtype=np.int64)
+    for i, (ans, kw) in enumerate(zip(answers, kw_csvs)):
+        m = matcher(kw, normalize)
+        if not m.keywords:
+            continue
+        found = m.find(ans)
+        cov[i] = keyword_coverage(ans, found)
+        run[i] = max_keyword_run(ans, found)
+    return cov, run
+
+
+def score_answers(answers: Sequence[str], kw_csvs: Sequence[str]) -> np.ndarray:
+    """score_answer の列版（キーワードが無い行は 0.0）。"""
+    hits, nkeys = keyword_hits([a or "" for a in answers], [k or "" for k in kw_csvs])
+    return np.divide(hits, nkeys, out=np.zeros(len(hits)), where=nkeys > 0)
+
+
+def contains_all_column(answers: Sequence[str], kw_csvs: Sequence[str]) -> np.ndarray:
+    hits, nkeys = keyword_hits(answers, kw_csvs)
+    return hits == nkeys
+
+
+def text_lengths(col: Sequence[str]) -> np.ndarray:
+    return np.fromiter((len(s) for s in col), dtype=np.int64, count=len(col))
+
+
+# ---------- ベンチマーク ----------
+def _bench(n: int) -> None:
+    import random
+
+    import pandas as pd
+
+    rng = random.Random(0)
+    words = ["Azure", "OpenAI", "Search", "RAG", "低コスト", "高速", "インデックス", "ベクトル",
+             "サービス", "モデル", "生成", "検索", "評価", "プロンプト", "キーワード"] + [f"w{i}" for i in range(500)]
+    kwsets = ["Azure,OpenAI", "低コスト,高速", "RAG,検索,ベクトル", "インデックス", "プロンプト,評価"]
+
+    def sent(k: int) -> str:
+        return "、".join(rng.choice(words) for _ in range(k)) + "。"
+
+    df = pd.DataFrame({
+        "keywords": [rng.choice(kwsets) for _ in range(n)],
+        "base_answer": [sent(rng.randint(3, 15)) for _ in range(n)],
+        "improved_answer": [sent(rng.randint(3, 15)) for _ in range(n)],
+        "expected": [sent(rng.randint(3, 10)) for _ in range(n)],
+    })
+
+    # 旧実装（analyze_day6.py の iterrows ループ＋ eval_prompts.py の score_answer をそのまま）
+    def old_tok(s):
+        return [w for w in re.findall(r"\w+|[一-龠ぁ-んァ-ン]+", str(s))]
+
+    def old_jaccard(a, b):
+        A, B = set(old_tok(a)), set(old_tok(b))
+        return len(A & B) / max(1, len(A | B))
+
+    def old_contains_all(ans, kw_csv):
+        kws = [k.strip() for k in str(kw_csv).split(",") if k.strip()]
+        return all(k in str(ans) for k in kws)
+
+    def old_score_answer(ans, keywords_csv):
+        ans = ans or ""
+        keys = [k.strip() for k in (keywords_csv or "").split(",") if k.strip()]
+        if not keys:
+            return 0.0
+        return sum(1 for k in keys if k in ans) / len(keys)
+
+    t0 = time.perf_counter()
+    legacy = []
+    for _, r in df.iterrows():
+        exp, base, impv = r.get("keywords", ""), r.get("base_answer", ""), r.get("improved_answer", "")
+        legacy.append((len(base), len(impv), old_contains_all(base, exp), old_contains_all(impv, exp),
+                       old_jaccard(r.get("expected", ""), base), old_jaccard(r.get("expected", ""), impv),
+                       old_score_answer(base, exp)))
+    t_legacy = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    kw = [str(x) for x in df["keywords"]]
+    base = [str(x) for x in df["base_answer"]]
+    impv = [str(x) for x in df["improved_answer"]]
+    exp = [str(x) for x in df["expected"]]
+    vocab = Vocab()
+    cols = (text_lengths(base), text_lengths(impv),
+            contains_all_column(base, kw), contains_all_column(impv, kw),
+            jaccard_columns(exp, base, vocab), jaccard_columns(exp, impv, vocab),
+            score_answers(base, kw))
+    t_vec = time.perf_counter() - t0
+
+    new = list(zip(*(c.tolist() for c in cols)))
+    same = new == [tuple(r) for r in legacy]
+    print(f"rows={n}  legacy={t_legacy:.2f}s  vectorized={t_vec:.2f}s  "
+          f"speedup=x{t_legacy / max(t_vec, 1e-9):.1f}  identical={same}")
+    if not same:
+        raise SystemExit("[ERROR] 旧実装と結果が一致しません。")
+
+
+if __name__ == "__main__":
+    import argparse
+    ap = argparse.ArgumentParser(description="Day6 scoring benchmark")
+    ap.add_argument("--bench", type=int, default=100000, help="合成データの行数")
+    _bench(ap.parse_args().bench)
@@ -2,6 +2,9 @@ import json, os, logging
 import azure.functions as func
 from openai import AzureOpenAI
 
+from shared_code import response_cache
+from shared_code.response_cache import CACHE, cache_key
+
 client = AzureOpenAI(
     api_key=os.environ.get("AZURE_OPENAI_API_KEY"),
     azure_endpoint=os.environ.get("AZURE_OPENAI_ENDPOINT"),
@@ -20,7 +23,7 @@ def _build_messages(prompt, messages):
 
 def main(req: func.HttpRequest) -> func.HttpResponse:
     try:
-        body = req.get_json(silent=True) or {}
+        body = req.get_json() or {}
     except ValueError:
         body = {}
 
@@ -29,13 +32,13 @@ def main(req: func.HttpRequest) -> func.HttpResponse:
     temperature = float(body.get("temperature", 0.2))
     model = os.environ.get("AZURE_OPENAI_DEPLOYMENT")
 
-    try:
+    def call_upstream():
         resp = client.chat.completions.create(
             model=model, messages=messages, temperature=temperature
         )
         msg = resp.choices[0].message
         usage = getattr(resp, "usage", None)
-        data = {
+        return {
             "answer": getattr(msg, "content", ""),
             "role": getattr(msg, "role", "assistant"),
             "model": model,
@@ -45,9 +48,15 @@ def main(req: func.HttpRequest) -> func.HttpResponse:
                 "total_tokens": getattr(usage, "total_tokens", None),
             },
         }
+
+    try:
+        # 同じ messages / model / temperature は応答キャッシュ・実行中の呼び出しへの合流で返す
+        key = cache_key(messages, model, temperature)
+        bypass = "no-cache" in (req.headers.get("Cache-Control") or "")
+        data, status = CACHE.get_or_call(key, temperature, call_upstream, bypass=bypass)
         return func.HttpResponse(
             json.dumps(data, ensure_ascii=False),
-            headers={"Content-Type": "application/json"},
+            headers={"Content-Type": "application/json", **response_cache.headers(key, status)},
             status_code=200,
         )
     except Exception as e:
@@ -1,47 +1,44 @@
-import os, json
+import os, json, logging
 import azure.functions as func
-from openai import AzureOpenAI
+import openai
+
+from shared_code.aoai_client import ASYNC_REGISTRY, REGISTRY, get_async_client, get_client
+from shared_code import response_cache
+from shared_code.concurrency import GATE, Shed, upstream_retry_after
+from shared_code.prompt import build_messages
+from shared_code.response_cache import CACHE, cache_key
+from shared_code.timing import Timings
 
 app = func.FunctionApp(http_auth_level=func.AuthLevel.ANONYMOUS)
 
-@app.route(route="chat", methods=["GET","POST"])
-def chat(req: func.HttpRequest) -> func.HttpResponse:
-    # --- ① ここを追記：エンドポイント整形（改行/空白対策＋末尾スラッシュ保証） ---
-    ep = (os.getenv("AZURE_OPENAI_ENDPOINT") or "").strip()
-    if not ep.endswith("/"):
-        ep += "/"
-    # ---------------------------------------------------------------------------
+# ストリーミング（SSE）版は別アプリ ../functions-openai-stream の /api/chat/stream
+# （HTTP ストリーミング拡張を入れるとアプリ内の全 HTTP トリガーの型が変わるため同居させない）
 
-    client = AzureOpenAI(
-        api_key=os.environ.get("AZURE_OPENAI_API_KEY"),
-        azure_endpoint=ep,  # ← ここを ep に変更
-        api_version=os.environ.get("OPENAI_API_VERSION", "2024-07-18"),
-    )
+# 非同期版（/api/achat）の上流タイムアウト（秒）
+UPSTREAM_TIMEOUT = float(os.getenv("AOAI_UPSTREAM_TIMEOUT", "30") or "30")
 
+def _request_messages(req: func.HttpRequest) -> tuple:
     try:
         body = req.get_json()
     except ValueError:
         body = {}
 
-    prompt = body.get("prompt") or req.params.get("prompt") or "こんにちは！"
-    messages = [
-        {"role":"system","content": os.getenv(
-            "SYSTEM_PROMPT",
-            "あなたは日本語で簡潔に答えるアシスタントです。常に日本語で1文で回答してください。"
-        )},
-        {"role":"user","content": prompt},
-    ]
-
-    resp = client.chat.completions.create(
-        model=os.environ.get("AZURE_OPENAI_DEPLOYMENT"),
-        messages=messages,
-        temperature=float(body.get("temperature",0.2))
+    prompt = body.get("prompt") or req.params.get("prompt")
+    return body, build_messages(prompt)
+
+def _json_response(data: dict, status_code: int = 200, headers: dict | None = None) -> func.HttpResponse:
+    return func.HttpResponse(
+        json.dumps(data, ensure_ascii=False),
+        mimetype="application/json",
+        headers={"Content-Type": "application/json; charset=utf-8", **(headers or {})},
+        status_code=status_code
     )
-    usage = getattr(resp, "usage", None)
 
-    data = {
+def _answer(resp, model: str | None) -> dict:
+    usage = getattr(resp, "usage", None)
+    return {
         "answer": resp.choices[0].message.content,
-        "model": os.environ.get("AZURE_OPENAI_DEPLOYMENT"),
+        "model": model,
         "usage": {
             "prompt_tokens": getattr(usage,"prompt_tokens",None),
             "completion_tokens": getattr(usage,"completion_tokens",None),
@@ -49,10 +46,106 @@ def chat(req: func.HttpRequest) -> func.HttpResponse:
         },
     }
 
+@app.route(route="chat", methods=["GET","POST"])
+def chat(req: func.HttpRequest) -> func.HttpResponse:
+    t = Timings()
+    # --- ① クライアントはプロセス内で使い回す（エンドポイント整形・設定変更時の作り直しは
+    #        shared_code/aoai_client.py。ウォーム時は接続プールのキープアライブも効く） ---
+    with t.span("acquire"):
+        client, reused = get_client()
+    # ---------------------------------------------------------------------------
+
+    body, messages = _request_messages(req)
+    model = os.environ.get("AZURE_OPENAI_DEPLOYMENT")
+    temperature = float(body.get("temperature",0.2))
+
+    def call_upstream() -> dict:
+        with t.span("upstream"):
+            resp = client.chat.completions.create(
+                model=model,
+                messages=messages,
+                temperature=temperature
+            )
+        return _answer(resp, model)
+
+    # --- ③ 応答キャッシュ＋同時リクエストの合流（shared_code/response_cache.py） ---
+    key = cache_key(messages, model, temperature)
+    bypass = "no-cache" in (req.headers.get("Cache-Control") or "")
+    with t.span("cache"):
+        data, cache_status = CACHE.get_or_call(key, temperature, call_upstream, bypass=bypass)
+    with t.span("serialize"):
+        payload = json.dumps(data, ensure_ascii=False)
+    # 区間ごとの所要時間（ms）。Server-Timing ヘッダとログに出す
+    logging.info("chat timings=%s client_reused=%s cache=%s", t.as_dict(), reused, cache_status)
+
     # --- ② ここを追記：charset=utf-8 を明示して文字化け防止 ---
     return func.HttpResponse(
-        json.dumps(data, ensure_ascii=False),
+        payload,
         mimetype="application/json",
-        headers={"Content-Type": "application/json; charset=utf-8"},
+        headers={
+            "Content-Type": "application/json; charset=utf-8",
+            "Server-Timing": t.header(),
+            "X-Client-Reused": "1" if reused else "0",
+            **response_cache.headers(key, cache_status),
+        },
         status_code=200
     )
+
+@app.route(route="achat", methods=["GET","POST"])
+async def chat_async(req: func.HttpRequest) -> func.HttpResponse:
+    # 非同期版: 上流を待つ間ワーカースレッドを占有しない（AsyncAzureOpenAI）。
+    # 同時呼び出しは GATE で制限し、満杯・上流 429 はすぐに 429 + Retry-After を返す
+    t = Timings()
+    with t.span("acquire"):
+        client, reused = get_async_client()
+    body, messages = _request_messages(req)
+    model = os.environ.get("AZURE_OPENAI_DEPLOYMENT")
+    temperature = float(body.get("temperature",0.2))
+
+    async def call_upstream() -> dict:
+        async with GATE.slot():
+            with t.span("upstream"):
+                try:
+                    resp = await client.chat.completions.create(
+                        model=model,
+                        messages=messages,
+                        temperature=temperature,
+                        timeout=UPSTREAM_TIMEOUT
+                    )
+                except openai.RateLimitError as e:
+                    GATE.counts["shed_upstream"] += 1
+                    raise Shed("upstream rate limited", upstream_retry_after(e.response.headers)) from e
+        return _answer(resp, model)
+
+    key = cache_key(messages, model, temperature)
+    bypass = "no-cache" in (req.headers.get("Cache-Control") or "")
+    try:
+        with t.span("cache"):
+            data, cache_status = await CACHE.aget_or_call(key, temperature, call_upstream, bypass=bypass)
+    except Shed as e:
+        return _json_response({"error": e.reason, "retry_after": e.retry_after}, 429,
+                              {"Retry-After": str(max(1, round(e.retry_after))), "Server-Timing": t.header()})
+    except openai.APITimeoutError:
+        GATE.counts["timeouts"] += 1
+        return _json_response({"error": f"upstream timeout ({UPSTREAM_TIMEOUT:.0f}s)"}, 504,
+                              {"Server-Timing": t.header()})
+    except openai.APIError as e:
+        # 上流のエラー応答・接続エラー（リセットなど）
+        logging.warning("upstream error: %s", e)
+        return _json_response({"error": str(e)}, 502, {"Server-Timing": t.header()})
+
+    with t.span("serialize"):
+        resp = _json_response(data, 200, {
+            "X-Client-Reused": "1" if reused else "0",
+            **response_cache.headers(key, cache_status),
+        })
+    resp.headers["Server-Timing"] = t.header()
+    logging.info("achat timings=%s client_reused=%s cache=%s", t.as_dict(), reused, cache_status)
+    return resp
+
+@app.route(route="chat/stats", methods=["GET"])
+def chat_stats(req: func.HttpRequest) -> func.HttpResponse:
+    # キャッシュ（ヒット / 合流 / ミス）・同時実行制御・クライアント再利用の件数（インスタンス単位）
+    data = {"cache": CACHE.stats(), "gate": GATE.stats(),
+            "clients": REGISTRY.stats(), "async_clients": ASYNC_REGISTRY.stats()}
+    return _json_response(data)
@@ -0,0 +1 @@
+# 関数間で共有するモジュール（function_app.py / chat/__init__.py から import）
@@ -0,0 +1,172 @@
+# shared_code/aoai_client.py
+# AzureOpenAI クライアントのプロセス内レジストリ
+# - (エンドポイント, api-version, キー) ごとに 1 つだけ作り、呼び出し間で使い回す（遅延初期化）
+# - HTTP はキープアライブ付きの接続プール（AOAI_POOL_SIZE / AOAI_KEEPALIVE_SEC / AOAI_TIMEOUT）
+# - 設定（環境変数）が変わったら次の呼び出しで新しいクライアントに切り替える（ホットリロード）。
+#   古いクライアントは実行中の呼び出しを邪魔しないよう猶予時間の後（以降の get() のたびに確認）に閉じる。
+#   非同期クライアントは作ったイベントループの上で閉じる
+# - 非同期版（AsyncAzureOpenAI）はイベントループごとに持つ。429 は呼び出し側で即座に返せるよう
+#   SDK 内のリトライは既定で無効（AOAI_ASYNC_MAX_RETRIES）
+# 使い方:
+#   from shared_code.aoai_client import get_client, get_async_client
+#   client, reused = get_client()
+#   aclient, reused = get_async_client()   # async 関数の中で
+
+import asyncio
+import hashlib
+import inspect
+import logging
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, List, NamedTuple, Tuple
+
+import httpx
+from openai import AsyncAzureOpenAI, AzureOpenAI, DefaultAsyncHttpxClient, DefaultHttpxClient
+
+DEFAULT_API_VERSION = "2024-07-18"
+
+
+class Settings(NamedTuple):
+    endpoint: str
+    api_version: str
+    api_key: str
+
+    @property
+    def key(self) -> Tuple[str, str, str]:
+        # レジストリのキー（API キーそのものは持たずハッシュにする）
+        return (self.endpoint, self.api_version,
+                hashlib.sha256(self.api_key.encode("utf-8")).hexdigest()[:16])
+
+
+def current_settings() -> Settings:
+    """環境変数から接続設定を読む（エンドポイントは改行/空白を除き、末尾スラッシュを保証）。"""
+    ep = (os.getenv("AZURE_OPENAI_ENDPOINT") or "").strip()
+    if not ep.endswith("/"):
+        ep += "/"
+    return Settings(ep, (os.getenv("OPENAI_API_VERSION") or DEFAULT_API_VERSION).strip(),
+                    (os.getenv("AZURE_OPENAI_API_KEY") or "").strip())
+
+
+def _pool_options() -> Dict[str, Any]:
+    pool = int(os.getenv("AOAI_POOL_SIZE", "20") or "20")
+    return {
+        "limits": httpx.Limits(max_connections=pool, max_keepalive_connections=pool,
+                               keepalive_expiry=float(os.getenv("AOAI_KEEPALIVE_SEC", "60") or "60")),
+        "timeout": httpx.Timeout(float(os.getenv("AOAI_TIMEOUT", "60") or "60"), connect=5.0),
+    }
+
+
+def _new_client(s: Settings) -> AzureOpenAI:
+    return AzureOpenAI(api_key=s.api_key, azure_endpoint=s.endpoint, api_version=s.api_version,
+                       http_client=DefaultHttpxClient(**_pool_options()))
+
+
+def _new_async_client(s: Settings) -> AsyncAzureOpenAI:
+    return AsyncAzureOpenAI(api_key=s.api_key, azure_endpoint=s.endpoint, api_version=s.api_version,
+                            http_client=DefaultAsyncHttpxClient(**_pool_options()),
+                            max_retries=int(os.getenv("AOAI_ASYNC_MAX_RETRIES", "0") or "0"))
+
+
+def _close(client: Any, loop: asyncio.AbstractEventLoop | None = None) -> None:
+    try:
+        res = client.close()
+        if not inspect.isawaitable(res):
+            return
+        # 非同期クライアントは作ったループで閉じる（そのループが止まっていれば GC に任せる）
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if loop is not None and loop is running:
+            loop.create_task(res)
+        elif loop is not None and loop.is_running() and not loop.is_closed():
+            asyncio.run_coroutine_threadsafe(res, loop)
+        else:
+            res.close()
+    except Exception:
+        pass
+
+
+class ClientRegistry:
+    def __init__(self, factory: Callable[[Settings], Any] = _new_client,
+                 retire_grace_sec: float = 120.0):
+        self.factory = factory
+        self.retire_grace_sec = retire_grace_sec
+        self._clients: Dict[Tuple[Any, ...], Any] = {}
+        self._current: Tuple[Any, ...] | None = None
+        self._owners: Dict[Tuple[Any, ...], Any] = {}  # キー → クライアントを作ったイベントループ
+        self._retired: List[Tuple[float, Any, Any]] = []
+        self._lock = threading.Lock()
+        self.created = 0
+        self.reused = 0
+        self.reloads = 0
+
+    def get(self, settings: Settings | None = None, scope: Any = None,
+            owner: asyncio.AbstractEventLoop | None = None) -> Tuple[Any, bool]:
+        """
+        (クライアント, 使い回したか)。設定（と scope）が前回と違えば作り直して旧クライアントを退役させる。
+        scope は非同期クライアントのイベントループなど、設定以外で分けたいもの。
+        owner はクライアントを作ったイベントループ（退役後はそのループ上で閉じる）。
+        """
+        s = settings or current_settings()
+        key = s.key + (scope,)
+        with self._lock:
+            if self._retired:
+                self._close_retired()
+            client = self._clients.get(key)
+            if client is not None and key == self._current:
+                self.reused += 1
+                return client, True
+            if client is None:
+                client = self.factory(s)
+                self._clients[key] = client
+                self._owners[key] = owner
+                self.created += 1
+            if self._current is not None and self._current != key:
+                old = self._clients.pop(self._current, None)
+                old_owner = self._owners.pop(self._current, None)
+                if old is not None:
+                    self._retired.append((time.monotonic(), old, old_owner))
+                self.reloads += 1
+                logging.info("aoai client reloaded: endpoint=%s api_version=%s", s.endpoint, s.api_version)
+            self._current = key
+            return client, False
+
+    def _close_retired(self) -> None:
+        now = time.monotonic()
+        keep = []
+        for t, c, loop in self._retired:
+            if now - t >= self.retire_grace_sec:
+                _close(c, loop)
+            else:
+                keep.append((t, c, loop))
+        self._retired = keep
+
+    def close_all(self) -> None:
+        with self._lock:
+            for key, c in self._clients.items():
+                _close(c, self._owners.get(key))
+            for _, c, loop in self._retired:
+                _close(c, loop)
+            self._clients.clear()
+            self._owners.clear()
+            self._retired.clear()
+            self._current = None
+
+    def stats(self) -> Dict[str, int]:
+        return {"created": self.created, "reused": self.reused, "reloads": self.reloads}
+
+
+REGISTRY = ClientRegistry()
+ASYNC_REGISTRY = ClientRegistry(factory=_new_async_client)
+
+
+def get_client() -> Tuple[AzureOpenAI, bool]:
+    return REGISTRY.get()
+
+
+def get_async_client() -> Tuple[AsyncAzureOpenAI, bool]:
+    # 非同期クライアントの接続プールはイベントループに紐づくので、ループごとに分ける
+    loop = asyncio.get_running_loop()
+    return ASYNC_REGISTRY.get(scope=id(loop), owner=loop)
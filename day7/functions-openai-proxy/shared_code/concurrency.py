@@ -0,0 +1,101 @@
+# shared_code/concurrency.py
+# 非同期プロキシの同時実行制御（インスタンス単位）
+# - 上流への同時呼び出しを AOAI_MAX_CONCURRENCY 件（既定 16）に制限する
+# - 空きが無ければ AOAI_QUEUE_WAIT_MS（既定 0 = 待たない）だけ待ち、それでも空かなければ
+#   すぐに 429 を返す（Shed）。ワーカーを上流の待ちで埋めない
+# - 上流の 429 は Retry-After をそのまま返せるよう Shed に変換する（upstream_retry_after）
+
+import asyncio
+import os
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Dict
+
+
+class Shed(Exception):
+    """呼び出しを断った（ローカルの満杯 or 上流の 429）。retry_after は秒。"""
+
+    def __init__(self, reason: str, retry_after: float):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+def upstream_retry_after(headers: Any, default: float = 1.0) -> float:
+    """retry-after-ms / retry-after（秒）ヘッダを読む。"""
+    try:
+        ms = headers.get("retry-after-ms")
+        if ms:
+            return float(ms) / 1000.0
+        sec = headers.get("retry-after")
+        if sec:
+            return float(sec)
+    except (TypeError, ValueError, AttributeError):
+        pass
+    return default
+
+
+class ConcurrencyGate:
+    def __init__(self, limit: int = 16, queue_wait_sec: float = 0.0, shed_retry_after: float = 1.0):
+        self.limit = max(1, limit)
+        self.queue_wait_sec = queue_wait_sec
+        self.shed_retry_after = shed_retry_after
+        # Semaphore はイベントループごとに作る
+        self._sems: Dict[int, asyncio.Semaphore] = {}
+        self.inflight = 0
+        self.peak = 0
+        self.counts = {"admitted": 0, "shed_local": 0, "shed_upstream": 0, "timeouts": 0}
+
+    def _sem(self) -> asyncio.Semaphore:
+        loop_id = id(asyncio.get_running_loop())
+        sem = self._sems.get(loop_id)
+        if sem is None:
+            sem = self._sems[loop_id] = asyncio.Semaphore(self.limit)
+        return sem
+
+    async def acquire(self) -> asyncio.Semaphore:
+        """
+        空きを 1 つ取る（取れなければ Shed）。戻り値は release に渡す。
+        ストリーミング応答のように with で囲めない所（応答を返した後も上流を読み続ける）で使う。
+        """
+        sem = self._sem()
+        if not sem.locked():
+            await sem.acquire()
+        elif self.queue_wait_sec > 0:
+            try:
+                await asyncio.wait_for(sem.acquire(), self.queue_wait_sec)
+            except asyncio.TimeoutError:
+                self.counts["shed_local"] += 1
+                raise Shed("proxy concurrency limit reached", self.shed_retry_after) from None
+        else:
+            self.counts["shed_local"] += 1
+            raise Shed("proxy concurrency limit reached", self.shed_retry_after)
+        self.counts["admitted"] += 1
+        self.inflight += 1
+        self.peak = max(self.peak, self.inflight)
+        return sem
+
+    def release(self, sem: asyncio.Semaphore) -> None:
+        self.inflight -= 1
+        sem.release()
+
+    @asynccontextmanager
+    async def slot(self) -> AsyncIterator[None]:
+        sem = await self.acquire()
+        try:
+            yield
+        finally:
+            self.release(sem)
+
+    def stats(self) -> Dict[str, Any]:
+        return {"limit": self.limit, "inflight": self.inflight, "peak": self.peak, **self.counts}
+
+
+def from_env() -> ConcurrencyGate:
+    return ConcurrencyGate(
+        limit=int(os.getenv("AOAI_MAX_CONCURRENCY", "16") or "16"),
+        queue_wait_sec=float(os.getenv("AOAI_QUEUE_WAIT_MS", "0") or "0") / 1000.0,
+        shed_retry_after=float(os.getenv("AOAI_SHED_RETRY_AFTER", "1") or "1"),
+    )
+
+
+GATE = from_env()
@@ -0,0 +1,14 @@
+# shared_code/prompt.py
+# プロキシが上流に送る messages の組み立て（chat / achat / chat/stream で共通）
+
+import os
+from typing import Dict, List
+
+DEFAULT_SYSTEM_PROMPT = "あなたは日本語で簡潔に答えるアシスタントです。常に日本語で1文で回答してください。"
+
+
+def build_messages(prompt: str | None) -> List[Dict[str, str]]:
+    return [
+        {"role": "system", "content": os.getenv("SYSTEM_PROMPT", DEFAULT_SYSTEM_PROMPT)},
+        {"role": "user", "content": prompt or "こんにちは！"},
+    ]
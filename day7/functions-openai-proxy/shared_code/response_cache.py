@@ -0,0 +1,284 @@
+# shared_code/response_cache.py
+# プロキシの応答キャッシュ＋同一リクエストの合流（single-flight）
+# - キーは正規化した messages（role / 前後空白・連続空白を除いた content）・モデル・temperature
+# - temperature=0 の応答は RESPONSE_CACHE_TTL 秒（既定 300）保存。temperature>0 は
+#   RESPONSE_CACHE_TTL_NONZERO（既定 0 = 保存しない）
+# - 同じキーの呼び出しが実行中なら上流には送らず、その結果を待って共有する（インスタンス内。
+#   temperature>0 でも「同時に来た同一リクエスト」だけは同じ回答になる。RESPONSE_COALESCE=0 で無効）
+# - 保存先は既定でインスタンス内メモリ（LRU, RESPONSE_CACHE_MAX 件）。
+#   RESPONSE_CACHE_URL=redis://localhost:6379/0 で Redis 互換サーバ（要 pip install redis）
+#   （async 版は Redis の呼び出しを別スレッドで行い、イベントループを止めない）
+# - 状態は X-Cache ヘッダ（HIT / MISS / COALESCED / BYPASS）で返し、件数は stats() で見る
+# 使い方:
+#   from shared_code.response_cache import CACHE, cache_key
+#   data, status = CACHE.get_or_call(cache_key(messages, model, temperature), temperature, call_upstream)
+#   data, status = await CACHE.aget_or_call(key, temperature, async_call_upstream)   # async 版
+
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, List, Tuple
+
+try:  # Redis 互換バックエンドは任意
+    import redis
+except ImportError:  # pragma: no cover
+    redis = None
+
+
+def _norm_text(s: Any) -> str:
+    return " ".join(str(s or "").split())
+
+
+def cache_key(messages: List[Dict[str, Any]], model: str | None, temperature: float) -> str:
+    norm = [{"role": _norm_text(m.get("role")).lower(), "content": _norm_text(m.get("content"))}
+            for m in messages if isinstance(m, dict)]
+    raw = json.dumps({"m": norm, "model": model or "", "t": round(float(temperature), 4)},
+                     ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+# ========= バックエンド =========
+class MemoryBackend:
+    """インスタンス内の LRU（期限付き）。"""
+
+    def __init__(self, max_items: int = 1000):
+        self.max_items = max_items
+        self._data: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Any:
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            if item[0] < time.time():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return item[1]
+
+    def set(self, key: str, value: Any, ttl: float) -> None:
+        with self._lock:
+            self._data[key] = (time.time() + ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_items:
+                self._data.popitem(last=False)
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+class RedisBackend:
+    """Redis 互換サーバ（インスタンス間で共有）。接続エラーはミス扱いで上流に流す。"""
+
+    def __init__(self, url: str, prefix: str = "aoai-proxy:"):
+        if redis is None:
+            raise ImportError("RESPONSE_CACHE_URL には redis パッケージが必要です（pip install redis）。")
+        self.client = redis.Redis.from_url(url, socket_timeout=0.5, socket_connect_timeout=0.5)
+        self.prefix = prefix
+
+    def get(self, key: str) -> Any:
+        try:
+            raw = self.client.get(self.prefix + key)
+        except redis.RedisError as e:
+            logging.warning("response cache get failed: %s", e)
+            return None
+        return json.loads(raw) if raw else None
+
+    def set(self, key: str, value: Any, ttl: float) -> None:
+        try:
+            self.client.set(self.prefix + key, json.dumps(value, ensure_ascii=False), ex=max(1, int(ttl)))
+        except redis.RedisError as e:
+            logging.warning("response cache set failed: %s", e)
+
+
+# ========= キャッシュ本体 =========
+class _LeaderCancelled(Exception):
+    """async の合流で先行の呼び出しがキャンセルされた（待っている側は自分で呼び直す）。"""
+
+
+class _Flight:
+    def __init__(self) -> None:
+        self.event = threading.Event()
+        self.value: Any = None
+        self.error: BaseException | None = None
+
+
+class ResponseCache:
+    def __init__(self, backend: Any, ttl: float = 300.0, nonzero_ttl: float = 0.0,
+                 coalesce: bool = True, wait_timeout: float = 120.0):
+        self.backend = backend
+        self.ttl = ttl
+        self.nonzero_ttl = nonzero_ttl
+        self.coalesce = coalesce
+        self.wait_timeout = wait_timeout
+        self._inflight: Dict[str, _Flight] = {}
+        self._ainflight: Dict[Tuple[int, str], "asyncio.Future[Any]"] = {}
+        self._lock = threading.Lock()
+        self.counts = {"hit": 0, "miss": 0, "coalesced": 0, "bypass": 0, "errors": 0}
+
+    def ttl_for(self, temperature: float) -> float:
+        return self.ttl if float(temperature) == 0.0 else self.nonzero_ttl
+
+    def _count(self, name: str) -> None:
+        with self._lock:
+            self.counts[name] += 1
+
+    def get_or_call(self, key: str, temperature: float, fn: Callable[[], Any],
+                    bypass: bool = False) -> Tuple[Any, str]:
+        """
+        (値, 状態)。状態は "hit" / "miss" / "coalesced" / "bypass"。
+        bypass=True（Cache-Control: no-cache）はキャッシュを読まずに上流へ送り、結果は保存する。
+        """
+        ttl = self.ttl_for(temperature)
+        if bypass:
+            self._count("bypass")
+            value = fn()
+            if ttl > 0:
+                self.backend.set(key, value, ttl)
+            return value, "bypass"
+        if ttl > 0:
+            value = self.backend.get(key)
+            if value is not None:
+                self._count("hit")
+                return value, "hit"
+        if not self.coalesce:
+            self._count("miss")
+            value = fn()
+            if ttl > 0:
+                self.backend.set(key, value, ttl)
+            return value, "miss"
+
+        with self._lock:
+            flight = self._inflight.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._inflight[key] = _Flight()
+        if not leader:
+            # 実行中の同じ呼び出しの結果を待つ（失敗ならその例外をそのまま返す）
+            if not flight.event.wait(self.wait_timeout):
+                raise TimeoutError("coalesced upstream call did not finish in time")
+            if flight.error is not None:
+                raise flight.error
+            self._count("coalesced")
+            return flight.value, "coalesced"
+        try:
+            self._count("miss")
+            flight.value = fn()
+            if ttl > 0:
+                self.backend.set(key, flight.value, ttl)
+            return flight.value, "miss"
+        except BaseException as e:
+            flight.error = e
+            self._count("errors")
+            raise
+        finally:
+            flight.event.set()
+            with self._lock:
+                self._inflight.pop(key, None)
+
+    async def _aget(self, key: str) -> Any:
+        # Redis などの同期クライアントはイベントループを止めないよう別スレッドで呼ぶ
+        if isinstance(self.backend, MemoryBackend):
+            return self.backend.get(key)
+        return await asyncio.to_thread(self.backend.get, key)
+
+    async def _aset(self, key: str, value: Any, ttl: float) -> None:
+        if isinstance(self.backend, MemoryBackend):
+            self.backend.set(key, value, ttl)
+        else:
+            await asyncio.to_thread(self.backend.set, key, value, ttl)
+
+    async def aget_or_call(self, key: str, temperature: float, fn: Callable[[], Awaitable[Any]],
+                           bypass: bool = False) -> Tuple[Any, str]:
+        """get_or_call の async 版（合流はイベントループ内の Future で待つ）。"""
+        ttl = self.ttl_for(temperature)
+        if bypass:
+            self._count("bypass")
+            value = await fn()
+            if ttl > 0:
+                await self._aset(key, value, ttl)
+            return value, "bypass"
+        if ttl > 0:
+            value = await self._aget(key)
+            if value is not None:
+                self._count("hit")
+                return value, "hit"
+        if not self.coalesce:
+            self._count("miss")
+            value = await fn()
+            if ttl > 0:
+                await self._aset(key, value, ttl)
+            return value, "miss"
+
+        loop = asyncio.get_running_loop()
+        fkey = (id(loop), key)
+        while True:
+            fut = self._ainflight.get(fkey)
+            if fut is None:
+                break
+            # shield: 待っている側がキャンセルされても先行の呼び出しは止めない。
+            # 先行がキャンセルされたら、最初に戻った待ち手が代わりに呼ぶ（残りはそれを待つ）
+            try:
+                value = await asyncio.shield(fut)
+            except _LeaderCancelled:
+                continue
+            self._count("coalesced")
+            return value, "coalesced"
+        fut = self._ainflight[fkey] = loop.create_future()
+        try:
+            self._count("miss")
+            value = await fn()
+            fut.set_result(value)  # 保存を待たずに待ち手へ渡す
+            if ttl > 0:
+                await self._aset(key, value, ttl)
+            return value, "miss"
+        except asyncio.CancelledError:
+            # 待ち手まではキャンセルしない
+            if not fut.done():
+                fut.set_exception(_LeaderCancelled())
+                fut.exception()
+            raise
+        except Exception as e:
+            self._count("errors")
+            if fut.done():
+                raise
+            fut.set_exception(e)
+            fut.exception()  # 待ち手がいなくても "never retrieved" 警告を出さない
+            raise
+        finally:
+            self._ainflight.pop(fkey, None)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            c = dict(self.counts)
+            c["inflight"] = len(self._inflight) + len(self._ainflight)
+        looked = c["hit"] + c["miss"] + c["coalesced"]
+        c["hit_ratio"] = round((c["hit"] + c["coalesced"]) / looked, 4) if looked else 0.0
+        c["backend"] = type(self.backend).__name__
+        if isinstance(self.backend, MemoryBackend):
+            c["entries"] = len(self.backend)
+        return c
+
+
+def headers(key: str, status: str) -> Dict[str, str]:
+    return {"X-Cache": status.upper(), "X-Cache-Key": key[:12]}
+
+
+def from_env() -> ResponseCache:
+    url = (os.getenv("RESPONSE_CACHE_URL") or "").strip()
+    backend = RedisBackend(url) if url else MemoryBackend(int(os.getenv("RESPONSE_CACHE_MAX", "1000") or "1000"))
+    return ResponseCache(
+        backend,
+        ttl=float(os.getenv("RESPONSE_CACHE_TTL", "300") or "300"),
+        nonzero_ttl=float(os.getenv("RESPONSE_CACHE_TTL_NONZERO", "0") or "0"),
+        coalesce=os.getenv("RESPONSE_COALESCE", "1") not in ("0", "false", "False"),
+    )
+
+
+CACHE = from_env()
@@ -0,0 +1,187 @@
+# shared_code/sse.py
+# チャット応答のストリーミング（Server-Sent Events）
+# - 上流の stream=True の差分（delta）を SSE のイベントとして中継する（フレームワーク非依存）
+#     event: delta  data: {"text": "..."}
+#     event: usage  data: {"model", "finish_reason", "usage", "ttft_ms", "total_ms", "upstream_chunks", "events"}
+#     event: error  data: {"error": "..."}   （送り始めた後に上流が失敗した場合）
+#     event: done   data: [DONE]
+# - 細かい delta は窓（SSE_COALESCE_MS, 既定 50ms）か文字数（SSE_COALESCE_CHARS, 既定 256）でまとめて送る。
+#   最初の 1 件だけは待たずに送る（体感の待ち時間 = 最初のトークンまで）。SSE_COALESCE_MS=0 で delta ごと
+# - 窓は時間で閉じる（次の delta が来なくても窓が過ぎたら溜まった分を送る）
+# - Accept に text/event-stream が無いクライアント向けに、同じ中継を collect() でまとめて 1 つの JSON にできる
+# 使い方:
+#   stream = await client.chat.completions.create(..., **stream_options())
+#   async for frame in sse_frames(relay(stream, model=model)): ...   # bytes
+#   data = await collect(relay(stream, model=model))                  # {"answer", "model", "usage"}
+
+import asyncio
+import json
+import logging
+import os
+import time
+from typing import Any, AsyncIterator, Dict, List, Tuple
+
+
+def coalesce_window_sec(override: Any = None) -> float:
+    """まとめ送りの窓（秒）。override はリクエストの coalesce_ms。"""
+    raw = override if override not in (None, "") else os.getenv("SSE_COALESCE_MS", "50")
+    try:
+        return max(0.0, float(raw) / 1000.0)
+    except (TypeError, ValueError):
+        return 0.05
+
+
+def coalesce_max_chars() -> int:
+    return int(os.getenv("SSE_COALESCE_CHARS", "256") or "256")
+
+
+def stream_options() -> Dict[str, Any]:
+    """chat.completions.create に渡す引数。最後の usage チャンクは SSE_INCLUDE_USAGE=0 で要求しない。"""
+    opts: Dict[str, Any] = {"stream": True}
+    if os.getenv("SSE_INCLUDE_USAGE", "1") not in ("0", "false", "False"):
+        opts["stream_options"] = {"include_usage": True}
+    return opts
+
+
+def accepts_event_stream(accept: str | None) -> bool:
+    """Accept ヘッダに text/event-stream（q>0）があるか。"""
+    for part in (accept or "").split(","):
+        media, *params = [p.strip() for p in part.split(";")]
+        if media.lower() != "text/event-stream":
+            continue
+        for p in params:
+            name, _, value = p.partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    return float(value) > 0
+                except ValueError:
+                    return False
+        return True
+    return False
+
+
+def sse_event(event: str, data: Any) -> bytes:
+    payload = data if isinstance(data, str) else json.dumps(data, ensure_ascii=False)
+    lines = "".join(f"data: {line}\n" for line in payload.split("\n"))
+    return f"event: {event}\n{lines}\n".encode("utf-8")
+
+
+def _usage_dict(usage: Any) -> Dict[str, Any]:
+    return {
+        "prompt_tokens": getattr(usage, "prompt_tokens", None),
+        "completion_tokens": getattr(usage, "completion_tokens", None),
+        "total_tokens": getattr(usage, "total_tokens", None),
+    }
+
+
+# ========= 上流の中継 =========
+async def relay(stream: Any, model: str | None = None, window_sec: float | None = None,
+                max_chars: int | None = None, started: float | None = None
+                ) -> AsyncIterator[Tuple[str, Dict[str, Any]]]:
+    """
+    上流の AsyncStream（ChatCompletionChunk）を ("delta", {...}) … ("usage", {...}) にまとめ直す。
+    途中で止められた（クライアント切断など）ら上流の接続も閉じる。
+    """
+    window = coalesce_window_sec() if window_sec is None else window_sec
+    limit = coalesce_max_chars() if max_chars is None else max_chars
+    started = started or time.perf_counter()
+    buf: List[str] = []
+    size = 0
+    last_flush = started
+    ttft: float | None = None
+    usage: Any = None
+    finish: str | None = None
+    n_chunks = n_events = 0
+
+    def take() -> Tuple[str, Dict[str, Any]]:
+        nonlocal size, last_flush, n_events
+        text = "".join(buf)
+        buf.clear()
+        size = 0
+        last_flush = time.perf_counter()
+        n_events += 1
+        return "delta", {"text": text}
+
+    it = stream.__aiter__()
+    nxt: "asyncio.Future[Any] | None" = None
+    try:
+        while True:
+            if nxt is None:
+                nxt = asyncio.ensure_future(it.__anext__())
+            if buf:
+                # 窓が閉じるまで次の delta を待つ。来なければ溜まった分を先に送る
+                remaining = window - (time.perf_counter() - last_flush)
+                if remaining > 0:
+                    await asyncio.wait({nxt}, timeout=remaining)
+                if not nxt.done():
+                    yield take()
+                    continue
+            try:
+                chunk = await nxt
+            except StopAsyncIteration:
+                break
+            finally:
+                if nxt.done():
+                    nxt = None
+            n_chunks += 1
+            if getattr(chunk, "usage", None) is not None:
+                usage = chunk.usage
+            for choice in getattr(chunk, "choices", None) or []:
+                if getattr(choice, "finish_reason", None):
+                    finish = choice.finish_reason
+                text = getattr(getattr(choice, "delta", None), "content", None)
+                if text:
+                    if ttft is None:
+                        ttft = time.perf_counter() - started
+                    buf.append(text)
+                    size += len(text)
+            if buf and (n_events == 0 or window <= 0 or size >= limit
+                        or time.perf_counter() - last_flush >= window):
+                yield take()
+        if buf:
+            yield take()
+        yield "usage", {
+            "model": model,
+            "finish_reason": finish,
+            "usage": _usage_dict(usage) if usage is not None else None,
+            "ttft_ms": round(ttft * 1000, 1) if ttft is not None else None,
+            "total_ms": round((time.perf_counter() - started) * 1000, 1),
+            "upstream_chunks": n_chunks,
+            "events": n_events,
+        }
+    finally:
+        if nxt is not None and not nxt.done():
+            nxt.cancel()
+        close = getattr(stream, "close", None)
+        if close is not None:
+            try:
+                await close()
+            except Exception:
+                pass
+
+
+async def sse_frames(events: AsyncIterator[Tuple[str, Dict[str, Any]]]) -> AsyncIterator[bytes]:
+    """relay のイベントを SSE のバイト列にする。途中の上流エラーは error イベントにして閉じる。"""
+    try:
+        async for name, data in events:
+            yield sse_event(name, data)
+    except Exception as e:
+        logging.warning("stream aborted: %s", e)
+        yield sse_event("error", {"error": str(e)})
+    yield sse_event("done", "[DONE]")
+
+
+async def collect(events: AsyncIterator[Tuple[str, Dict[str, Any]]]) -> Dict[str, Any]:
+    """relay のイベントを 1 つの応答（/api/chat と同じ形）にまとめる。"""
+    parts: List[str] = []
+    tail: Dict[str, Any] = {}
+    async for name, data in events:
+        if name == "delta":
+            parts.append(data["text"])
+        elif name == "usage":
+            tail = data
+    return {
+        "answer": "".join(parts),
+        "model": tail.get("model"),
+        "usage": tail.get("usage") or _usage_dict(None),
+    }
@@ -0,0 +1,27 @@
+# shared_code/timing.py
+# 1 回の呼び出し内の区間計測（acquire / upstream / serialize など）
+# - Server-Timing ヘッダ（ミリ秒）とログ用の dict を返す
+
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator
+
+
+class Timings:
+    def __init__(self) -> None:
+        self.spans: Dict[str, float] = {}  # 区間名 -> 秒
+
+    @contextmanager
+    def span(self, name: str) -> Iterator[None]:
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.spans[name] = self.spans.get(name, 0.0) + time.perf_counter() - t0
+
+    def as_dict(self) -> Dict[str, float]:
+        return {k: round(v * 1000, 2) for k, v in self.spans.items()}
+
+    def header(self) -> str:
+        """Server-Timing: acquire;dur=0.05, upstream;dur=812.3, ..."""
+        return ", ".join(f"{k};dur={v:.2f}" for k, v in self.as_dict().items())
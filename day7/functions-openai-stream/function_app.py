@@ -0,0 +1,159 @@
+# day7/functions-openai-stream/function_app.py
+# ---------------------------------------------------
+# Day7 OpenAI プロキシのストリーミング版（/api/chat/stream）
+# - 上流の差分を SSE（text/event-stream, chunked）でそのまま流す。体感の待ち時間が
+#   「回答がすべて生成されるまで」から「最初のトークンまで」に縮む
+# - Accept に text/event-stream が無いクライアントには、まとめた JSON（/api/chat と同じ形）を返す
+# - HTTP ストリーミングには azurefunctions-extensions-http-fastapi が必要で、これを import した
+#   アプリは全 HTTP トリガーが FastAPI の Request/Response 型になる。func.HttpRequest の
+#   functions-openai-proxy とは同居できないので別アプリにしている
+# - クライアント / 同時実行制御 / 応答キャッシュ / SSE 中継は functions-openai-proxy/shared_code を使う
+#   （ローカルはパスを通して参照。デプロイ時は shared_code をこのフォルダにコピーする）
+# 設定:
+#   PYTHON_ENABLE_INIT_INDEXING=1（local.settings.json / アプリ設定）
+#   SSE_COALESCE_MS（既定 50）/ SSE_COALESCE_CHARS（既定 256）/ SSE_INCLUDE_USAGE（既定 1）
+#   リクエストの coalesce_ms で窓を上書きできる（0 = delta ごと）
+# 使い方:
+#   func start --port 7072
+#   curl -N -H "Accept: text/event-stream" "http://localhost:7072/api/chat/stream?prompt=自己紹介して"
+# ---------------------------------------------------
+
+import json
+import logging
+import os
+import sys
+import time
+from pathlib import Path
+
+import azure.functions as func
+import openai
+from azurefunctions.extensions.http.fastapi import JSONResponse, Request, Response, StreamingResponse
+from starlette.background import BackgroundTask
+
+PROXY_DIR = Path(__file__).resolve().parents[1] / "functions-openai-proxy"
+if not (Path(__file__).resolve().parent / "shared_code").exists():
+    sys.path.insert(0, str(PROXY_DIR))
+
+from shared_code.aoai_client import ASYNC_REGISTRY, get_async_client
+from shared_code import response_cache
+from shared_code.concurrency import GATE, Shed, upstream_retry_after
+from shared_code.prompt import build_messages
+from shared_code.response_cache import CACHE, cache_key
+from shared_code.sse import accepts_event_stream, coalesce_window_sec, collect, relay, sse_frames, stream_options
+from shared_code.timing import Timings
+
+app = func.FunctionApp(http_auth_level=func.AuthLevel.ANONYMOUS)
+
+# 上流の接続〜最初の応答までのタイムアウト（秒）
+UPSTREAM_TIMEOUT = float(os.getenv("AOAI_UPSTREAM_TIMEOUT", "30") or "30")
+
+
+async def _json_body(req: Request) -> dict:
+    try:
+        body = json.loads(await req.body() or b"{}")
+    except ValueError:
+        body = {}
+    return body if isinstance(body, dict) else {}
+
+
+def _error_response(e: Exception, t: Timings) -> JSONResponse:
+    """上流に送る前 / 送り始める前の失敗を HTTP ステータスにする（/api/achat と同じ対応）。"""
+    if isinstance(e, openai.RateLimitError):
+        GATE.counts["shed_upstream"] += 1
+        e = Shed("upstream rate limited", upstream_retry_after(e.response.headers))
+    if isinstance(e, Shed):
+        return JSONResponse({"error": e.reason, "retry_after": e.retry_after}, 429,
+                            {"Retry-After": str(max(1, round(e.retry_after))), "Server-Timing": t.header()})
+    if isinstance(e, openai.APITimeoutError):
+        GATE.counts["timeouts"] += 1
+        return JSONResponse({"error": f"upstream timeout ({UPSTREAM_TIMEOUT:.0f}s)"}, 504,
+                            {"Server-Timing": t.header()})
+    logging.warning("upstream error: %s", e)
+    return JSONResponse({"error": str(e)}, 502, {"Server-Timing": t.header()})
+
+
+@app.route(route="chat/stream", methods=["GET","POST"])
+async def chat_stream(req: Request) -> Response:
+    started = time.perf_counter()
+    t = Timings()
+    with t.span("acquire"):
+        client, reused = get_async_client()
+    body = await _json_body(req)
+    messages = build_messages(body.get("prompt") or req.query_params.get("prompt"))
+    model = os.environ.get("AZURE_OPENAI_DEPLOYMENT")
+    temperature = float(body.get("temperature",0.2))
+    window = coalesce_window_sec(body.get("coalesce_ms", req.query_params.get("coalesce_ms")))
+    kwargs = dict(model=model, messages=messages, temperature=temperature, timeout=UPSTREAM_TIMEOUT)
+
+    # ---------- SSE を受け付けないクライアント: まとめて JSON（キャッシュ・合流あり） ----------
+    if not accepts_event_stream(req.headers.get("accept")):
+        async def call_upstream() -> dict:
+            async with GATE.slot():
+                with t.span("upstream"):
+                    stream = await client.chat.completions.create(**kwargs, **stream_options())
+                    return await collect(relay(stream, model=model, window_sec=0))
+
+        key = cache_key(messages, model, temperature)
+        bypass = "no-cache" in (req.headers.get("cache-control") or "")
+        try:
+            data, cache_status = await CACHE.aget_or_call(key, temperature, call_upstream, bypass=bypass)
+        except (Shed, openai.APIError) as e:
+            return _error_response(e, t)
+        return JSONResponse(data, 200, {
+            "Server-Timing": t.header(),
+            "X-Client-Reused": "1" if reused else "0",
+            **response_cache.headers(key, cache_status),
+        })
+
+    # ---------- SSE: 最初のチャンクより前の失敗はステータスで返し、以降はイベントで返す ----------
+    try:
+        sem = await GATE.acquire()
+    except Shed as e:
+        return _error_response(e, t)
+    try:
+        with t.span("connect"):
+            stream = await client.chat.completions.create(**kwargs, **stream_options())
+    except openai.APIError as e:
+        GATE.release(sem)
+        return _error_response(e, t)
+    except BaseException:
+        # 接続中の切断（CancelledError）なども枠を返してから伝える
+        GATE.release(sem)
+        raise
+
+    # 上流を読み終える（またはクライアントが切断する）まで同時実行の枠を持つ。
+    # frames() が一度も回らない（応答が送られない）こともあるので、応答後の BackgroundTask からも返す。
+    # 先に呼ばれた方だけが効く
+    released = False
+
+    async def finish() -> None:
+        nonlocal released
+        if released:
+            return
+        released = True
+        GATE.release(sem)
+        logging.info("chat/stream done: elapsed_ms=%.1f client_reused=%s",
+                     (time.perf_counter() - started) * 1000, reused)
+        try:
+            await stream.close()
+        except Exception:
+            pass
+
+    async def frames():
+        try:
+            async for frame in sse_frames(relay(stream, model=model, window_sec=window, started=started)):
+                yield frame
+        finally:
+            await finish()
+
+    return StreamingResponse(frames(), media_type="text/event-stream", background=BackgroundTask(finish), headers={
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no",
+        "Server-Timing": t.header(),
+        "X-Client-Reused": "1" if reused else "0",
+    })
+
+
+@app.route(route="chat/stream/stats", methods=["GET"])
+async def chat_stream_stats(req: Request) -> Response:
+    return JSONResponse({"cache": CACHE.stats(), "gate": GATE.stats(), "async_clients": ASYNC_REGISTRY.stats()})
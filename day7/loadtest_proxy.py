@@ -0,0 +1,199 @@
+# day7/loadtest_proxy.py
+# ---------------------------------------------------
+# Day7 OpenAI プロキシ（functions-openai-proxy）の簡易負荷試験
+# - 既定ではローカルのモック上流（tools/mock_aoai.py）を起動し、関数を同じプロセスで直接呼ぶ
+#     sync : /api/chat  をスレッドプール（Functions の Python ワーカーと同じく --threads 本）で実行
+#     async: /api/achat を 1 つのイベントループで実行（上流待ちでスレッドを占有しない）
+#     stream: functions-openai-stream の /api/chat/stream（SSE）。最初の delta までの時間（TTFT）と完了までを比べる
+# - --url を指定すると起動済みの Functions ホスト（func start）に HTTP で投げる
+# - 毎回別のプロンプトを送る（応答キャッシュ・合流に当たらないように）
+# 使い方:
+#   python day7/loadtest_proxy.py --requests 200 --concurrency 64 --threads 8 --latency fixed:0.5
+#   python day7/loadtest_proxy.py --mode stream --requests 50 --ttft fixed:0.3 --tokens-per-sec 50
+#   python day7/loadtest_proxy.py --url http://localhost:7071/api/achat --requests 200
+# ---------------------------------------------------
+
+import argparse
+import asyncio
+import importlib.util
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import List, Tuple
+
+ROOT = Path(__file__).resolve().parents[1]
+APP_DIR = Path(__file__).resolve().parent / "functions-openai-proxy"
+STREAM_APP = Path(__file__).resolve().parent / "functions-openai-stream" / "function_app.py"
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_mock(latency: str, rpm: int, ttft: str = "fixed:0.05",
+               tokens_per_sec: float = 200.0) -> Tuple[subprocess.Popen, str]:
+    port = _free_port()
+    cmd = [sys.executable, str(ROOT / "tools" / "mock_aoai.py"), "--port", str(port), "--latency", latency,
+           "--ttft", ttft, "--tokens-per-sec", str(tokens_per_sec)]
+    if rpm:
+        cmd += ["--rpm", str(rpm)]
+    proc = subprocess.Popen(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    for _ in range(50):
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.1).close()
+            break
+        except OSError:
+            time.sleep(0.1)
+    return proc, f"http://127.0.0.1:{port}"
+
+
+def _body(i: int) -> bytes:
+    return json.dumps({"prompt": f"負荷試験 {i}", "temperature": 0.2}, ensure_ascii=False).encode("utf-8")
+
+
+def _summary(name: str, results: List[Tuple[int, float]], elapsed: float) -> None:
+    lat = sorted(sec for _, sec in results)
+    codes = Counter(code for code, _ in results)
+    ok = codes.get(200, 0)
+
+    def pct(q: float) -> float:
+        return lat[min(len(lat) - 1, int(q * len(lat)))] * 1000 if lat else 0.0
+
+    print(f"[{name}] requests={len(results)} ok={ok} codes={dict(codes)} elapsed={elapsed:.2f}s "
+          f"throughput={ok / elapsed:.1f} ok/s  p50={pct(0.5):.0f}ms p99={pct(0.99):.0f}ms")
+
+
+# ========= 同一プロセスで関数を直接呼ぶ =========
+def run_sync(fa, func, n: int, threads: int) -> None:
+    handler = fa.chat._function._func
+
+    def one(i: int) -> Tuple[int, float]:
+        t0 = time.perf_counter()
+        r = handler(func.HttpRequest("POST", "/api/chat", body=_body(i)))
+        return r.status_code, time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        results = list(pool.map(one, range(n)))
+    _summary(f"sync  threads={threads}", results, time.perf_counter() - t0)
+
+
+async def run_async(fa, func, n: int, concurrency: int) -> None:
+    handler = fa.chat_async._function._func
+    sem = asyncio.Semaphore(concurrency)
+
+    async def one(i: int) -> Tuple[int, float]:
+        async with sem:
+            t0 = time.perf_counter()
+            r = await handler(func.HttpRequest("POST", "/api/achat", body=_body(i)))
+            return r.status_code, time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    results = await asyncio.gather(*(one(i) for i in range(n)))
+    _summary(f"async concurrency={concurrency}", list(results), time.perf_counter() - t0)
+    print(f"        gate={fa.GATE.stats()}")
+
+
+async def run_stream(n: int, concurrency: int) -> None:
+    # 関数アプリ名が同じ function_app なので、別名で読み込む
+    spec = importlib.util.spec_from_file_location("stream_function_app", STREAM_APP)
+    sa = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(sa)
+    handler = sa.chat_stream._function._func
+    sem = asyncio.Semaphore(concurrency)
+
+    def request(i: int):
+        body = _body(i)
+        scope = {"type": "http", "method": "POST", "path": "/api/chat/stream", "query_string": b"",
+                 "headers": [(b"accept", b"text/event-stream"), (b"content-type", b"application/json")]}
+
+        async def receive():
+            return {"type": "http.request", "body": body, "more_body": False}
+        return sa.Request(scope, receive)
+
+    async def one(i: int) -> Tuple[int, float, float, int]:
+        async with sem:
+            t0 = time.perf_counter()
+            r = await handler(request(i))
+            ttft, events = 0.0, 0
+            if r.status_code == 200:
+                async for frame in r.body_iterator:
+                    if frame.startswith(b"event: delta"):
+                        events += 1
+                        ttft = ttft or time.perf_counter() - t0
+            return r.status_code, ttft, time.perf_counter() - t0, events
+
+    t0 = time.perf_counter()
+    results = await asyncio.gather(*(one(i) for i in range(n)))
+    elapsed = time.perf_counter() - t0
+    _summary(f"stream concurrency={concurrency} (complete)", [(c, total) for c, _, total, _ in results], elapsed)
+    _summary(f"stream concurrency={concurrency} (TTFT)", [(c, ttft) for c, ttft, _, _ in results], elapsed)
+    print(f"        delta events/response={sum(e for *_, e in results) / max(1, len(results)):.1f} "
+          f"gate={sa.GATE.stats()}")
+
+
+# ========= 起動済みホストに HTTP で投げる =========
+async def run_http(url: str, n: int, concurrency: int) -> None:
+    import httpx
+    sem = asyncio.Semaphore(concurrency)
+    async with httpx.AsyncClient(timeout=120, limits=httpx.Limits(max_connections=concurrency)) as client:
+        async def one(i: int) -> Tuple[int, float]:
+            async with sem:
+                t0 = time.perf_counter()
+                r = await client.post(url, content=_body(i), headers={"Content-Type": "application/json"})
+                return r.status_code, time.perf_counter() - t0
+
+        t0 = time.perf_counter()
+        results = await asyncio.gather(*(one(i) for i in range(n)))
+    _summary(f"http {url}", list(results), time.perf_counter() - t0)
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description="Day7 proxy load test (sync vs async)")
+    ap.add_argument("--requests", type=int, default=200)
+    ap.add_argument("--concurrency", type=int, default=64, help="同時クライアント数")
+    ap.add_argument("--threads", type=int, default=8, help="sync 版のワーカースレッド数")
+    ap.add_argument("--latency", default="fixed:0.5", help="モック上流の応答時間（tools/mock_aoai.py の形式）")
+    ap.add_argument("--rpm", type=int, default=0, help="モック上流の RPM 上限（429 の確認用）")
+    ap.add_argument("--ttft", default="fixed:0.05", help="モック上流のストリーミング TTFT（stream 用）")
+    ap.add_argument("--tokens-per-sec", type=float, default=200.0, help="モック上流のストリーミング速度（stream 用）")
+    ap.add_argument("--mode", choices=["both", "sync", "async", "stream"], default="both")
+    ap.add_argument("--url", help="起動済みの Functions ホストに HTTP で投げる（モックは起動しない）")
+    args = ap.parse_args()
+
+    if args.url:
+        asyncio.run(run_http(args.url, args.requests, args.concurrency))
+        return
+
+    proc, endpoint = start_mock(args.latency, args.rpm, args.ttft, args.tokens_per_sec)
+    try:
+        os.environ.update({"AZURE_OPENAI_ENDPOINT": endpoint, "AZURE_OPENAI_API_KEY": "mock",
+                           "AZURE_OPENAI_DEPLOYMENT": os.getenv("AZURE_OPENAI_DEPLOYMENT") or "mock"})
+        os.environ.setdefault("AOAI_MAX_CONCURRENCY", str(args.concurrency))
+        os.environ.setdefault("AOAI_POOL_SIZE", str(args.concurrency))
+        sys.path.insert(0, str(APP_DIR))
+        import azure.functions as func
+        import function_app as fa
+
+        print(f"upstream={endpoint} latency={args.latency} requests={args.requests} "
+              f"concurrency={args.concurrency} max_concurrency={fa.GATE.limit}")
+        if args.mode in ("both", "sync"):
+            run_sync(fa, func, args.requests, args.threads)
+        if args.mode in ("both", "async"):
+            asyncio.run(run_async(fa, func, args.requests, args.concurrency))
+        if args.mode == "stream":
+            asyncio.run(run_stream(args.requests, args.concurrency))
+    finally:
+        proc.terminate()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,10 @@
-﻿import os, json, requests
+﻿import os, json, logging
 from dotenv import load_dotenv
 from openai import AzureOpenAI
 import azure.functions as func
 
+from shared_code.publisher import get_publisher
+
 load_dotenv(r'C:\dev\azure-ai-40days\.env')
 
 client = AzureOpenAI(
@@ -11,11 +13,14 @@ client = AzureOpenAI(
     azure_endpoint=os.getenv('AZURE_OPENAI_ENDPOINT')
 )
 
-def main(req: func.HttpRequest) -> func.HttpResponse:
+def main(req: func.HttpRequest, context: func.Context) -> func.HttpResponse:
     data = req.get_json() if req.get_body() else {}
     prompt = data.get('prompt') or req.params.get('prompt') or '日本語で自己紹介して'
     base = os.getenv('FUNCTIONS_BASE_URL', 'http://localhost:7082')
-    bcast = f'{base}/api/broadcast'
+    # broadcast への送信はバックグラウンドでまとめて行う（shared_code/publisher.py）。
+    # 生成ループはキューに積むだけなので、broadcast の往復時間でストリームが止まらない
+    pub = get_publisher(f'{base}/api/broadcast')
+    sid = context.invocation_id
 
     stream = client.chat.completions.create(
         model=os.getenv('AZURE_OPENAI_DEPLOYMENT', 'gpt4o-mini-chat'),
@@ -25,8 +30,12 @@ def main(req: func.HttpRequest) -> func.HttpResponse:
     for chunk in stream:
         delta = chunk.choices[0].delta.content if chunk.choices and chunk.choices[0].delta else None
         if delta:
-            try: requests.post(bcast, json={'message': delta}, timeout=5)
-            except Exception: pass
+            pub.publish(delta, stream=sid)
 
-    requests.post(bcast, json={'message': '\n\n✅ 完了'}, timeout=5)
-    return func.HttpResponse(json.dumps({'ok': True}), mimetype='application/json')
+    # 完了マークまで送り終わってから返す（返した後はワーカーが止められることがある）。
+    # この会話の送信に失敗があれば delivered=False
+    delivered = pub.flush(pub.publish('\n\n✅ 完了', stream=sid), stream=sid)
+    stats = pub.stats()
+    logging.info('broadcast publisher: %s', stats)
+    return func.HttpResponse(json.dumps({'ok': True, 'delivered': delivered, 'publisher': stats}),
+                             mimetype='application/json')
@@ -0,0 +1 @@
+# 関数間で共有するモジュール（chat_stream/__init__.py などから import）
@@ -0,0 +1,274 @@
+# shared_code/publisher.py
+# /api/broadcast（SignalR 出力バインド）へのバックグラウンド送信
+# - 生成ループは publish() でキューに積むだけ。送信（HTTP → SignalR）は別スレッドで行うので、
+#   broadcast の往復時間がトークン生成を止めない
+# - まとめ送り: 最初のトークンから BROADCAST_BATCH_MS（既定 50ms）経つか、
+#   BROADCAST_BATCH_CHARS（既定 512 文字）溜まったら 1 メッセージにして送る
+# - キューは BROADCAST_QUEUE_MAX 件（既定 1000）まで。満杯時（BROADCAST_OVERFLOW）:
+#     coalesce（既定）: 末尾の要素に連結する（取りこぼさない。件数だけ抑える）
+#     block          : BROADCAST_BLOCK_MS（既定 200）まで空きを待ち、それでも満杯なら coalesce
+#     drop           : 捨てて dropped に数える
+# - 同時に走っている複数の会話（stream）は同じバッチでも別メッセージで送る（順序は会話ごとに保つ）
+# - 送信失敗は 1 回だけ再送し、それでも失敗したら errors に数えて次へ進む。
+#   失敗した番号は覚えておき、flush() はその範囲に失敗があれば False を返す
+# - stats(): キュー長（現在 / 最大）・バッチサイズ（トークン数 / 文字数）・
+#   トークンの遅れ（publish から broadcast 完了まで, ms。まとめられたトークンも 1 つずつ数える）・
+#   送信時間の分位点
+# 使い方:
+#   pub = get_publisher(f"{base}/api/broadcast")
+#   for delta in ...: pub.publish(delta, stream=invocation_id)
+#   ok = pub.flush(pub.publish("\n\n✅ 完了", stream=invocation_id), stream=invocation_id)
+#   # この会話の分が送られるまで待つ（失敗があれば False）
+
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import Any, Callable, Deque, Dict, List
+
+import requests
+
+OVERFLOW_POLICIES = ("coalesce", "block", "drop")
+
+
+def _pct(values: List[float], q: float) -> float | None:
+    if not values:
+        return None
+    s = sorted(values)
+    return s[min(len(s) - 1, int(q * len(s)))]
+
+
+class _Entry:
+    __slots__ = ("seq", "stream", "text", "t_toks")
+
+    def __init__(self, seq: int, stream: Any, text: str, t_enq: float):
+        self.seq = seq
+        self.stream = stream
+        self.text = text
+        self.t_toks = [t_enq]  # まとめられたトークンごとの publish 時刻
+
+    @property
+    def t_enq(self) -> float:
+        return self.t_toks[0]
+
+    @property
+    def tokens(self) -> int:
+        return len(self.t_toks)
+
+
+class BroadcastPublisher:
+    def __init__(self, url: str, batch_ms: float = 50.0, batch_chars: int = 512,
+                 max_queue: int = 1000, overflow: str = "coalesce", block_ms: float = 200.0,
+                 timeout: float = 5.0, send: Callable[[str], None] | None = None,
+                 sample_size: int = 2048):
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError(f"overflow must be one of {OVERFLOW_POLICIES}: {overflow}")
+        self.url = url
+        self.batch_sec = max(0.0, batch_ms / 1000.0)
+        self.batch_chars = max(1, batch_chars)
+        self.max_queue = max(1, max_queue)
+        self.overflow = overflow
+        self.block_sec = max(0.0, block_ms / 1000.0)
+        self.timeout = timeout
+        self._session = requests.Session()  # keep-alive で使い回す
+        self._send = send or self._post
+
+        self._queue: Deque[_Entry] = deque()
+        self._cond = threading.Condition()
+        self._seq = 0          # 最後に積んだ要素の番号（キューの中は番号順）
+        self._done_seq = 0     # この番号までの要素は処理済み（送信失敗も含む）
+        self._flush_upto = 0   # flush で待たれている番号（ここまでは窓を待たずに送る）
+        self._failed: Deque[tuple] = deque(maxlen=1024)  # 送れなかった (番号, 会話)
+        self._checked_upto = 0  # 会話を指定しない flush で失敗を確認済みの番号
+        self._closed = False
+
+        self.counts = {"published": 0, "coalesced": 0, "dropped": 0, "blocked": 0,
+                       "batches": 0, "messages": 0, "errors": 0, "retries": 0, "failed_tokens": 0}
+        self.max_depth = 0
+        self._lag_ms: Deque[float] = deque(maxlen=sample_size)
+        self._batch_tokens: Deque[int] = deque(maxlen=sample_size)
+        self._batch_chars: Deque[int] = deque(maxlen=sample_size)
+        self._send_ms: Deque[float] = deque(maxlen=sample_size)
+
+        self._thread = threading.Thread(target=self._run, name="broadcast-publisher", daemon=True)
+        self._thread.start()
+
+    # ---------- 生成ループ側 ----------
+    def publish(self, text: str, stream: Any = None) -> int:
+        """キューに積んで番号を返す（flush に渡すとそのトークンが送られるまで待てる）。送信は待たない。"""
+        if not text:
+            return self._seq
+        now = time.monotonic()
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("publisher is closed")
+            if len(self._queue) >= self.max_queue and self.overflow == "block":
+                self.counts["blocked"] += 1
+                deadline = now + self.block_sec
+                while len(self._queue) >= self.max_queue and not self._closed:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+            if len(self._queue) >= self.max_queue:
+                if self.overflow == "drop":
+                    self.counts["dropped"] += 1
+                    return self._seq
+                # coalesce: 同じ会話の末尾要素に連結する（各トークンの publish 時刻は残す）。
+                # その会話の要素がキューに無いときだけ上限を超えて積む（超過は同時に走る会話の数まで）
+                for e in reversed(self._queue):
+                    if e.stream == stream:
+                        e.text += text
+                        e.t_toks.append(now)
+                        self.counts["coalesced"] += 1
+                        self.counts["published"] += 1
+                        return e.seq
+            self._seq += 1
+            self._queue.append(_Entry(self._seq, stream, text, now))
+            self.counts["published"] += 1
+            self.max_depth = max(self.max_depth, len(self._queue))
+            self._cond.notify_all()
+            return self._seq
+
+    def flush(self, upto: int | None = None, timeout: float = 30.0, stream: Any = None) -> bool:
+        """
+        番号 upto（既定は今までの全部）まで処理し終わるのを待つ。
+        時間切れ、または範囲内に送れなかった要素があれば False。stream を渡すとその会話の失敗だけを見る
+        （渡さなければ前回の同様の flush 以降の全会話）。
+        """
+        with self._cond:
+            target = self._seq if upto is None else upto
+            self._flush_upto = max(self._flush_upto, target)
+            self._cond.notify_all()
+            if not self._cond.wait_for(lambda: self._done_seq >= target, timeout):
+                return False
+            if stream is not None:
+                return not any(seq <= target and s == stream for seq, s in self._failed)
+            since, self._checked_upto = self._checked_upto, max(self._checked_upto, target)
+            return not any(since < seq <= target for seq, _ in self._failed)
+
+    def close(self, timeout: float = 5.0) -> None:
+        self.flush(timeout=timeout)
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._thread.join(timeout)
+        self._session.close()
+
+    # ---------- 送信スレッド ----------
+    def _post(self, text: str) -> None:
+        r = self._session.post(self.url, json={"message": text}, timeout=self.timeout)
+        r.raise_for_status()
+
+    def _take_batch(self) -> List[_Entry]:
+        """窓が閉じるか文字数が溜まるまで待ってから、先頭から batch_chars 分を取り出す。"""
+        with self._cond:
+            while not self._queue and not self._closed:
+                self._cond.wait()
+            if not self._queue:
+                return []
+            deadline = self._queue[0].t_enq + self.batch_sec
+            while not self._closed:
+                chars = sum(len(e.text) for e in self._queue)
+                remaining = deadline - time.monotonic()
+                if chars >= self.batch_chars or remaining <= 0 or self._flush_upto > self._done_seq:
+                    break
+                self._cond.wait(remaining)
+            batch: List[_Entry] = []
+            chars = 0
+            while self._queue and (not batch or chars + len(self._queue[0].text) <= self.batch_chars):
+                e = self._queue.popleft()
+                batch.append(e)
+                chars += len(e.text)
+            self._cond.notify_all()  # block で待っている publish を起こす
+            return batch
+
+    def _send_with_retry(self, text: str) -> bool:
+        for attempt in range(2):
+            t0 = time.monotonic()
+            try:
+                self._send(text)
+                self._send_ms.append((time.monotonic() - t0) * 1000)
+                return True
+            except Exception as e:
+                if attempt == 0:
+                    self.counts["retries"] += 1
+                    time.sleep(0.05)
+                else:
+                    self.counts["errors"] += 1
+                    logging.warning("broadcast failed: %s", e)
+        return False
+
+    def _run(self) -> None:
+        while True:
+            batch = self._take_batch()
+            if not batch:
+                return
+            # 会話ごとに連結して 1 メッセージずつ送る（会話内の順序は保つ）
+            groups: "OrderedDict[Any, List[_Entry]]" = OrderedDict()
+            for e in batch:
+                groups.setdefault(e.stream, []).append(e)
+            for stream, entries in groups.items():
+                text = "".join(e.text for e in entries)
+                if self._send_with_retry(text):
+                    done = time.monotonic()
+                    self._lag_ms.extend((done - t) * 1000 for e in entries for t in e.t_toks)
+                    self.counts["messages"] += 1
+                else:
+                    with self._cond:
+                        self._failed.extend((e.seq, stream) for e in entries)
+                    self.counts["failed_tokens"] += sum(e.tokens for e in entries)
+            self.counts["batches"] += 1
+            self._batch_tokens.append(sum(e.tokens for e in batch))
+            self._batch_chars.append(sum(len(e.text) for e in batch))
+            with self._cond:
+                self._done_seq = batch[-1].seq
+                self._cond.notify_all()
+
+    # ---------- メトリクス ----------
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            depth = len(self._queue)
+        lag = list(self._lag_ms)
+        tokens = list(self._batch_tokens)
+        sends = list(self._send_ms)
+
+        def r(v: float | None) -> float | None:
+            return round(v, 1) if v is not None else None
+
+        return {
+            **self.counts,
+            "queue_depth": depth,
+            "queue_depth_max": self.max_depth,
+            "batch_tokens_avg": r(sum(tokens) / len(tokens)) if tokens else None,
+            "batch_tokens_max": max(tokens) if tokens else None,
+            "batch_chars_avg": r(sum(self._batch_chars) / len(self._batch_chars)) if self._batch_chars else None,
+            "lag_ms_p50": r(_pct(lag, 0.5)),
+            "lag_ms_p95": r(_pct(lag, 0.95)),
+            "lag_ms_p99": r(_pct(lag, 0.99)),
+            "lag_ms_max": r(max(lag)) if lag else None,
+            "send_ms_p50": r(_pct(sends, 0.5)),
+            "send_ms_p99": r(_pct(sends, 0.99)),
+        }
+
+
+# ========= プロセス内で使い回す =========
+_PUBLISHERS: Dict[str, BroadcastPublisher] = {}
+_LOCK = threading.Lock()
+
+
+def get_publisher(url: str) -> BroadcastPublisher:
+    with _LOCK:
+        pub = _PUBLISHERS.get(url)
+        if pub is None:
+            pub = _PUBLISHERS[url] = BroadcastPublisher(
+                url,
+                batch_ms=float(os.getenv("BROADCAST_BATCH_MS", "50") or "50"),
+                batch_chars=int(os.getenv("BROADCAST_BATCH_CHARS", "512") or "512"),
+                max_queue=int(os.getenv("BROADCAST_QUEUE_MAX", "1000") or "1000"),
+                overflow=(os.getenv("BROADCAST_OVERFLOW") or "coalesce").strip().lower(),
+                block_ms=float(os.getenv("BROADCAST_BLOCK_MS", "200") or "200"),
+                timeout=float(os.getenv("BROADCAST_TIMEOUT", "5") or "5"),
+            )
+        return pub
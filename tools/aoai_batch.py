@@ -0,0 +1,239 @@
+# tools/aoai_batch.py
+# ---------------------------------------------
+# Azure OpenAI Batch API の薄いクライアント（オフライン評価用）
+# - 1 行 1 リクエストの Batch 形式 JSONL を書き出す
+#     {"custom_id": "...", "method": "POST", "url": "/chat/completions", "body": {"model": <deploy>, ...}}
+# - /openai/files にアップロード → /openai/batches で投入 → 完了までポーリング
+# - 出力（output_file / error_file）を custom_id で突き合わせて返す
+# - 投入済みバッチの id を作業ディレクトリに保存し、中断後の再実行は再投入せずポーリングから再開
+#   （取得済みの結果で失敗した行は、再実行時にその行だけ投入し直す）
+# - 対話用のクォータ（RPM/TPM）を消費しない。Batch 用のデプロイ（Global-Batch）を
+#   AOAI_BATCH_DEPLOYMENT で指定（未指定なら通常のデプロイ名を使う）
+# - ローカルでは tools/mock_aoai.py が同じエンドポイントを模擬する
+# 使い方:
+#   from tools.aoai_batch import BatchClient, chat_request, run_requests
+#   reqs = [chat_request("q1", deploy, messages, temperature=0.1, max_tokens=256), ...]
+#   results = run_requests(BatchClient.from_env(), reqs, Path("batch"), tag="eval")
+#   results["q1"]["content"]
+#   python tools/aoai_batch.py requests.jsonl --workdir batch     # JSONL を直接投入
+# ---------------------------------------------
+
+import hashlib
+import json
+import os
+import sys
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+import requests
+
+API_VERSION = "2024-10-21"
+TERMINAL = {"completed", "failed", "expired", "cancelled"}
+
+
+# ========= リクエスト作成 =========
+def chat_request(custom_id: str, deployment: str, messages: List[Dict[str, Any]],
+                 **params: Any) -> Dict[str, Any]:
+    """Batch 入力 1 行分（chat completions）。params は temperature / max_tokens など。"""
+    body = {"model": deployment, "messages": messages}
+    body.update({k: v for k, v in params.items() if v is not None})
+    return {"custom_id": str(custom_id), "method": "POST", "url": "/chat/completions", "body": body}
+
+
+def write_requests(path: Path, reqs: Iterable[Dict[str, Any]]) -> int:
+    n = 0
+    seen = set()
+    with Path(path).open("w", encoding="utf-8", newline="\n") as f:
+        for r in reqs:
+            if r["custom_id"] in seen:
+                raise ValueError(f"custom_id が重複しています: {r['custom_id']}")
+            seen.add(r["custom_id"])
+            f.write(json.dumps(r, ensure_ascii=False) + "\n")
+            n += 1
+    return n
+
+
+def parse_results(text: str) -> Dict[str, Dict[str, Any]]:
+    """
+    output / error ファイルの中身を custom_id → {"content", "usage", "error"} に変換。
+    リクエスト単位の失敗は error に理由を入れる（content は None）。
+    """
+    out: Dict[str, Dict[str, Any]] = {}
+    for line in text.splitlines():
+        if not line.strip():
+            continue
+        o = json.loads(line)
+        cid = str(o.get("custom_id"))
+        resp = o.get("response") or {}
+        body = resp.get("body") or {}
+        err = o.get("error")
+        status = resp.get("status_code")
+        if err or (status is not None and status != 200):
+            detail = err or body.get("error") or {}
+            msg = detail.get("message") if isinstance(detail, dict) else detail
+            out[cid] = {"content": None, "usage": {}, "error": str(msg or f"status={status}")}
+            continue
+        choice = (body.get("choices") or [{}])[0]
+        out[cid] = {
+            "content": (choice.get("message") or {}).get("content") or "",
+            "usage": body.get("usage") or {},
+            "error": "",
+        }
+    return out
+
+
+# ========= REST クライアント =========
+class BatchClient:
+    def __init__(self, endpoint: str, api_key: str, api_version: str = API_VERSION,
+                 timeout: float = 60.0):
+        ep = (endpoint or "").strip().rstrip("/")
+        if ep and not ep.startswith(("http://", "https://")):
+            ep = "https://" + ep
+        self.endpoint = ep
+        self.api_version = api_version
+        self.timeout = timeout
+        self.session = requests.Session()
+        self.session.headers["api-key"] = api_key or ""
+
+    @classmethod
+    def from_env(cls) -> "BatchClient":
+        ep = os.getenv("AOAI_ENDPOINT") or os.getenv("AZURE_OPENAI_ENDPOINT")
+        key = os.getenv("AOAI_KEY") or os.getenv("AOAI_API_KEY") or os.getenv("AZURE_OPENAI_KEY") \
+            or os.getenv("AZURE_OPENAI_API_KEY")
+        if not ep or not key:
+            raise RuntimeError("Batch API: AOAI_ENDPOINT / AOAI_KEY（または AZURE_OPENAI_*）が未設定です。")
+        return cls(ep, key, os.getenv("AOAI_BATCH_API_VERSION") or API_VERSION)
+
+    def _url(self, path: str) -> str:
+        return f"{self.endpoint}/openai/{path}?api-version={self.api_version}"
+
+    def _check(self, r: requests.Response) -> Dict[str, Any]:
+        if r.status_code >= 400:
+            raise RuntimeError(f"Batch API HTTP {r.status_code}: {r.text[:500]}")
+        return r.json()
+
+    def upload(self, path: Path) -> str:
+        with Path(path).open("rb") as f:
+            r = self.session.post(self._url("files"), data={"purpose": "batch"},
+                                  files={"file": (Path(path).name, f, "application/jsonl")},
+                                  timeout=self.timeout)
+        return self._check(r)["id"]
+
+    def create(self, input_file_id: str, completion_window: str = "24h") -> Dict[str, Any]:
+        r = self.session.post(self._url("batches"), json={
+            "input_file_id": input_file_id,
+            "endpoint": "/chat/completions",
+            "completion_window": completion_window,
+        }, timeout=self.timeout)
+        return self._check(r)
+
+    def get(self, batch_id: str) -> Dict[str, Any]:
+        return self._check(self.session.get(self._url(f"batches/{batch_id}"), timeout=self.timeout))
+
+    def content(self, file_id: str) -> str:
+        r = self.session.get(self._url(f"files/{file_id}/content"), timeout=self.timeout)
+        if r.status_code >= 400:
+            raise RuntimeError(f"Batch API HTTP {r.status_code}: {r.text[:500]}")
+        r.encoding = "utf-8"
+        return r.text
+
+    def wait(self, batch_id: str, poll_sec: float = 30.0, timeout_sec: float = 0.0,
+             on_status: Optional[Callable[[Dict[str, Any]], None]] = None) -> Dict[str, Any]:
+        """終了状態になるまでポーリング（timeout_sec=0 なら無期限）。"""
+        t0 = time.monotonic()
+        last = None
+        while True:
+            b = self.get(batch_id)
+            state = (b.get("status"), json.dumps(b.get("request_counts") or {}, sort_keys=True))
+            if on_status and state != last:
+                on_status(b)
+            last = state
+            if b.get("status") in TERMINAL:
+                return b
+            if timeout_sec and time.monotonic() - t0 > timeout_sec:
+                raise TimeoutError(f"batch {batch_id} が {timeout_sec:.0f}s 以内に終わりませんでした（status={b.get('status')}）")
+            time.sleep(poll_sec)
+
+
+# ========= 実行（投入 → 待機 → 突き合わせ） =========
+def _print_status(b: Dict[str, Any]) -> None:
+    rc = b.get("request_counts") or {}
+    print(f"[batch] {b.get('id')}: {b.get('status')} "
+          f"(completed={rc.get('completed', 0)}, failed={rc.get('failed', 0)}, total={rc.get('total', 0)})")
+
+
+def run_requests(client: BatchClient, reqs: List[Dict[str, Any]], workdir: Path,
+                 tag: str = "batch", poll_sec: float | None = None,
+                 timeout_sec: float = 0.0) -> Dict[str, Dict[str, Any]]:
+    """
+    reqs を 1 バッチとして投入し、custom_id → 結果 を返す。
+    入力内容のハッシュごとに workdir/{tag}-{hash}.*.json(l) を残すので、同じ入力での
+    再実行は投入済みバッチの待機・取得から再開し、取得済みなら API を呼ばない。
+    取得済みの結果のうち失敗した行（個別エラー・出力に無い）は、再実行時にその分だけ投入し直す。
+    """
+    if not reqs:
+        return {}
+    workdir = Path(workdir)
+    workdir.mkdir(parents=True, exist_ok=True)
+    payload = "\n".join(json.dumps(r, ensure_ascii=False, sort_keys=True) for r in reqs)
+    stem = f"{tag}-{hashlib.sha256(payload.encode('utf-8')).hexdigest()[:12]}"
+    in_path = workdir / f"{stem}.requests.jsonl"
+    state_path = workdir / f"{stem}.state.json"
+    out_path = workdir / f"{stem}.output.jsonl"
+    poll = poll_sec if poll_sec is not None else float(os.getenv("AOAI_BATCH_POLL_SEC", "30") or "30")
+
+    if out_path.exists():
+        results = {cid: r for cid, r in parse_results(out_path.read_text(encoding="utf-8")).items()
+                   if not r["error"]}
+        retry = [r for r in reqs if r["custom_id"] not in results]
+        print(f"[batch] reuse results: {out_path.name} (ok={len(results)}, retry={len(retry)})")
+        if retry:
+            results.update(run_requests(client, retry, workdir, tag=tag, poll_sec=poll_sec,
+                                        timeout_sec=timeout_sec))
+        return {r["custom_id"]: results[r["custom_id"]] for r in reqs}
+
+    state = json.loads(state_path.read_text(encoding="utf-8")) if state_path.exists() else {}
+    if not state.get("batch_id"):
+        write_requests(in_path, reqs)
+        file_id = client.upload(in_path)
+        b = client.create(file_id)
+        state = {"batch_id": b["id"], "input_file_id": file_id, "requests": len(reqs)}
+        state_path.write_text(json.dumps(state, ensure_ascii=False, indent=2), encoding="utf-8")
+        print(f"[batch] submitted {len(reqs)} requests: {b['id']}")
+    else:
+        print(f"[batch] resume polling: {state['batch_id']}")
+
+    b = client.wait(state["batch_id"], poll_sec=poll, timeout_sec=timeout_sec, on_status=_print_status)
+    if b.get("status") != "completed":
+        # 失敗・期限切れは state を消して次回は再投入させる
+        state_path.unlink(missing_ok=True)
+        raise RuntimeError(f"batch {b.get('id')} ended with status={b.get('status')}: {b.get('errors')}")
+
+    text = client.content(b["output_file_id"]) if b.get("output_file_id") else ""
+    if b.get("error_file_id"):
+        err_text = client.content(b["error_file_id"])
+        text = text + ("\n" if text and not text.endswith("\n") else "") + err_text
+    out_path.write_text(text, encoding="utf-8")
+    results = parse_results(text)
+    missing = [r["custom_id"] for r in reqs if r["custom_id"] not in results]
+    for cid in missing:
+        results[cid] = {"content": None, "usage": {}, "error": "missing in batch output"}
+    return results
+
+
+# ========= CLI =========
+if __name__ == "__main__":
+    import argparse
+    ap = argparse.ArgumentParser(description="submit a Batch-format JSONL to Azure OpenAI and wait")
+    ap.add_argument("requests", type=Path, help="Batch 形式の入力 JSONL")
+    ap.add_argument("--workdir", type=Path, default=Path("batch"))
+    ap.add_argument("--poll", type=float, default=None, help="ポーリング間隔（秒）")
+    args = ap.parse_args()
+    with args.requests.open(encoding="utf-8-sig") as f:
+        reqs = [json.loads(line) for line in f if line.strip()]
+    res = run_requests(BatchClient.from_env(), reqs, args.workdir,
+                       tag=args.requests.stem, poll_sec=args.poll)
+    ok = sum(1 for r in res.values() if not r["error"])
+    print(f"[batch] done: ok={ok} failed={len(res) - ok}")
+    sys.exit(0 if ok == len(res) else 1)
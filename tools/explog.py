@@ -0,0 +1,377 @@
+# tools/explog.py
+# ---------------------------------------------
+# 実験ログの共通ライタ / リーダ
+# - 行をメモリに溜め、batch_rows 件 or flush_sec 秒ごとにまとめて書き出す
+#   （1行ごとに open/close しない。プロセス終了時にも残りを flush）
+# - 形式:
+#     csv / jsonl … 従来どおり 1 ファイルに追記（互換用）
+#     parquet / arrow … ディレクトリ配下に日付パーティション（date=YYYY-MM-DD/part-*.parquet|.arrow）
+#       で書き出す列指向ストア。型付きスキーマ（"string" / "int64" / "float64" / "bool"）
+# - 読み出しは pyarrow.dataset で列の射影と述語プッシュダウン（filters=[("error", "==", "")] など）
+# - CSV へのエクスポート / 既存 CSV の取り込みも可能（pyarrow が必要）
+# 使い方:
+#   log = ExperimentLog(Path("explog/results"), [("ts", "string"), ("topK", "int64"), ...], fmt="parquet")
+#   log.append(row); log.flush()
+#   tbl = read_table(Path("explog/results"), columns=["topK", "llm_sec"], filters=[("error", "==", "")])
+#   python tools/explog.py export day13/explog/results day13/results_export.csv
+#   python tools/explog.py import day13/results.csv day13/explog/results --types topK=int64,llm_sec=float64
+#   python tools/explog.py compact day13/explog/results
+# ---------------------------------------------
+
+import atexit
+import csv
+import datetime
+import json
+import os
+import threading
+import time
+import weakref
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Sequence, Tuple
+
+try:  # 列指向形式は任意（pip install pyarrow）
+    import pyarrow as pa
+    import pyarrow.dataset as pads
+    import pyarrow.parquet as pq
+except ImportError:  # pragma: no cover
+    pa = None
+
+Schema = List[Tuple[str, str]]
+FORMATS = ("csv", "jsonl", "parquet", "arrow")
+COLUMNAR = ("parquet", "arrow")
+_SUFFIX = {"parquet": ".parquet", "arrow": ".arrow"}
+_DS_FORMAT = {"parquet": "parquet", "arrow": "ipc"}
+
+
+def _require_pyarrow() -> None:
+    if pa is None:
+        raise ImportError("parquet / arrow 形式には pyarrow が必要です（pip install pyarrow）。")
+
+
+def env_format(default: str = "csv") -> str:
+    """EXPLOG_FORMAT（csv / parquet / arrow）。不正値は既定値。"""
+    fmt = (os.getenv("EXPLOG_FORMAT", default) or default).strip().lower()
+    return fmt if fmt in FORMATS else default
+
+
+# ========= 型変換 =========
+def _coerce(v: Any, typ: str) -> Any:
+    """CSV 由来の文字列や空欄も含めて型に合わせる（空欄・変換不能は None）。"""
+    if v is None or (isinstance(v, str) and v.strip() == "" and typ != "string"):
+        return None
+    try:
+        if typ == "int64":
+            return int(float(v)) if not isinstance(v, bool) else int(v)
+        if typ == "float64":
+            return float(v)
+        if typ == "bool":
+            return v if isinstance(v, bool) else str(v).strip().lower() in ("1", "true", "yes", "on")
+    except (TypeError, ValueError):
+        return None
+    return "" if v is None else str(v)
+
+
+def _csv_cell(v: Any) -> Any:
+    return "" if v is None else v
+
+
+def arrow_schema(schema: Schema) -> Any:
+    _require_pyarrow()
+    types = {"string": pa.string(), "int64": pa.int64(), "float64": pa.float64(), "bool": pa.bool_()}
+    return pa.schema([(name, types[typ]) for name, typ in schema])
+
+
+# ========= ライタ =========
+_OPEN_LOGS: "weakref.WeakSet[ExperimentLog]" = weakref.WeakSet()
+
+
+class ExperimentLog:
+    def __init__(self, path: Path, schema: Schema, fmt: str = "csv",
+                 batch_rows: int = 256, flush_sec: float = 5.0,
+                 partition_col: str | None = "ts", csv_header: bool = True):
+        """
+        path: csv / jsonl はファイル、parquet / arrow はディレクトリ。
+        partition_col: 列指向形式で日付パーティションに使う列（先頭10文字 = YYYY-MM-DD）。
+        csv_header: False ならヘッダ無し CSV（既存のヘッダ無しファイルへの追記用）。
+        """
+        if fmt not in FORMATS:
+            raise ValueError(f"unknown format: {fmt}")
+        if fmt in COLUMNAR:
+            _require_pyarrow()
+        self.path = Path(path)
+        self.schema = list(schema)
+        self.fields = [n for n, _ in self.schema]
+        self.fmt = fmt
+        self.batch_rows = max(1, batch_rows)
+        self.flush_sec = flush_sec
+        self.partition_col = partition_col
+        self.csv_header = csv_header
+        self._buf: List[Dict[str, Any]] = []
+        self._last_flush = time.monotonic()
+        self._seq = 0
+        self._lock = threading.Lock()
+        self.rows_written = 0
+        self.flushes = 0
+        _OPEN_LOGS.add(self)
+
+    def append(self, row: Dict[str, Any]) -> None:
+        rec = {n: _coerce(row.get(n), t) for n, t in self.schema}
+        with self._lock:
+            self._buf.append(rec)
+            due = (len(self._buf) >= self.batch_rows
+                   or time.monotonic() - self._last_flush >= self.flush_sec)
+        if due:
+            self.flush()
+
+    def flush(self) -> int:
+        with self._lock:
+            rows, self._buf = self._buf, []
+            self._last_flush = time.monotonic()
+            if not rows:
+                return 0
+            if self.fmt == "csv":
+                self._write_csv(rows)
+            elif self.fmt == "jsonl":
+                self._write_jsonl(rows)
+            else:
+                self._write_columnar(rows)
+            self.rows_written += len(rows)
+            self.flushes += 1
+            return len(rows)
+
+    def close(self) -> None:
+        self.flush()
+        _OPEN_LOGS.discard(self)
+
+    def __enter__(self) -> "ExperimentLog":
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        self.close()
+
+    # ----- 形式ごとの書き出し -----
+    def _write_csv(self, rows: List[Dict[str, Any]]) -> None:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        new = not self.path.exists()
+        with self.path.open("a", newline="", encoding="utf-8") as f:
+            w = csv.writer(f)
+            if new and self.csv_header:
+                w.writerow(self.fields)
+            w.writerows([_csv_cell(r[n]) for n in self.fields] for r in rows)
+
+    def _write_jsonl(self, rows: List[Dict[str, Any]]) -> None:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with self.path.open("a", encoding="utf-8") as f:
+            f.write("".join(json.dumps(r, ensure_ascii=False) + "\n" for r in rows))
+
+    def _write_columnar(self, rows: List[Dict[str, Any]]) -> None:
+        groups: Dict[str, List[Dict[str, Any]]] = {}
+        for r in rows:
+            part = ""
+            if self.partition_col:
+                day = str(r.get(self.partition_col) or "")[:10] or "unknown"
+                part = f"date={day}"
+            groups.setdefault(part, []).append(r)
+        sch = arrow_schema(self.schema)
+        stamp = datetime.datetime.now().strftime("%Y%m%d%H%M%S")
+        for part, grp in groups.items():
+            d = self.path / part if part else self.path
+            d.mkdir(parents=True, exist_ok=True)
+            self._seq += 1
+            name = f"part-{stamp}-{os.getpid()}-{self._seq:05d}{_SUFFIX[self.fmt]}"
+            tbl = pa.Table.from_pylist(grp, schema=sch)
+            tmp = d / (name + ".tmp")
+            if self.fmt == "parquet":
+                pq.write_table(tbl, tmp)
+            else:
+                with pa.OSFile(str(tmp), "wb") as sink, pa.ipc.new_file(sink, sch) as w:
+                    w.write_table(tbl)
+            tmp.replace(d / name)  # 書きかけのファイルを読ませない
+
+
+@atexit.register
+def _flush_all() -> None:
+    for log in list(_OPEN_LOGS):
+        try:
+            log.flush()
+        except Exception:
+            pass
+
+
+def flush_all() -> None:
+    _flush_all()
+
+
+# ========= リーダ =========
+def _detect_format(path: Path) -> str:
+    for fmt, suf in _SUFFIX.items():
+        if next(Path(path).rglob(f"*{suf}"), None) is not None:
+            return fmt
+    raise FileNotFoundError(f"no parquet / arrow files under: {path}")
+
+
+def dataset(path: Path, fmt: str | None = None) -> Any:
+    _require_pyarrow()
+    fmt = fmt or _detect_format(path)
+    return pads.dataset(str(path), format=_DS_FORMAT[fmt], partitioning="hive",
+                        exclude_invalid_files=True)
+
+
+def _existing(ds: Any, columns: Sequence[str] | None) -> List[str] | None:
+    # 古いファイル（列追加前）から作ったストアでも読めるよう、無い列は射影から外す
+    if not columns:
+        return None
+    names = set(ds.schema.names)
+    return [c for c in columns if c in names]
+
+
+def read_table(path: Path, columns: Sequence[str] | None = None,
+               filters: List[Tuple[str, str, Any]] | None = None, fmt: str | None = None) -> Any:
+    """
+    列指向ストアを読む。columns で必要な列だけ、filters（[(列, 演算子, 値), ...] の AND）は
+    ファイル / 行グループの統計とパーティション（date=...）を使って読み飛ばす。
+    """
+    ds = dataset(path, fmt)
+    expr = pq.filters_to_expression(filters) if filters else None
+    return ds.to_table(columns=_existing(ds, columns), filter=expr)
+
+
+def iter_rows(path: Path, columns: Sequence[str] | None = None,
+              filters: List[Tuple[str, str, Any]] | None = None, fmt: str | None = None
+              ) -> Iterator[Dict[str, Any]]:
+    """read_table と同じ条件で、レコードバッチ単位に dict を返す（全体をメモリに載せない）。"""
+    ds = dataset(path, fmt)
+    expr = pq.filters_to_expression(filters) if filters else None
+    for batch in ds.to_batches(columns=_existing(ds, columns), filter=expr):
+        yield from batch.to_pylist()
+
+
+def export_csv(path: Path, out_csv: Path, columns: Sequence[str] | None = None,
+               filters: List[Tuple[str, str, Any]] | None = None, header: bool = True) -> int:
+    """列指向ストアを従来形式の CSV に書き出す（空値は空欄、bool は True/False）。"""
+    ds = dataset(path)
+    cols = list(columns) if columns else [f for f in ds.schema.names if f != "date"]
+    n = 0
+    with Path(out_csv).open("w", newline="", encoding="utf-8") as f:
+        w = csv.writer(f)
+        if header:
+            w.writerow(cols)
+        for row in iter_rows(path, cols, filters):
+            w.writerow([_csv_cell(row.get(c)) for c in cols])
+            n += 1
+    return n
+
+
+def infer_schema(csv_path: Path, fields: Sequence[str], types: Dict[str, str] | None = None,
+                 header: bool = True) -> Schema:
+    """CSV の値から列の型を推定（types で明示したものを優先）。"""
+    types = dict(types or {})
+    cand = {f: ["int64", "float64", "bool"] for f in fields if f not in types}
+    seen = set()
+    with Path(csv_path).open(encoding="utf-8-sig", newline="") as f:
+        r = csv.reader(f)
+        if header:
+            next(r, None)
+        for rec in r:
+            for f_name, v in zip(fields, rec):
+                if f_name not in cand or v == "":
+                    continue
+                seen.add(f_name)
+                ok = []
+                for t in cand[f_name]:
+                    if t == "bool" and v in ("True", "False", "true", "false"):
+                        ok.append(t)
+                    elif t == "int64" and v.lstrip("-").isdigit():
+                        ok.append(t)
+                    elif t == "float64":
+                        try:
+                            float(v)
+                            ok.append(t)
+                        except ValueError:
+                            pass
+                cand[f_name] = ok
+    for f_name, ts in cand.items():
+        # 値が 1 つも無い列（全部空欄）は string
+        types[f_name] = ts[0] if ts and f_name in seen else "string"
+    return [(f_name, types[f_name]) for f_name in fields]
+
+
+def import_csv(csv_path: Path, out_path: Path, schema: Schema | None = None, fmt: str = "parquet",
+               fields: Sequence[str] | None = None, types: Dict[str, str] | None = None,
+               partition_col: str | None = "ts", batch_rows: int = 50000) -> int:
+    """既存 CSV を列指向ストアに取り込む。ヘッダ無し CSV は fields で列名を渡す。"""
+    with Path(csv_path).open(encoding="utf-8-sig", newline="") as f:
+        first = next(csv.reader(f), [])
+    header = fields is None
+    fields = list(fields or first)
+    schema = schema or infer_schema(csv_path, fields, types, header=header)
+    if partition_col not in fields:
+        partition_col = None
+    log = ExperimentLog(out_path, schema, fmt=fmt, batch_rows=batch_rows,
+                        flush_sec=float("inf"), partition_col=partition_col)
+    n = 0
+    with Path(csv_path).open(encoding="utf-8-sig", newline="") as f:
+        r = csv.reader(f)
+        if header:
+            next(r, None)
+        for rec in r:
+            if rec:
+                log.append(dict(zip(fields, rec)))
+                n += 1
+    log.close()
+    return n
+
+
+def compact(path: Path) -> int:
+    """パーティションごとに小さな part ファイルを 1 つにまとめる。戻り値は削除したファイル数。"""
+    _require_pyarrow()
+    fmt = _detect_format(path)
+    removed = 0
+    dirs = {p.parent for p in Path(path).rglob(f"*{_SUFFIX[fmt]}")}
+    for d in sorted(dirs):
+        parts = sorted(d.glob(f"part-*{_SUFFIX[fmt]}"))
+        if len(parts) <= 1:
+            continue
+        tbl = pads.dataset([str(p) for p in parts], format=_DS_FORMAT[fmt]).to_table()
+        name = f"part-{datetime.datetime.now().strftime('%Y%m%d%H%M%S')}-compact{_SUFFIX[fmt]}"
+        tmp = d / (name + ".tmp")
+        if fmt == "parquet":
+            pq.write_table(tbl, tmp)
+        else:
+            with pa.OSFile(str(tmp), "wb") as sink, pa.ipc.new_file(sink, tbl.schema) as w:
+                w.write_table(tbl)
+        tmp.replace(d / name)
+        for p in parts:
+            p.unlink()
+        removed += len(parts)
+    return removed
+
+
+# ========= CLI =========
+if __name__ == "__main__":
+    import argparse
+    ap = argparse.ArgumentParser(description="experiment log store utilities")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    a = sub.add_parser("export", help="列指向ストア → CSV")
+    a.add_argument("store", type=Path)
+    a.add_argument("out", type=Path)
+    a.add_argument("--no-header", action="store_true")
+    b = sub.add_parser("import", help="CSV → 列指向ストア")
+    b.add_argument("csv", type=Path)
+    b.add_argument("store", type=Path)
+    b.add_argument("--format", choices=COLUMNAR, default="parquet")
+    b.add_argument("--fields", help="ヘッダ無し CSV の列名（カンマ区切り）")
+    b.add_argument("--types", default="", help="列の型（例: topK=int64,llm_sec=float64）")
+    c = sub.add_parser("compact", help="part ファイルをパーティションごとに統合")
+    c.add_argument("store", type=Path)
+    args = ap.parse_args()
+
+    if args.cmd == "export":
+        print(f"exported {export_csv(args.store, args.out, header=not args.no_header)} rows -> {args.out}")
+    elif args.cmd == "import":
+        types = dict(kv.split("=", 1) for kv in args.types.split(",") if "=" in kv)
+        fields = args.fields.split(",") if args.fields else None
+        n = import_csv(args.csv, args.store, fmt=args.format, fields=fields, types=types)
+        print(f"imported {n} rows -> {args.store}")
+    else:
+        print(f"compacted: {compact(args.store)} files merged")
@@ -0,0 +1,135 @@
+# tools/loadtest_aoai.py
+# ---------------------------------------------
+# モック Azure OpenAI（tools/mock_aoai.py）に対する負荷試験ハーネス
+# - day13_rag_opt の _post_retry（接続プール・トークンバケット・バックオフ込み）を
+#   そのまま使って N 件を同時実行数 C で送り、スループットと遅延分布を測る
+# - --stream なら day13 の SSE 受信経路を使い TTFT も集計
+# - --url を省略するとモックをプロセス内で起動（遅延分布・429・TPM はオプションで指定）
+# 使い方:
+#   python tools/loadtest_aoai.py -n 500 -c 32 --latency lognormal:-1.5,0.5 --tpm 60000
+#   python tools/loadtest_aoai.py -n 200 -c 16 --error-rate 0.1 --retry-after 0.2 --stream
+#   AOAI_TPM=60000 python tools/loadtest_aoai.py ...   # クライアント側リミッタを有効化
+# ---------------------------------------------
+
+import argparse
+import json
+import os
+import sys
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+from tools.mock_aoai import MockAOAI, add_mock_args, config_from_args
+
+
+def percentile(xs: List[float], p: float) -> Optional[float]:
+    if not xs:
+        return None
+    xs = sorted(xs)
+    i = min(len(xs) - 1, max(0, int(round(p / 100.0 * (len(xs) - 1)))))
+    return xs[i]
+
+
+def _fmt(v: Optional[float], unit: str = "s") -> str:
+    return "-" if v is None else f"{v:.3f}{unit}"
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description="load test against mock Azure OpenAI")
+    ap.add_argument("-n", "--requests", type=int, default=200)
+    ap.add_argument("-c", "--concurrency", type=int, default=16)
+    ap.add_argument("--url", help="起動済みモックの URL（省略時はプロセス内で起動）")
+    ap.add_argument("--stream", action="store_true", help="SSE ストリーミングで送る")
+    ap.add_argument("--max-tokens", type=int, default=100)
+    ap.add_argument("--json", type=Path, help="結果サマリを JSON で保存")
+    add_mock_args(ap)
+    args = ap.parse_args()
+
+    mock = None
+    url = args.url
+    if not url:
+        mock = MockAOAI(config_from_args(args))
+        url = mock.start()
+
+    # day13 を import する前に接続先をモックへ向ける（.env より優先）
+    os.environ["AOAI_ENDPOINT"] = url
+    os.environ["AOAI_KEY"] = "mock"
+    os.environ["AOAI_DEPLOYMENT"] = "mock"
+    os.environ.setdefault("SEARCH_BACKEND", "local")
+    os.environ.setdefault("HTTP_POOL_SIZE", str(max(args.concurrency, 1)))
+    sys.path.insert(0, str(ROOT / "day13"))
+    import day13_rag_opt as rag
+
+    chat_url = f"{rag.AOAI_EP}/openai/deployments/{rag.DEPLOY}/chat/completions?api-version={rag.AOAI_API_VERSION}"
+    headers = {"api-key": rag.AOAI_KEY, "Content-Type": "application/json"}
+
+    def one(i: int) -> Dict[str, Any]:
+        body = {
+            "messages": [{"role": "user", "content": f"負荷試験 #{i}: RAGの最適化ポイントを要約して"}],
+            "max_tokens": args.max_tokens,
+        }
+        est = rag.estimate_tokens(body["messages"], args.max_tokens)
+        t0 = time.perf_counter()
+        try:
+            if args.stream:
+                _, timing = rag._chat_stream(chat_url, headers, body, est, None)
+                return {"ok": True, "sec": time.perf_counter() - t0, "ttft": timing.get("ttft_sec")}
+            r = rag._post_retry(chat_url, headers, body, timeout=60,
+                                limit_key=rag.AOAI_LIMIT_KEY, est_tokens=est)
+            r.json()
+            return {"ok": True, "sec": time.perf_counter() - t0}
+        except Exception as e:
+            return {"ok": False, "sec": time.perf_counter() - t0, "error": str(e)[:200]}
+
+    t_start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        results = list(pool.map(one, range(args.requests)))
+    wall = time.perf_counter() - t_start
+
+    ok = [r for r in results if r["ok"]]
+    lat = [r["sec"] for r in ok]
+    ttft = [r["ttft"] for r in ok if r.get("ttft") is not None]
+    server = json.load(urllib.request.urlopen(f"{url}/stats"))
+    summary = {
+        "requests": args.requests,
+        "concurrency": args.concurrency,
+        "stream": args.stream,
+        "ok": len(ok),
+        "failed": len(results) - len(ok),
+        "wall_sec": round(wall, 3),
+        "throughput_rps": round(len(ok) / wall, 2) if wall > 0 else 0.0,
+        "latency_p50": percentile(lat, 50),
+        "latency_p90": percentile(lat, 90),
+        "latency_p99": percentile(lat, 99),
+        "latency_max": max(lat) if lat else None,
+        "ttft_p50": percentile(ttft, 50),
+        "ttft_p99": percentile(ttft, 99),
+        "server": server,
+        "client_http": rag.http_stats(),
+        "client_limiter": {str(k): v for k, v in rag.LIMITER.stats().items()},
+    }
+
+    print(f"== load test: n={args.requests} c={args.concurrency} stream={args.stream} ==")
+    print(f"ok={summary['ok']} failed={summary['failed']} wall={wall:.2f}s "
+          f"throughput={summary['throughput_rps']} req/s")
+    print(f"latency p50={_fmt(summary['latency_p50'])} p90={_fmt(summary['latency_p90'])} "
+          f"p99={_fmt(summary['latency_p99'])} max={_fmt(summary['latency_max'])}")
+    if ttft:
+        print(f"ttft    p50={_fmt(summary['ttft_p50'])} p99={_fmt(summary['ttft_p99'])}")
+    print(f"server: {server}")
+    print(f"client: {summary['client_http']}  limiter: {summary['client_limiter']}")
+    errors = [r["error"] for r in results if not r["ok"]]
+    if errors:
+        print(f"first error: {errors[0]}")
+    if args.json:
+        args.json.write_text(json.dumps(summary, ensure_ascii=False, indent=2), encoding="utf-8")
+    if mock is not None:
+        mock.stop()
+
+
+if __name__ == "__main__":
+    main()
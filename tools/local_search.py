@@ -0,0 +1,343 @@
+# tools/local_search.py
+# ---------------------------------------------
+# Azure AI Search の代わりに使えるローカル BM25 検索エンジン（ネットワーク不要）
+# - リポジトリ内の Markdown（既定: day12/, faq/, articles/）から転置インデックスを構築
+# - REST 互換:  LocalSearchIndex.search_rest(payload)
+#     POST /indexes/{INDEX}/docs/search の {"search","top","skip","searchFields","select",
+#     "highlight","highlightPreTag","highlightPostTag"} を受け {"value":[...]} を返す
+# - SDK 互換:   LocalSearchClient.search(search_text, top=, search_fields=, select=,
+#     highlight_fields=, highlight_pre_tag=, highlight_post_tag=, ...) / get_document_count()
+# - 各結果に "@search.score" と（指定時）"@search.highlights" を付与
+# - トークン化: 英数字は単語単位（小文字化）、日本語は文字 2-gram
+# 使い方:
+#   SEARCH_BACKEND=local を設定すると day10〜day13 のスクリプトがこのエンジンを使う
+#   python tools/local_search.py "費用 OR コスト"          # 検索して表示
+#   python tools/local_search.py --bench 5000 "エラー"     # QPS 計測
+# ---------------------------------------------
+
+import math
+import os
+import re
+import sys
+import threading
+import time
+import unicodedata
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+ROOT = Path(__file__).resolve().parents[1]
+DEFAULT_DIRS = [ROOT / "day12", ROOT / "faq", ROOT / "articles"]
+
+_TOKEN = re.compile(r"[a-z0-9_]+|[ぁ-んァ-ヴー一-龠々]+")
+_QUERY = re.compile(r'"([^"]*)"|(\S+)')
+_SEARCHABLE = ("content", "metadata_storage_name")
+
+
+def _norm(text: str) -> str:
+    return unicodedata.normalize("NFKC", text).lower()
+
+
+def tokenize(text: str) -> List[str]:
+    out: List[str] = []
+    for m in _TOKEN.findall(_norm(text)):
+        if m.isascii():
+            out.append(m)
+        elif len(m) == 1:
+            out.append(m)
+        else:
+            out.extend(m[i:i + 2] for i in range(len(m) - 1))
+    return out
+
+
+def parse_query(q: str) -> Tuple[List[str], List[str], bool]:
+    """
+    簡易クエリ構文（simple / full の共通部分）:
+    空白区切りの語は OR（searchMode=any 相当）、"..." はフレーズ、* は全件。
+    戻り値: (トークン, フレーズ, 全件検索か)
+    """
+    q = (q or "").strip()
+    if q in ("", "*"):
+        return [], [], True
+    tokens: List[str] = []
+    phrases: List[str] = []
+    for phrase, word in _QUERY.findall(q.replace("(", " ").replace(")", " ")):
+        if phrase:
+            phrases.append(_norm(phrase))
+            tokens.extend(tokenize(phrase))
+        elif word.upper() not in ("OR", "AND", "NOT", "|", "+"):
+            tokens.extend(tokenize(word.lstrip("+-")))
+    return tokens, phrases, False
+
+
+def highlight_terms(q: str) -> List[str]:
+    """ハイライト用の語（2-gram に分解せず、クエリに書かれた語・フレーズのまま）。"""
+    out: List[str] = []
+    for phrase, word in _QUERY.findall((q or "").replace("(", " ").replace(")", " ")):
+        w = _norm(phrase or word.lstrip("+-"))
+        if w and w != "*" and (phrase or word.upper() not in ("OR", "AND", "NOT", "|", "+")):
+            out.append(w)
+    return out
+
+
+class LocalSearchIndex:
+    """フィールド別の転置インデックスと BM25 スコアリング。"""
+
+    def __init__(self, k1: float = 1.2, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.docs: List[Dict[str, Any]] = []
+        # field -> term -> {doc_id: tf}
+        self._postings: Dict[str, Dict[str, Dict[int, int]]] = {f: {} for f in _SEARCHABLE}
+        self._lens: Dict[str, List[int]] = {f: [] for f in _SEARCHABLE}
+        self._avg: Dict[str, float] = {f: 0.0 for f in _SEARCHABLE}
+        self._norm_text: List[Dict[str, str]] = []
+
+    # ========= 構築 =========
+    def add(self, doc: Dict[str, Any]) -> None:
+        i = len(self.docs)
+        self.docs.append(doc)
+        normed: Dict[str, str] = {}
+        for f in _SEARCHABLE:
+            text = str(doc.get(f) or "")
+            normed[f] = _norm(text)
+            toks = tokenize(text)
+            self._lens[f].append(len(toks))
+            post = self._postings[f]
+            for t in toks:
+                d = post.setdefault(t, {})
+                d[i] = d.get(i, 0) + 1
+        self._norm_text.append(normed)
+
+    def finish(self) -> "LocalSearchIndex":
+        for f in _SEARCHABLE:
+            lens = self._lens[f]
+            self._avg[f] = (sum(lens) / len(lens)) if lens else 0.0
+        return self
+
+    @classmethod
+    def from_markdown(cls, dirs: Optional[Iterable[Path]] = None) -> "LocalSearchIndex":
+        idx = cls()
+        for d in dirs or DEFAULT_DIRS:
+            d = Path(d)
+            if not d.exists():
+                continue
+            for p in sorted(d.rglob("*.md")):
+                try:
+                    text = p.read_text(encoding="utf-8-sig")
+                except (OSError, UnicodeDecodeError):
+                    continue
+                idx.add({
+                    "id": str(len(idx.docs)),
+                    "content": text,
+                    "metadata_storage_name": p.name,
+                    "metadata_storage_path": p.relative_to(ROOT).as_posix() if p.is_relative_to(ROOT) else str(p),
+                })
+        return idx.finish()
+
+    def __len__(self) -> int:
+        return len(self.docs)
+
+    # ========= 検索 =========
+    def _idf(self, field: str, term: str) -> float:
+        n = len(self._postings[field].get(term, ()))
+        return math.log(1 + (len(self.docs) - n + 0.5) / (n + 0.5))
+
+    def score(self, query: str, fields: Sequence[str] = _SEARCHABLE) -> List[Tuple[int, float]]:
+        tokens, phrases, match_all = parse_query(query)
+        if match_all:
+            return [(i, 1.0) for i in range(len(self.docs))]
+        fields = [f for f in fields if f in self._postings] or list(_SEARCHABLE)
+        scores: Dict[int, float] = {}
+        k1, b = self.k1, self.b
+        for f in fields:
+            post, lens, avg = self._postings[f], self._lens[f], self._avg[f] or 1.0
+            for t in set(tokens):
+                docs = post.get(t)
+                if not docs:
+                    continue
+                idf = self._idf(f, t)
+                for i, tf in docs.items():
+                    denom = tf + k1 * (1 - b + b * lens[i] / avg)
+                    scores[i] = scores.get(i, 0.0) + idf * tf * (k1 + 1) / denom
+        if phrases:
+            # フレーズは原文（正規化済み）に連続して含まれる文書のみ残す
+            scores = {i: s for i, s in scores.items()
+                      if all(any(p in self._norm_text[i][f] for f in fields) for p in phrases)}
+        return sorted(scores.items(), key=lambda x: (-x[1], x[0]))
+
+    def _highlights(self, text: str, terms: List[str], pre: str, post: str,
+                    width: int = 120, max_frags: int = 5) -> List[str]:
+        if not terms:
+            return []
+        low = text.lower()
+        if len(low) != len(text):  # 小文字化で長さが変わる文字を含む場合は大小区別あり
+            low = text
+        spans: List[Tuple[int, int]] = []
+        for t in set(terms):
+            start = low.find(t)
+            while start != -1:
+                spans.append((start, start + len(t)))
+                start = low.find(t, start + 1)
+        if not spans:
+            return []
+        spans.sort()
+        merged: List[List[int]] = []
+        for s, e in spans:
+            if merged and s <= merged[-1][1]:
+                merged[-1][1] = max(merged[-1][1], e)
+            else:
+                merged.append([s, e])
+        frags: List[str] = []
+        i = 0
+        while i < len(merged) and len(frags) < max_frags:
+            w0 = max(0, merged[i][0] - width // 3)
+            w1 = min(len(text), w0 + width)
+            parts: List[str] = []
+            pos = w0
+            while i < len(merged) and merged[i][1] <= w1:
+                s, e = merged[i]
+                parts.append(text[pos:s] + pre + text[s:e] + post)
+                pos = e
+                i += 1
+            if not parts:  # 幅より長い一致
+                s, e = merged[i]
+                parts.append(pre + text[s:e] + post)
+                pos = e
+                i += 1
+            parts.append(text[pos:w1])
+            frags.append(re.sub(r"\s+", " ", "".join(parts)).strip())
+        return frags
+
+    def search(self, search_text: str, top: Optional[int] = None, skip: int = 0,
+               search_fields: Optional[Sequence[str]] = None,
+               select: Optional[Sequence[str]] = None,
+               highlight_fields: Optional[Sequence[str]] = None,
+               highlight_pre_tag: str = "<em>", highlight_post_tag: str = "</em>") -> List[Dict[str, Any]]:
+        fields = list(search_fields) if search_fields else list(_SEARCHABLE)
+        ranked = self.score(search_text, fields)
+        ranked = ranked[skip or 0:]
+        if top is not None:
+            ranked = ranked[:top]
+        terms = highlight_terms(search_text)
+        out: List[Dict[str, Any]] = []
+        for i, s in ranked:
+            doc = self.docs[i]
+            item: Dict[str, Any] = {"@search.score": s}
+            item.update({k: doc.get(k) for k in select} if select else doc)
+            if highlight_fields:
+                hl = {}
+                for f in highlight_fields:
+                    frags = self._highlights(str(doc.get(f) or ""), terms,
+                                             highlight_pre_tag, highlight_post_tag)
+                    if frags:
+                        hl[f] = frags
+                if hl:
+                    item["@search.highlights"] = hl
+            out.append(item)
+        return out
+
+    def search_rest(self, payload: Dict[str, Any]) -> Dict[str, Any]:
+        """/indexes/{INDEX}/docs/search の POST ボディを受けて同じ形の JSON を返す。"""
+        def _csv(v: Any) -> Optional[List[str]]:
+            if not v:
+                return None
+            if isinstance(v, str):
+                return [x.strip() for x in v.split(",") if x.strip()]
+            return list(v)
+
+        value = self.search(
+            payload.get("search", "*"),
+            top=payload.get("top", 50),
+            skip=payload.get("skip", 0),
+            search_fields=_csv(payload.get("searchFields")),
+            select=_csv(payload.get("select")),
+            highlight_fields=_csv(payload.get("highlight")),
+            highlight_pre_tag=payload.get("highlightPreTag", "<em>"),
+            highlight_post_tag=payload.get("highlightPostTag", "</em>"),
+        )
+        res: Dict[str, Any] = {"value": value}
+        if payload.get("count"):
+            res["@odata.count"] = len(self.score(payload.get("search", "*"),
+                                                 _csv(payload.get("searchFields")) or _SEARCHABLE))
+        return res
+
+
+class LocalSearchClient:
+    """azure.search.documents.SearchClient のうち本リポジトリで使う部分の代替。"""
+
+    def __init__(self, index: Optional[LocalSearchIndex] = None, **_: Any):
+        self.index = index or default_index()
+
+    def search(self, search_text: Optional[str] = None, *, top: Optional[int] = None,
+               skip: Optional[int] = None, search_fields: Any = None, select: Any = None,
+               highlight_fields: Any = None, highlight_pre_tag: str = "<em>",
+               highlight_post_tag: str = "</em>", **_: Any) -> Iterator[Dict[str, Any]]:
+        if isinstance(search_fields, str):
+            search_fields = [x.strip() for x in search_fields.split(",")]
+        if isinstance(highlight_fields, str):
+            highlight_fields = [x.strip() for x in highlight_fields.split(",")]
+        if isinstance(select, str):
+            select = [x.strip() for x in select.split(",")]
+        return iter(self.index.search(
+            search_text or "*", top=top, skip=skip or 0, search_fields=search_fields,
+            select=select, highlight_fields=highlight_fields,
+            highlight_pre_tag=highlight_pre_tag, highlight_post_tag=highlight_post_tag,
+        ))
+
+    def get_document_count(self) -> int:
+        return len(self.index)
+
+    def close(self) -> None:
+        pass
+
+
+_default: Optional[LocalSearchIndex] = None
+_default_lock = threading.Lock()
+
+
+def default_index() -> LocalSearchIndex:
+    """
+    LOCAL_SEARCH_DIRS（os.pathsep 区切り）または既定ディレクトリから 1 度だけ構築。
+    並列ジョブから同時に呼ばれても構築は 1 回（ロック + 二重チェック）。
+    """
+    global _default
+    if _default is None:
+        with _default_lock:
+            if _default is None:
+                env = os.getenv("LOCAL_SEARCH_DIRS")
+                dirs = [Path(p) for p in env.split(os.pathsep) if p] if env else None
+                _default = LocalSearchIndex.from_markdown(dirs)
+    return _default
+
+
+def use_local_backend() -> bool:
+    return (os.getenv("SEARCH_BACKEND") or "").lower() == "local"
+
+
+# ========= CLI =========
+if __name__ == "__main__":
+    import argparse
+    ap = argparse.ArgumentParser(description="local BM25 search")
+    ap.add_argument("query", nargs="*", default=["*"])
+    ap.add_argument("--top", type=int, default=5)
+    ap.add_argument("--bench", type=int, default=0, help="指定回数だけ検索して QPS を表示")
+    args = ap.parse_args()
+    q = " ".join(args.query)
+
+    t0 = time.perf_counter()
+    idx = default_index()
+    print(f"indexed {len(idx)} docs in {time.perf_counter() - t0:.3f}s")
+
+    if args.bench:
+        t0 = time.perf_counter()
+        for _ in range(args.bench):
+            idx.search_rest({"search": q, "top": args.top})
+        sec = time.perf_counter() - t0
+        print(f"{args.bench} queries in {sec:.3f}s -> {args.bench / sec:.0f} QPS")
+        sys.exit(0)
+
+    for r in idx.search(q, top=args.top, select=["metadata_storage_name"],
+                        highlight_fields=["content"], highlight_pre_tag="[", highlight_post_tag="]"):
+        print(f"- {r['metadata_storage_name']}  score={r['@search.score']:.4f}")
+        for frag in (r.get("@search.highlights") or {}).get("content", [])[:1]:
+            print(f"  snippet: {frag}")
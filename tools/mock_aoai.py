@@ -0,0 +1,485 @@
+# tools/mock_aoai.py
+# ---------------------------------------------
+# 負荷試験用の Azure OpenAI 互換モックサーバ（トークン課金なし・ネットワーク不要）
+# - POST /openai/deployments/{deployment}/chat/completions
+#     通常応答（JSON）と stream=true の SSE（data: {...} / data: [DONE]）に対応
+#     stream_options.include_usage=true なら最後に usage チャンクを送る
+# - POST /openai/deployments/{deployment}/embeddings（決定的なハッシュベクトル）
+# - Batch API: POST /openai/files（purpose=batch）, GET /openai/files/{id}/content,
+#   POST /openai/batches, GET /openai/batches/{id}
+#   （--batch-latency 後に全行を処理して completed。クォータ/429 注入の対象外）
+# - GET  /stats（受信数・429 数など）
+# - 遅延: fixed:x / uniform:a,b / lognormal:mu,sigma（秒）で応答時間・TTFT を分布指定
+# - 429 注入: --error-rate の確率で retry-after 付き 429
+# - クォータ: --rpm / --tpm（60秒スライディングウィンドウ、超過時は retry-after 付き 429）
+# - 回答はメッセージ内容のハッシュから決定的に生成（同じ入力なら同じ出力）
+# 使い方:
+#   python tools/mock_aoai.py --port 8089 --latency lognormal:-0.7,0.4 --tpm 20000
+#   AOAI_ENDPOINT=http://127.0.0.1:8089 AOAI_KEY=mock AOAI_DEPLOYMENT=mock python day13/day13_rag_opt.py
+# ---------------------------------------------
+
+import email.parser
+import email.policy
+import hashlib
+import itertools
+import json
+import math
+import random
+import re
+import sys
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+_CHAT = re.compile(r"^/openai/deployments/([^/]+)/chat/completions$")
+_EMBED = re.compile(r"^/openai/deployments/([^/]+)/embeddings$")
+_FILE_CONTENT = re.compile(r"^/openai/files/([^/]+)/content$")
+_BATCH = re.compile(r"^/openai/batches/([^/]+)$")
+
+
+# ========= 設定 =========
+def parse_dist(spec: str) -> Tuple[str, List[float]]:
+    """'lognormal:-0.7,0.4' → ("lognormal", [-0.7, 0.4])。数値だけなら fixed。"""
+    spec = (spec or "0").strip()
+    if ":" not in spec:
+        return "fixed", [float(spec)]
+    kind, args = spec.split(":", 1)
+    return kind.strip().lower(), [float(x) for x in args.split(",") if x.strip()]
+
+
+def sample(dist: Tuple[str, List[float]], rng: random.Random) -> float:
+    kind, a = dist
+    if kind == "uniform":
+        return rng.uniform(a[0], a[1])
+    if kind == "lognormal":
+        return rng.lognormvariate(a[0], a[1])
+    if kind == "exp":
+        return rng.expovariate(1.0 / a[0]) if a[0] > 0 else 0.0
+    return a[0] if a else 0.0
+
+
+@dataclass
+class MockConfig:
+    latency: str = "fixed:0.05"       # 非ストリーミング応答の所要時間
+    ttft: str = "fixed:0.05"          # ストリーミングの最初のトークンまで
+    tokens_per_sec: float = 200.0     # ストリーミングの出力速度
+    error_rate: float = 0.0           # ランダム 429 の確率
+    retry_after: float = 1.0          # ランダム 429 の retry-after 秒
+    rpm: int = 0                      # 0 = 無制限
+    tpm: int = 0                      # 0 = 無制限（prompt 見積り + max_tokens で計上）
+    answer_tokens: int = 40           # 回答の長さ（おおよそのトークン数）
+    batch_latency: str = "fixed:1.0"  # Batch ジョブの投入から完了までの時間
+    seed: int = 0
+
+
+@dataclass
+class MockStats:
+    requests: int = 0
+    ok: int = 0
+    throttled_random: int = 0
+    throttled_quota: int = 0
+    streamed: int = 0
+    embeddings: int = 0
+    batches: int = 0
+    batch_requests: int = 0
+
+
+def approx_tokens(text: str) -> int:
+    ascii_n = sum(1 for ch in text if ord(ch) < 128)
+    return (ascii_n + 3) // 4 + (len(text) - ascii_n)
+
+
+def make_answer(messages: List[Dict[str, Any]], n_tokens: int) -> str:
+    """メッセージのハッシュから決定的に回答文を作る。"""
+    src = json.dumps(messages, ensure_ascii=False, sort_keys=True)
+    h = hashlib.sha256(src.encode("utf-8")).hexdigest()
+    user = next((str(m.get("content") or "") for m in reversed(messages) if m.get("role") == "user"), "")
+    head = re.sub(r"\s+", " ", user)[:30]
+    words = [f"要点{int(h[i:i + 2], 16) % 10}" for i in range(0, 64, 2)]
+    body = "、".join(words)
+    text = f"（mock:{h[:8]}）{head} への回答: {body}"
+    # おおよそ n_tokens に揃える（日本語1文字≒1token）
+    while approx_tokens(text) < n_tokens:
+        text += "。" + body
+    return text[:max(1, n_tokens)]
+
+
+# ========= サーバ本体 =========
+class MockAOAI:
+    def __init__(self, cfg: Optional[MockConfig] = None):
+        self.cfg = cfg or MockConfig()
+        self.stats = MockStats()
+        self._rng = random.Random(self.cfg.seed)
+        self._lock = threading.Lock()
+        self._req_log: Deque[float] = deque()
+        self._tok_log: Deque[Tuple[float, int]] = deque()
+        self._latency = parse_dist(self.cfg.latency)
+        self._ttft = parse_dist(self.cfg.ttft)
+        self._batch_latency = parse_dist(self.cfg.batch_latency)
+        self._ids = itertools.count(1)
+        self.files: Dict[str, bytes] = {}
+        self.batches: Dict[str, Dict[str, Any]] = {}
+        self.server: Optional[ThreadingHTTPServer] = None
+
+    # ----- クォータ判定（60秒スライディングウィンドウ） -----
+    def admit(self, tokens: int) -> Tuple[bool, float, Dict[str, str]]:
+        now = time.monotonic()
+        with self._lock:
+            self.stats.requests += 1
+            while self._req_log and now - self._req_log[0] >= 60:
+                self._req_log.popleft()
+            while self._tok_log and now - self._tok_log[0][0] >= 60:
+                self._tok_log.popleft()
+            used_tok = sum(n for _, n in self._tok_log)
+            headers: Dict[str, str] = {}
+            if self.cfg.rpm:
+                headers["x-ratelimit-remaining-requests"] = str(max(0, self.cfg.rpm - len(self._req_log)))
+            if self.cfg.tpm:
+                headers["x-ratelimit-remaining-tokens"] = str(max(0, self.cfg.tpm - used_tok))
+
+            if self.cfg.error_rate and self._rng.random() < self.cfg.error_rate:
+                self.stats.throttled_random += 1
+                return False, self.cfg.retry_after, headers
+            if self.cfg.rpm and len(self._req_log) >= self.cfg.rpm:
+                self.stats.throttled_quota += 1
+                return False, max(0.1, 60 - (now - self._req_log[0])), headers
+            if self.cfg.tpm and used_tok + tokens > self.cfg.tpm:
+                # 必要量が空くまでの秒数
+                free, wait = self.cfg.tpm - used_tok, 0.1
+                for t, n in self._tok_log:
+                    free += n
+                    if free >= tokens:
+                        wait = max(0.1, 60 - (now - t))
+                        break
+                self.stats.throttled_quota += 1
+                return False, wait, headers
+            self._req_log.append(now)
+            self._tok_log.append((now, tokens))
+            return True, 0.0, headers
+
+    def sample_latency(self) -> float:
+        with self._lock:
+            return max(0.0, sample(self._latency, self._rng))
+
+    def sample_ttft(self) -> float:
+        with self._lock:
+            return max(0.0, sample(self._ttft, self._rng))
+
+    # ----- Batch API -----
+    def new_id(self, prefix: str) -> str:
+        with self._lock:
+            return f"{prefix}-mock{next(self._ids):06d}"
+
+    def create_batch(self, input_file_id: str, endpoint: str, window: str) -> Dict[str, Any]:
+        lines = [ln for ln in self.files[input_file_id].decode("utf-8-sig").splitlines() if ln.strip()]
+        b = {
+            "id": self.new_id("batch"), "object": "batch", "endpoint": endpoint,
+            "input_file_id": input_file_id, "completion_window": window,
+            "status": "validating", "created_at": int(time.time()),
+            "output_file_id": None, "error_file_id": None, "errors": None,
+            "request_counts": {"total": len(lines), "completed": 0, "failed": 0},
+        }
+        with self._lock:
+            self.batches[b["id"]] = b
+            self.stats.batches += 1
+            delay = max(0.0, sample(self._batch_latency, self._rng))
+        threading.Thread(target=self._process_batch, args=(b, lines, delay), daemon=True).start()
+        return dict(b)
+
+    def _process_batch(self, b: Dict[str, Any], lines: List[str], delay: float) -> None:
+        time.sleep(delay * 0.1)
+        b["status"] = "in_progress"
+        time.sleep(delay * 0.9)
+        out, err = [], []
+        for ln in lines:
+            req = json.loads(ln)
+            cid = req.get("custom_id")
+            body = req.get("body") or {}
+            if req.get("url") != b["endpoint"] or not body.get("messages"):
+                err.append({"id": self.new_id("req"), "custom_id": cid, "response": None,
+                            "error": {"code": "invalid_request", "message": f"unsupported url: {req.get('url')}"}})
+                b["request_counts"]["failed"] += 1
+                continue
+            resp = self.chat_response(body.get("model") or "mock", body)
+            out.append({"id": self.new_id("req"), "custom_id": cid,
+                        "response": {"status_code": 200, "request_id": self.new_id("r"), "body": resp},
+                        "error": None})
+            b["request_counts"]["completed"] += 1
+        b["status"] = "finalizing"
+        with self._lock:
+            self.stats.batch_requests += len(lines)
+        for key, rows in (("output_file_id", out), ("error_file_id", err)):
+            if rows:
+                fid = self.new_id("file")
+                self.files[fid] = "".join(json.dumps(r, ensure_ascii=False) + "\n" for r in rows).encode("utf-8")
+                b[key] = fid
+        b["completed_at"] = int(time.time())
+        b["status"] = "completed"
+
+    def chat_response(self, deployment: str, body: Dict[str, Any]) -> Dict[str, Any]:
+        messages = body.get("messages") or []
+        prompt_tokens = sum(approx_tokens(str(m.get("content") or "")) + 4 for m in messages)
+        max_tokens = int(body.get("max_tokens") or self.cfg.answer_tokens)
+        answer = make_answer(messages, min(max_tokens, self.cfg.answer_tokens))
+        return {
+            "id": "chatcmpl-mock", "object": "chat.completion", "created": int(time.time()),
+            "model": deployment,
+            "choices": [{"index": 0, "finish_reason": "stop",
+                         "message": {"role": "assistant", "content": answer}}],
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": approx_tokens(answer),
+                "total_tokens": prompt_tokens + approx_tokens(answer),
+            },
+        }
+
+    # ----- 起動 / 停止 -----
+    def start(self, host: str = "127.0.0.1", port: int = 0) -> str:
+        mock = self
+
+        class Handler(_Handler):
+            pass
+        Handler.mock = mock
+        self.server = _Server((host, port), Handler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self.url
+
+    @property
+    def url(self) -> str:
+        assert self.server is not None
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def stop(self) -> None:
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+
+class _Server(ThreadingHTTPServer):
+    # 既定の listen backlog（5）だと負荷試験の同時接続でリセットされる
+    request_queue_size = 256
+
+    def handle_error(self, request: Any, client_address: Any) -> None:
+        # クライアント側の切断（負荷試験終了時など）は黙って捨てる
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+
+class _Handler(BaseHTTPRequestHandler):
+    mock: MockAOAI
+    protocol_version = "HTTP/1.1"  # keep-alive
+    disable_nagle_algorithm = True  # ヘッダと本文の分割送信で遅延させない
+
+    def log_message(self, fmt: str, *args: Any) -> None:  # アクセスログは出さない
+        pass
+
+    def _send_json(self, status: int, obj: Any, headers: Optional[Dict[str, str]] = None) -> None:
+        body = json.dumps(obj, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _read_body(self) -> bytes:
+        n = int(self.headers.get("Content-Length") or 0)
+        return self.rfile.read(n) if n else b""
+
+    def _throttle(self, wait: float, headers: Dict[str, str]) -> None:
+        h = dict(headers)
+        h["retry-after"] = str(max(1, math.ceil(wait)))
+        h["retry-after-ms"] = str(int(wait * 1000))
+        self._send_json(429, {"error": {"code": "429", "message": "Rate limit is exceeded (mock)."}}, h)
+
+    def do_GET(self) -> None:
+        path = self.path.split("?", 1)[0]
+        if path == "/stats":
+            self._send_json(200, self.mock.stats.__dict__)
+            return
+        m = _FILE_CONTENT.match(path)
+        if m and m.group(1) in self.mock.files:
+            data = self.mock.files[m.group(1)]
+            self.send_response(200)
+            self.send_header("Content-Type", "application/octet-stream")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+            return
+        m = _BATCH.match(path)
+        if m and m.group(1) in self.mock.batches:
+            self._send_json(200, self.mock.batches[m.group(1)])
+            return
+        self._send_json(404, {"error": {"code": "404", "message": path}})
+
+    def do_POST(self) -> None:
+        path = self.path.split("?", 1)[0]
+        m = _CHAT.match(path)
+        if m:
+            self._chat(m.group(1), json.loads(self._read_body() or b"{}"))
+            return
+        m = _EMBED.match(path)
+        if m:
+            self._embed(json.loads(self._read_body() or b"{}"))
+            return
+        if path == "/openai/files":
+            self._upload()
+            return
+        if path == "/openai/batches":
+            body = json.loads(self._read_body() or b"{}")
+            fid = body.get("input_file_id")
+            if fid not in self.mock.files:
+                self._send_json(404, {"error": {"code": "404", "message": f"file not found: {fid}"}})
+                return
+            self._send_json(200, self.mock.create_batch(
+                fid, body.get("endpoint") or "/chat/completions", body.get("completion_window") or "24h"))
+            return
+        self._read_body()
+        self._send_json(404, {"error": {"code": "404", "message": path}})
+
+    def _upload(self) -> None:
+        """multipart/form-data（purpose, file）を受け取り、ファイルとして保存。"""
+        raw = self._read_body()
+        head = f"Content-Type: {self.headers.get('Content-Type')}\r\n\r\n".encode("latin-1")
+        msg = email.parser.BytesParser(policy=email.policy.HTTP).parsebytes(head + raw)
+        fields: Dict[str, Any] = {}
+        filename = "upload.jsonl"
+        for part in msg.iter_parts():
+            name = part.get_param("name", header="content-disposition")
+            if part.get_filename():
+                filename = part.get_filename()
+            fields[name] = part.get_payload(decode=True)
+        if "file" not in fields:
+            self._send_json(400, {"error": {"code": "400", "message": "file is required"}})
+            return
+        fid = self.mock.new_id("file")
+        self.mock.files[fid] = fields["file"]
+        purpose = (fields.get("purpose") or b"batch").decode("utf-8")
+        self._send_json(200, {"id": fid, "object": "file", "purpose": purpose,
+                              "filename": filename, "bytes": len(fields["file"]),
+                              "status": "processed", "created_at": int(time.time())})
+
+    def _chat(self, deployment: str, body: Dict[str, Any]) -> None:
+        mock = self.mock
+        messages = body.get("messages") or []
+        prompt_tokens = sum(approx_tokens(str(m.get("content") or "")) + 4 for m in messages)
+        max_tokens = int(body.get("max_tokens") or mock.cfg.answer_tokens)
+        ok, wait, headers = mock.admit(prompt_tokens + max_tokens)
+        if not ok:
+            self._throttle(wait, headers)
+            return
+        answer = make_answer(messages, min(max_tokens, mock.cfg.answer_tokens))
+        usage = {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": approx_tokens(answer),
+            "total_tokens": prompt_tokens + approx_tokens(answer),
+        }
+        created = int(time.time())
+        if not body.get("stream"):
+            time.sleep(mock.sample_latency())
+            with mock._lock:
+                mock.stats.ok += 1
+            self._send_json(200, {
+                "id": "chatcmpl-mock", "object": "chat.completion", "created": created,
+                "model": deployment,
+                "choices": [{"index": 0, "finish_reason": "stop",
+                             "message": {"role": "assistant", "content": answer}}],
+                "usage": usage,
+            }, headers)
+            return
+
+        # ----- SSE ストリーミング -----
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Transfer-Encoding", "chunked")
+        for k, v in headers.items():
+            self.send_header(k, v)
+        self.end_headers()
+
+        def emit(obj: Any) -> None:
+            data = obj if isinstance(obj, str) else json.dumps(obj, ensure_ascii=False)
+            chunk = f"data: {data}\n\n".encode("utf-8")
+            self.wfile.write(f"{len(chunk):X}\r\n".encode("ascii") + chunk + b"\r\n")
+            self.wfile.flush()
+
+        base = {"id": "chatcmpl-mock", "object": "chat.completion.chunk",
+                "created": created, "model": deployment}
+        time.sleep(mock.sample_ttft())
+        step = 1.0 / mock.cfg.tokens_per_sec if mock.cfg.tokens_per_sec > 0 else 0.0
+        pieces = [answer[i:i + 2] for i in range(0, len(answer), 2)]
+        emit({**base, "choices": [{"index": 0, "delta": {"role": "assistant", "content": ""}}]})
+        for i, piece in enumerate(pieces):
+            if i and step:
+                time.sleep(step * approx_tokens(piece))
+            emit({**base, "choices": [{"index": 0, "delta": {"content": piece}}]})
+        emit({**base, "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]})
+        if (body.get("stream_options") or {}).get("include_usage"):
+            emit({**base, "choices": [], "usage": usage})
+        emit("[DONE]")
+        self.wfile.write(b"0\r\n\r\n")
+        with mock._lock:
+            mock.stats.ok += 1
+            mock.stats.streamed += 1
+
+    def _embed(self, body: Dict[str, Any]) -> None:
+        inputs = body.get("input")
+        if isinstance(inputs, str):
+            inputs = [inputs]
+        data = []
+        for i, text in enumerate(inputs or []):
+            vec = []
+            for j in range(64):
+                h = hashlib.blake2b(f"{j}|{text}".encode("utf-8"), digest_size=2).digest()
+                vec.append(int.from_bytes(h, "little") / 65535.0 - 0.5)
+            data.append({"object": "embedding", "index": i, "embedding": vec})
+        with self.mock._lock:
+            self.mock.stats.embeddings += 1
+        self._send_json(200, {"object": "list", "data": data,
+                              "usage": {"prompt_tokens": 0, "total_tokens": 0}})
+
+
+# ========= CLI =========
+def add_mock_args(ap: Any) -> None:
+    ap.add_argument("--latency", default="fixed:0.05", help="応答時間の分布（秒）")
+    ap.add_argument("--ttft", default="fixed:0.05", help="ストリーミング TTFT の分布（秒）")
+    ap.add_argument("--tokens-per-sec", type=float, default=200.0)
+    ap.add_argument("--error-rate", type=float, default=0.0, help="ランダム 429 の確率")
+    ap.add_argument("--retry-after", type=float, default=1.0)
+    ap.add_argument("--rpm", type=int, default=0)
+    ap.add_argument("--tpm", type=int, default=0)
+    ap.add_argument("--answer-tokens", type=int, default=40)
+    ap.add_argument("--batch-latency", default="fixed:1.0", help="Batch ジョブの完了までの時間（秒）")
+    ap.add_argument("--seed", type=int, default=0)
+
+
+def config_from_args(args: Any) -> MockConfig:
+    return MockConfig(
+        latency=args.latency, ttft=args.ttft, tokens_per_sec=args.tokens_per_sec,
+        error_rate=args.error_rate, retry_after=args.retry_after,
+        rpm=args.rpm, tpm=args.tpm, answer_tokens=args.answer_tokens,
+        batch_latency=args.batch_latency, seed=args.seed,
+    )
+
+
+if __name__ == "__main__":
+    import argparse
+    ap = argparse.ArgumentParser(description="mock Azure OpenAI server")
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=8089)
+    add_mock_args(ap)
+    args = ap.parse_args()
+    mock = MockAOAI(config_from_args(args))
+    print(f"mock Azure OpenAI listening on {mock.start(args.host, args.port)}  (Ctrl+C で終了)")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        mock.stop()
@@ -0,0 +1,219 @@
+# tools/ratelimit.py
+# ---------------------------------------------
+# クライアント側の事前レート制御（トークンバケット）
+# - キー（エンドポイント＋デプロイ名など）ごとに RPM / TPM の 2 つのバケットを持つ
+# - 送信前に acquire() で待機し、429 を「踏んでから下がる」のではなく手前で抑える
+# - 応答ヘッダ（retry-after / x-ratelimit-remaining-*）から残量とレートを学習
+# - 429 を受けたらレートを 0.8 倍に下げ、成功が続くと設定値まで少しずつ戻す
+# 使い方:
+#   from tools.ratelimit import shared_limiter, estimate_tokens
+#   lim = shared_limiter()
+#   lim.configure(("aoai", ep, deploy), rpm=300, tpm=50000)
+#   lim.acquire(key, tokens=estimate_tokens(messages, max_tokens))
+#   ... 呼び出し ...
+#   lim.observe(key, status_code, headers)
+# ---------------------------------------------
+
+import threading
+import time
+from typing import Any, Dict, Hashable, Iterable, Mapping, Optional, Tuple
+
+# 429 後のレート下限（設定値に対する比率）
+_MIN_RATIO = 0.1
+
+
+class TokenBucket:
+    """1分あたり rate_per_min 補充、最大 capacity 保持するバケット。"""
+
+    def __init__(self, rate_per_min: float, capacity: Optional[float] = None):
+        self.base_rate = float(rate_per_min)
+        self.rate = float(rate_per_min)
+        self.capacity = float(capacity if capacity is not None else rate_per_min)
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        if now > self.updated:
+            self.level = min(self.capacity, self.level + (now - self.updated) * self.rate / 60.0)
+            self.updated = now
+
+    def wait_time(self, amount: float, now: float) -> float:
+        self._refill(now)
+        # 1回で容量を超える要求は満タンまで待てば通す
+        need = min(amount, self.capacity) - self.level
+        if need <= 0 or self.rate <= 0:
+            return 0.0
+        return need * 60.0 / self.rate
+
+    def take(self, amount: float) -> None:
+        self.level -= amount
+
+    def clamp(self, remaining: float, now: float) -> None:
+        """サーバ側の残量がこちらの見積りより少なければ合わせる。"""
+        self._refill(now)
+        self.level = min(self.level, remaining)
+
+    def slow_down(self) -> None:
+        self.rate = max(self.base_rate * _MIN_RATIO, self.rate * 0.8)
+
+    def recover(self) -> None:
+        self.rate = min(self.base_rate, self.rate * 1.02)
+
+
+class _KeyState:
+    def __init__(self) -> None:
+        self.requests: Optional[TokenBucket] = None
+        self.tokens: Optional[TokenBucket] = None
+        self.blocked_until = 0.0
+        self.waited = 0.0
+        self.throttled = 0
+
+
+class RateLimiter:
+    """
+    キーごとの RPM / TPM トークンバケット。スレッドセーフ。
+    rpm / tpm が 0（未設定）のキーは、retry-after による一時停止だけを行う。
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._state: Dict[Hashable, _KeyState] = {}
+
+    def _get(self, key: Hashable) -> _KeyState:
+        st = self._state.get(key)
+        if st is None:
+            st = self._state[key] = _KeyState()
+        return st
+
+    def configure(self, key: Hashable, rpm: float = 0, tpm: float = 0) -> None:
+        with self._lock:
+            st = self._get(key)
+            st.requests = TokenBucket(rpm) if rpm > 0 else None
+            st.tokens = TokenBucket(tpm) if tpm > 0 else None
+
+    def acquire(self, key: Hashable, tokens: float = 0) -> float:
+        """送信枠が空くまで待つ。戻り値は待機した秒数。"""
+        waited = 0.0
+        while True:
+            with self._lock:
+                st = self._get(key)
+                now = time.monotonic()
+                delay = max(0.0, st.blocked_until - now)
+                if st.requests is not None:
+                    delay = max(delay, st.requests.wait_time(1, now))
+                if st.tokens is not None and tokens > 0:
+                    delay = max(delay, st.tokens.wait_time(tokens, now))
+                if delay <= 0:
+                    if st.requests is not None:
+                        st.requests.take(1)
+                    if st.tokens is not None and tokens > 0:
+                        st.tokens.take(tokens)
+                    st.waited += waited
+                    return waited
+            # ロックの外で眠る（他キーの呼び出しを止めない）
+            delay = min(delay, 5.0)
+            time.sleep(delay)
+            waited += delay
+
+    def settle(self, key: Hashable, estimated: float, actual: float) -> None:
+        """見積りトークンと実トークン（usage）の差分をバケットに戻す／追加で引く。"""
+        with self._lock:
+            st = self._get(key)
+            if st.tokens is not None:
+                st.tokens.level = min(st.tokens.capacity, st.tokens.level + (estimated - actual))
+
+    def observe(self, key: Hashable, status: int, headers: Mapping[str, Any]) -> None:
+        """応答ヘッダから残量・待機時間を学習する。"""
+        h = {str(k).lower(): v for k, v in dict(headers or {}).items()}
+        now = time.monotonic()
+        with self._lock:
+            st = self._get(key)
+            # 上限ヘッダがあり未設定ならバケットを自動生成
+            for name, attr in (("requests", "requests"), ("tokens", "tokens")):
+                limit = _num(h.get(f"x-ratelimit-limit-{name}"))
+                if limit and getattr(st, attr) is None:
+                    setattr(st, attr, TokenBucket(limit))
+                remaining = _num(h.get(f"x-ratelimit-remaining-{name}"))
+                bucket = getattr(st, attr)
+                if remaining is not None and bucket is not None:
+                    bucket.clamp(remaining, now)
+                elif remaining == 0:
+                    # 上限不明でも残量 0 と言われたら少し待つ
+                    st.blocked_until = max(st.blocked_until, now + 1.0)
+
+            if status in (429, 503):
+                st.throttled += 1
+                ra = _retry_after(h)
+                if ra is not None:
+                    st.blocked_until = max(st.blocked_until, now + ra)
+                for b in (st.requests, st.tokens):
+                    if b is not None:
+                        b.slow_down()
+            elif 200 <= status < 300:
+                for b in (st.requests, st.tokens):
+                    if b is not None:
+                        b.recover()
+
+    def stats(self) -> Dict[Hashable, Dict[str, float]]:
+        with self._lock:
+            return {
+                k: {
+                    "waited_sec": round(st.waited, 3),
+                    "throttled": st.throttled,
+                    "rpm": st.requests.rate if st.requests else 0.0,
+                    "tpm": st.tokens.rate if st.tokens else 0.0,
+                }
+                for k, st in self._state.items()
+            }
+
+
+def _num(v: Any) -> Optional[float]:
+    if v is None or v == "":
+        return None
+    try:
+        return float(v)
+    except (TypeError, ValueError):
+        return None
+
+
+def _retry_after(h: Mapping[str, Any]) -> Optional[float]:
+    ms = _num(h.get("retry-after-ms"))
+    if ms is not None:
+        return ms / 1000.0
+    return _num(h.get("retry-after"))
+
+
+def estimate_tokens(messages: Iterable[Mapping[str, Any]], max_tokens: int = 0) -> int:
+    """
+    送信前のトークン見積り（Azure の TPM 計上に合わせ max_tokens も加算）。
+    ASCII は 4 文字 ≒ 1 token、それ以外（日本語など）は 1 文字 ≒ 1 token とみなす。
+    """
+    n = 0
+    for m in messages:
+        text = str(m.get("content") or "")
+        ascii_n = sum(1 for ch in text if ord(ch) < 128)
+        n += ascii_n // 4 + (len(text) - ascii_n) + 4
+    return n + int(max_tokens or 0)
+
+
+_shared: Optional[RateLimiter] = None
+_shared_lock = threading.Lock()
+
+
+def shared_limiter() -> RateLimiter:
+    """プロセス内で共有するリミッタ（全呼び出し箇所で同じバケットを使う）。"""
+    global _shared
+    with _shared_lock:
+        if _shared is None:
+            _shared = RateLimiter()
+        return _shared
+
+
+def env_limits(prefix: str, env: Mapping[str, str]) -> Tuple[float, float]:
+    """環境変数 {prefix}_RPM / {prefix}_TPM を読む（未設定・不正値は 0）。"""
+    def f(name: str) -> float:
+        try:
+            return float(env.get(f"{prefix}_{name}", "0") or "0")
+        except ValueError:
+            return 0.0
+    return f("RPM"), f("TPM")